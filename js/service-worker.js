@@ -5,7 +5,7 @@
  */
 
 // 緩存名稱和版本
-const CACHE_NAME = 'chicken-tw-cache-v2';
+const CACHE_NAME = 'chicken-tw-cache-20250417v3';
 
 // 需要緩存的資源
 const CACHE_URLS = [
@@ -5,50 +5,199 @@
  * 此文件提供PWA離線功能支持，包括緩存和後台同步
  */
 
-const CACHE_NAME = 'chicken-shop-v1.5.0';
+// @precache-manifest-start (由版本工具產生，請勿手動修改)
+const PRECACHE_REVISION = "0830f2f7ea";
+const PRECACHE_MANIFEST = [
+  { url: "/", revision: "1429b7f248" },
+  { url: "/_admin_menu.html", revision: "f59625941d" },
+  { url: "/_menu.html", revision: "46888ffe1c" },
+  { url: "/admin.html", revision: "c12f5e8ebf" },
+  { url: "/announce.html", revision: "8562dd2fd2" },
+  { url: "/changelog.html", revision: "eef89d1baf" },
+  { url: "/clockin.html", revision: "8aacb601e0" },
+  { url: "/cram-school-view.html", revision: "5b36f4ba9a" },
+  { url: "/cram-school.html", revision: "d0e465aaab" },
+  { url: "/css/bonus-group.css", revision: "36a9e7f1c9" },
+  { url: "/css/cram-school.css", revision: "93644f1d4f" },
+  { url: "/css/inventory-check.css", revision: "252c660889" },
+  { url: "/css/leave-logic.css", revision: "dbd0d57dc8" },
+  { url: "/css/style.css", revision: "0e6f3e357b" },
+  { url: "/css/styles.css", revision: "b4fb249107" },
+  { url: "/css/version-check.css", revision: "5901c04a28" },
+  { url: "/face-verification-demo.html", revision: "8a2b35b098" },
+  { url: "/index.html", revision: "1429b7f248" },
+  { url: "/js/admin-analysis.js", revision: "a11f987969" },
+  { url: "/js/admin-announcements.js", revision: "d6ded1a1b7" },
+  { url: "/js/admin-bonus-groups.js", revision: "88d2a84980" },
+  { url: "/js/admin-bonus-tasks.js", revision: "09e9e003cd" },
+  { url: "/js/admin-clockin-view.js", revision: "9dc743e989" },
+  { url: "/js/admin-cram-school.js", revision: "6798bebb91" },
+  { url: "/js/admin-employees.js", revision: "7cb99e588c" },
+  { url: "/js/admin-fix.js", revision: "cc67f9c793" },
+  { url: "/js/admin-inventory.js", revision: "05775167bc" },
+  { url: "/js/admin-leave-requests.js", revision: "0b64f87f68" },
+  { url: "/js/admin-logic.js", revision: "3791ae20d7" },
+  { url: "/js/admin-manual-schedule.js", revision: "0e82fcb75b" },
+  { url: "/js/admin-notifications.js", revision: "0c409dec37" },
+  { url: "/js/admin-order-items.js", revision: "26fc01f0d9" },
+  { url: "/js/admin-orders.js", revision: "57e7a578ae" },
+  { url: "/js/admin-parameters.js", revision: "68689f2a6a" },
+  { url: "/js/admin-performance-config.js", revision: "db191d0be1" },
+  { url: "/js/admin-push.js", revision: "346575fba0" },
+  { url: "/js/admin-referendum-settings.js", revision: "68dbc5901f" },
+  { url: "/js/admin-sales-config.js", revision: "ba3e7e1bad" },
+  { url: "/js/admin-sales.js", revision: "b76ba97b4b" },
+  { url: "/js/admin-schedule-config.js", revision: "2bbd4853fc" },
+  { url: "/js/announce-logic.js", revision: "806ca37fe4" },
+  { url: "/js/app-init.js", revision: "1547430f8e" },
+  { url: "/js/auth.js", revision: "846e1264a8" },
+  { url: "/js/bonus-group.js", revision: "62aeeda4f7" },
+  { url: "/js/clockin-logic.js", revision: "17c5b93834" },
+  { url: "/js/clockin-schedule-integration.js", revision: "a3fcf5b402" },
+  { url: "/js/cram-school-view-logic.js", revision: "d372dc1374" },
+  { url: "/js/cram-school.js", revision: "ecaab5cb36" },
+  { url: "/js/face-verification.js", revision: "edcc56ddda" },
+  { url: "/js/firebase-config.js", revision: "54a09c1643" },
+  { url: "/js/fixes.js", revision: "350604c27d" },
+  { url: "/js/headers-fix.js", revision: "716ed80905" },
+  { url: "/js/init-compat.js", revision: "cf49676be3" },
+  { url: "/js/init.js", revision: "6144462ded" },
+  { url: "/js/inventory-check.js", revision: "b8b023a70a" },
+  { url: "/js/knowledge-view-logic.js", revision: "0fef6d12bd" },
+  { url: "/js/leave-logic-fix.js", revision: "6ce935b3e8" },
+  { url: "/js/leave-logic.js", revision: "88a76f10a6" },
+  { url: "/js/main.js", revision: "9f7d56c841" },
+  { url: "/js/module-config.js", revision: "7b63a0dc63" },
+  { url: "/js/modules/auth/index.js", revision: "dd68a0e7f0" },
+  { url: "/js/modules/core/index.js", revision: "a537300c89" },
+  { url: "/js/offline-clockin.js", revision: "52aca6c459" },
+  { url: "/js/order-logic.js", revision: "0d4397e187" },
+  { url: "/js/order.js", revision: "ce31424e66" },
+  { url: "/js/prediction-models.js", revision: "ccd5cf1822" },
+  { url: "/js/referendum-logic.js", revision: "6f758f0444" },
+  { url: "/js/salary-prediction.js", revision: "224b8c5db9" },
+  { url: "/js/salary-stats.js", revision: "a10611e347" },
+  { url: "/js/salary-view-logic.js", revision: "72da604c4c" },
+  { url: "/js/sales-logic.js", revision: "be2b68447a" },
+  { url: "/js/schedule-fix.js", revision: "03dffc42c3" },
+  { url: "/js/schedule-gen-logic.js", revision: "0eed799972" },
+  { url: "/js/schedule-view-logic.js", revision: "2ab20772d8" },
+  { url: "/js/store-list-logic.js", revision: "42190a3592" },
+  { url: "/js/styles-fix.js", revision: "a1ea37a468" },
+  { url: "/js/system-logs-test.js", revision: "be92aa046f" },
+  { url: "/js/version-check.js", revision: "858a8d24cb" },
+  { url: "/js/version-checker.js", revision: "89fc1cbb89" },
+  { url: "/js/version-manager.js", revision: "ded49ca698" },
+  { url: "/js/version-updater.js", revision: "984453ecc5" },
+  { url: "/js/version.js", revision: "e9f38aa25f" },
+  { url: "/knowledge.html", revision: "8266f8ac1b" },
+  { url: "/leave.html", revision: "db193f59b3" },
+  { url: "/manifest.json", revision: "b1ad644c4f" },
+  { url: "/offline.html", revision: "a7dc3880d6" },
+  { url: "/order.html", revision: "01c8caabc9" },
+  { url: "/pending.html", revision: "966279e9ad" },
+  { url: "/referendum.html", revision: "9400317308" },
+  { url: "/register.html", revision: "c47b427496" },
+  { url: "/salary-prediction.html", revision: "f2d040c215" },
+  { url: "/salary-stats.html", revision: "923579b00b" },
+  { url: "/salary-view.html", revision: "883cf700e5" },
+  { url: "/salary.html", revision: "b59a4fbc6e" },
+  { url: "/sales.html", revision: "bc213eec63" },
+  { url: "/schedule-gen.html", revision: "b33bd93bdf" },
+  { url: "/schedule-view.html", revision: "68d14cf961" },
+  { url: "/system-logs-test.html", revision: "7a35c5f1c9" },
+];
+// @precache-manifest-end
+
+// 預緩存名稱帶有清單雜湊，清單變更時才會建立新的緩存
+const PRECACHE_PREFIX = 'chicken-shop-precache-';
+const CACHE_NAME = PRECACHE_PREFIX + PRECACHE_REVISION;
 const DYNAMIC_CACHE = 'chicken-shop-dynamic-v1';
+// 記錄緩存中各項目revision的內部鍵
+const REVISIONS_KEY = '/__precache-revisions.json';
 
-// 需要緩存的資源列表
-const STATIC_ASSETS = [
-  '/',
-  '/index.html',
-  '/clockin.html',
-  '/schedule.html',
-  '/offline.html',
-  '/css/styles.css',
-  '/js/clockin-logic.js',
-  '/js/offline-clockin.js',
-  '/js/face-verification.js',
-  '/js/auth.js',
-  '/js/firebase-config.js',
-  '/js/version.js',
-  '/js/version-checker.js',
+// 外部資源的網址本身帶有版本號，已緩存過就不需重新下載
+const EXTERNAL_ASSETS = [
   'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/css/bootstrap.min.css',
   'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.3/font/bootstrap-icons.css',
   'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0-alpha1/dist/js/bootstrap.bundle.min.js',
   'https://unpkg.com/leaflet@1.9.3/dist/leaflet.css',
-  'https://unpkg.com/leaflet@1.9.3/dist/leaflet.js',
-  '/icons/icon-72x72.png',
-  '/icons/icon-96x96.png',
-  '/icons/icon-128x128.png',
-  '/icons/icon-144x144.png',
-  '/icons/icon-152x152.png',
-  '/icons/icon-192x192.png',
-  '/icons/icon-384x384.png',
-  '/icons/icon-512x512.png'
+  'https://unpkg.com/leaflet@1.9.3/dist/leaflet.js'
 ];
 
+// 從舊的預緩存中找出revision未變的項目，避免重新下載
+async function findReusableResponses() {
+  const reusable = new Map();
+  const wanted = new Map(PRECACHE_MANIFEST.map(entry => [entry.url, entry.revision]));
+  const cacheNames = (await caches.keys())
+    .filter(name => name.startsWith(PRECACHE_PREFIX) && name !== CACHE_NAME);
+  
+  for (const cacheName of cacheNames) {
+    const cache = await caches.open(cacheName);
+    const stored = await cache.match(REVISIONS_KEY);
+    const revisions = stored ? await stored.json() : {};
+    
+    for (const [url, revision] of wanted) {
+      if (!reusable.has(url) && revisions[url] === revision) {
+        const response = await cache.match(url);
+        if (response) reusable.set(url, response);
+      }
+    }
+    for (const url of EXTERNAL_ASSETS) {
+      if (!reusable.has(url)) {
+        const response = await cache.match(url);
+        if (response) reusable.set(url, response);
+      }
+    }
+  }
+  return reusable;
+}
+
+// 只下載內容變更的項目，其餘直接由舊緩存複製
+async function precacheAssets() {
+  const cache = await caches.open(CACHE_NAME);
+  const reusable = await findReusableResponses();
+  let downloaded = 0;
+  
+  await Promise.all(PRECACHE_MANIFEST.map(async entry => {
+    const cached = reusable.get(entry.url);
+    if (cached) {
+      return cache.put(entry.url, cached);
+    }
+    // 同源資源設定為不可變緩存，需略過HTTP緩存才能取得新內容
+    const response = await fetch(new Request(entry.url, { cache: 'reload' }));
+    if (!response.ok) {
+      throw new Error(`預緩存 ${entry.url} 失敗: ${response.status}`);
+    }
+    downloaded++;
+    return cache.put(entry.url, response);
+  }));
+  
+  await Promise.all(EXTERNAL_ASSETS.map(url => {
+    const cached = reusable.get(url);
+    if (cached) {
+      return cache.put(url, cached);
+    }
+    downloaded++;
+    return cache.add(url);
+  }));
+  
+  const revisions = {};
+  PRECACHE_MANIFEST.forEach(entry => { revisions[entry.url] = entry.revision; });
+  await cache.put(REVISIONS_KEY, new Response(JSON.stringify(revisions), {
+    headers: { 'Content-Type': 'application/json' }
+  }));
+  
+  console.log(`[Service Worker] 預緩存完成，下載 ${downloaded} 項，沿用 ${reusable.size} 項`);
+}
+
 // 安裝Service Worker
 self.addEventListener('install', event => {
   console.log('[Service Worker] 安裝中');
   
   // 預緩存靜態資源
   event.waitUntil(
-    caches.open(CACHE_NAME)
-      .then(cache => {
-        console.log('[Service Worker] 預緩存資源');
-        return cache.addAll(STATIC_ASSETS);
-      })
+    precacheAssets()
       .then(() => {
         // 立即接管頁面，無需等待舊的Service Worker終止
         return self.skipWaiting();
@@ -145,24 +294,33 @@ self.addEventListener('fetch', event => {
           .catch(error => {
             console.log('[Service Worker] 獲取資源失敗:', error);
             
-            // 對於圖片請求，可以返回一個佔位圖片
-            if (event.request.url.match(/\.(jpg|jpeg|png|gif|svg)$/)) {
-              return caches.match('/icons/placeholder.png');
-            }
-            
-            // 對於其他類型的請求，可能無法提供適當的回退
-            return new Response('Resource not available offline', {
-              status: 503,
-              statusText: 'Service Unavailable',
-              headers: new Headers({
-                'Content-Type': 'text/plain'
-              })
-            });
+            // 帶 ?v= 的新網址不會命中預緩存 (以不含查詢字串的網址保存，可能是舊版內容)，
+            // 只有離線時才改用預緩存中的版本
+            return caches.open(CACHE_NAME)
+              .then(cache => cache.match(event.request, { ignoreSearch: true }))
+              .then(precached => precached || offlineFallback(event.request));
           });
       })
   );
 });
 
+// 離線且沒有緩存時的回應
+function offlineFallback(request) {
+  // 對於圖片請求，可以返回一個佔位圖片
+  if (request.url.match(/\.(jpg|jpeg|png|gif|svg)$/)) {
+    return caches.match('/icons/placeholder.png');
+  }
+  
+  // 對於其他類型的請求，可能無法提供適當的回退
+  return new Response('Resource not available offline', {
+    status: 503,
+    statusText: 'Service Unavailable',
+    headers: new Headers({
+      'Content-Type': 'text/plain'
+    })
+  });
+}
+
 // 處理後台同步
 self.addEventListener('sync', event => {
   console.log('[Service Worker] 後台同步觸發:', event.tag);
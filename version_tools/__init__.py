@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+雞精補習班版本工具共用模組
+提供各版本更新腳本共用的目錄走訪、部署文件篩選、版本號位置登記檔、掃描引擎、增量索引、並行掃描、原子改寫流程、備份庫、內容雜湊快取破壞、ES 模組引用標記、樣式表引用標記、文件名指紋、預緩存清單、資源引用圖、版本號分佈統計、機器可讀記錄及圖形介面背景工作
+"""
+
+from .scanner import (
+    VERSION_PATTERN,
+    JSON_VERSION_PATTERN,
+    JS_VERSION_PATTERN,
+    DEFAULT_PATTERNS,
+    PatternSpec,
+    VersionMatch,
+    FileScan,
+    LineCounter,
+    VersionScanner,
+)
+from .walker import EXCLUDED_DIRS, walk_files
+from .ignore import IgnoreMatcher
+from .registry import REGISTRY_FILENAME, parse_registry, load_patterns, release_patterns
+from .index import ScanIndex
+from .atomic import RewriteTransaction, atomic_write
+from .backups import BackupStore, file_digest
+from .rewrite import RewriteResult, splice_versions, version_matcher, rewrite_file, consolidate_file, splice_file
+from .parallel import resolve_jobs, iter_scan, iter_file_scans
+from .busting import AssetRef, StampResult, ContentHasher, iter_asset_refs, stamp_page
+from .graph import ReferenceGraph, resolve_reference, since_scope, git_changed_files
+from .stats import VersionStats
+from .records import RECORD_FORMATS, RecordWriter, DeferredRecords
+from .tasks import TaskCancelled, BackgroundTask
+from .modules import ModuleImport, ModuleStamp, ModuleGraph
+from .stylesheets import CssRef, CssStamp, StylesheetGraph
+from .fingerprint import (
+    ASSET_MANIFEST,
+    FingerprintResult,
+    Fingerprinter,
+    FingerprintedPaths,
+    load_asset_manifest,
+    fingerprinted_paths,
+)
+from .precache import PrecacheEntry, build_manifest, render_manifest, inject_manifest
+
+__all__ = [
+    'VERSION_PATTERN',
+    'JSON_VERSION_PATTERN',
+    'JS_VERSION_PATTERN',
+    'DEFAULT_PATTERNS',
+    'PatternSpec',
+    'VersionMatch',
+    'FileScan',
+    'LineCounter',
+    'VersionScanner',
+    'EXCLUDED_DIRS',
+    'walk_files',
+    'IgnoreMatcher',
+    'REGISTRY_FILENAME',
+    'parse_registry',
+    'load_patterns',
+    'release_patterns',
+    'ScanIndex',
+    'RewriteTransaction',
+    'atomic_write',
+    'BackupStore',
+    'file_digest',
+    'RewriteResult',
+    'splice_versions',
+    'version_matcher',
+    'rewrite_file',
+    'consolidate_file',
+    'splice_file',
+    'resolve_jobs',
+    'iter_scan',
+    'iter_file_scans',
+    'AssetRef',
+    'StampResult',
+    'ContentHasher',
+    'iter_asset_refs',
+    'stamp_page',
+    'ReferenceGraph',
+    'resolve_reference',
+    'since_scope',
+    'git_changed_files',
+    'VersionStats',
+    'RECORD_FORMATS',
+    'RecordWriter',
+    'DeferredRecords',
+    'TaskCancelled',
+    'BackgroundTask',
+    'ModuleImport',
+    'ModuleStamp',
+    'ModuleGraph',
+    'CssRef',
+    'CssStamp',
+    'StylesheetGraph',
+    'ASSET_MANIFEST',
+    'FingerprintResult',
+    'Fingerprinter',
+    'FingerprintedPaths',
+    'load_asset_manifest',
+    'fingerprinted_paths',
+    'PrecacheEntry',
+    'build_manifest',
+    'render_manifest',
+    'inject_manifest',
+]
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+原子改寫引擎
+新內容先寫入同目錄的暫存檔，提交時統一 fsync 後再以 rename 原子替換，
+中途當機不會留下寫到一半的文件；備份直接保留舊文件的 inode (硬連結)，
+不需要額外複製一份
+"""
+
+import os
+import shutil
+import tempfile
+
+
+class RewriteTransaction:
+    """批次原子改寫
+
+    stage() 只寫入暫存檔，remove() 只記錄要刪除的文件，commit() 時才依序 fsync 所有暫存檔、
+    保留備份、原子替換 (或刪除) 並 fsync 所屬目錄；同一文件重複 stage / remove 時以最後一次為準。
+    作為 with 區塊使用時，正常結束自動提交，發生例外則捨棄所有暫存檔
+
+    backup 為 True 時以硬連結保留 <文件>.bak；也可傳入 BackupStore，
+    改由內容定址備份庫保存舊內容
+    """
+
+    def __init__(self, backup=True, fsync=True):
+        self.backup = backup
+        self.fsync = fsync
+        self._staged = {}
+        self._removed = set()
+        self._hooks = []
+        self.committed = []
+        self.removed = []
+
+    def stage(self, file_path, data):
+        """將新內容寫入暫存檔，等待提交"""
+        file_path = os.path.abspath(file_path)
+        directory, name = os.path.split(file_path)
+        fd, temp_path = tempfile.mkstemp(prefix=f'.{name}.', suffix='.tmp', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            if os.path.exists(file_path):
+                shutil.copymode(file_path, temp_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+        self._unstage(file_path)
+        self._removed.discard(file_path)
+        self._staged[file_path] = temp_path
+        return temp_path
+
+    def remove(self, file_path):
+        """記錄要刪除的文件，提交時才備份並刪除"""
+        file_path = os.path.abspath(file_path)
+        self._unstage(file_path)
+        self._removed.add(file_path)
+
+    def _unstage(self, file_path):
+        previous = self._staged.pop(file_path, None)
+        if previous is not None:
+            os.unlink(previous)
+
+    def _backup(self, file_path):
+        """保留舊文件，預設以硬連結建立 .bak，檔案系統不支援時才複製"""
+        if self.backup is not True:
+            return self.backup.add(file_path)
+        backup_path = f"{file_path}.bak"
+        if os.path.lexists(backup_path):
+            os.unlink(backup_path)
+        try:
+            os.link(file_path, backup_path)
+        except OSError:
+            shutil.copy2(file_path, backup_path)
+        return backup_path
+
+    def on_commit(self, callback):
+        """登記提交時呼叫的 callback(transaction)
+
+        在所有暫存的改寫替換之後、寫入備份清單之前呼叫，其中再暫存的改寫於同一次提交中替換，
+        舊內容也記錄在同一份備份清單 (例如依改寫後的內容重新產生的清單文件)
+        """
+        self._hooks.append(callback)
+
+    def commit(self):
+        """提交所有暫存的改寫及刪除，回傳已替換的文件路徑 (已刪除的文件記錄於 removed)"""
+        directories = set()
+        try:
+            self._replace(directories)
+            while self._hooks:
+                self._hooks.pop(0)(self)
+                self._replace(directories)
+        finally:
+            if self.fsync:
+                for directory in directories:
+                    _fsync_directory(directory)
+            if self.backup not in (True, False, None):
+                self.backup.close()
+        return self.committed
+
+    def _replace(self, directories):
+        if self.fsync:
+            for temp_path in self._staged.values():
+                _fsync_path(temp_path)
+
+        while self._staged:
+            file_path, temp_path = next(iter(self._staged.items()))
+            if self.backup and os.path.exists(file_path):
+                self._backup(file_path)
+            os.replace(temp_path, file_path)
+            del self._staged[file_path]
+            self.committed.append(file_path)
+            directories.add(os.path.dirname(file_path))
+
+        for file_path in sorted(self._removed):
+            if not os.path.exists(file_path):
+                continue
+            if self.backup:
+                self._backup(file_path)
+            os.unlink(file_path)
+            self.removed.append(file_path)
+            directories.add(os.path.dirname(file_path))
+        self._removed.clear()
+
+    def rollback(self):
+        """捨棄所有尚未提交的暫存檔及刪除"""
+        for temp_path in self._staged.values():
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+        self._staged.clear()
+        self._removed.clear()
+        self._hooks.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+def _fsync_path(file_path):
+    # Windows 需以可寫模式開啟才能刷新緩衝區
+    fd = os.open(file_path, os.O_RDWR | getattr(os, 'O_BINARY', 0))
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _fsync_directory(directory):
+    # 目錄無法在 Windows 上開啟，rename 的持久性由檔案系統負責
+    if os.name == 'nt':
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write(file_path, data, backup=False):
+    """原子寫入單一文件，backup 的意義同 RewriteTransaction"""
+    with RewriteTransaction(backup=backup) as transaction:
+        transaction.stage(file_path, data)
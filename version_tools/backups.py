@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+內容定址備份庫
+被改寫文件的舊內容以 sha256 命名存放於 .version-backups/objects/，
+相同內容跨次執行只保存一份；每次執行另寫一份清單記錄改寫了哪些文件，
+還原時只需處理該次執行改寫過的文件
+"""
+
+import os
+import json
+import shutil
+import hashlib
+from datetime import datetime
+from pathlib import Path
+
+from .atomic import RewriteTransaction, atomic_write
+
+# 預設保留的執行記錄數量
+DEFAULT_KEEP = 20
+
+
+def file_digest(file_path):
+    """計算文件內容的 sha256"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class BackupStore:
+    """工作目錄下的內容定址備份庫
+
+    作為 RewriteTransaction 的 backup 使用：每個文件被替換前呼叫 add()，
+    提交完成後呼叫 close() 寫入本次執行的清單並依保留策略清理舊記錄
+    """
+
+    DIRNAME = '.version-backups'
+
+    def __init__(self, root, keep=DEFAULT_KEEP):
+        self.root = Path(root)
+        self.base = self.root / self.DIRNAME
+        self.objects = self.base / 'objects'
+        self.runs = self.base / 'runs'
+        self.keep = keep
+        self.run_id = None
+        self._files = {}
+
+    def _relpath(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), os.path.abspath(self.root)).replace('\\', '/')
+
+    def add(self, file_path):
+        """保存文件目前的內容，回傳其 sha256"""
+        digest = file_digest(file_path)
+        obj = self.objects / digest
+        if not obj.exists():
+            self.objects.mkdir(parents=True, exist_ok=True)
+            # 舊文件稍後會被整個替換，直接以硬連結接手它的 inode，不需複製
+            try:
+                os.link(file_path, obj)
+            except OSError:
+                shutil.copy2(file_path, obj)
+        self._files[self._relpath(file_path)] = digest
+        return digest
+
+    def close(self):
+        """寫入本次執行的清單，回傳執行編號 (沒有備份任何文件時為 None)"""
+        if not self._files:
+            return None
+        now = datetime.now()
+        self.run_id = now.strftime('%Y%m%d-%H%M%S-%f')
+        manifest = {
+            'run': self.run_id,
+            'created': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'files': self._files,
+        }
+        self.runs.mkdir(parents=True, exist_ok=True)
+        atomic_write(
+            self.runs / f'{self.run_id}.json',
+            json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        )
+        self._files = {}
+        if self.keep:
+            self.prune(self.keep)
+        return self.run_id
+
+    def list_runs(self):
+        """列出所有執行記錄，由新到舊"""
+        if not self.runs.is_dir():
+            return []
+        manifests = []
+        for path in sorted(self.runs.glob('*.json'), reverse=True):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    manifests.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        return manifests
+
+    def _manifest(self, run_id):
+        with open(self.runs / f'{run_id}.json', 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def restore(self, run_id, dry_run=False):
+        """將指定執行改寫過的文件還原為執行前的內容，回傳實際還原的文件"""
+        restored = []
+        with RewriteTransaction(backup=False) as transaction:
+            for rel, digest in self._manifest(run_id)['files'].items():
+                target = self.root / rel
+                if target.exists() and file_digest(target) == digest:
+                    continue
+                if not dry_run:
+                    transaction.stage(target, (self.objects / digest).read_bytes())
+                restored.append(target)
+        return restored
+
+    def prune(self, keep=DEFAULT_KEEP):
+        """只保留最新的 keep 次執行記錄，並刪除不再被引用的備份內容"""
+        manifests = self.list_runs()
+        for manifest in manifests[keep:]:
+            try:
+                (self.runs / f"{manifest['run']}.json").unlink()
+            except OSError:
+                pass
+
+        referenced = set()
+        for manifest in manifests[:keep]:
+            referenced.update(manifest['files'].values())
+
+        removed = 0
+        if self.objects.is_dir():
+            for obj in self.objects.iterdir():
+                if obj.name not in referenced:
+                    try:
+                        obj.unlink()
+                        removed += 1
+                    except OSError:
+                        pass
+        return removed
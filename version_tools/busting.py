@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+內容雜湊快取破壞
+不再把所有 ?v= 改成同一個日期版本號，而是改成各資源文件自己的內容雜湊，
+部署後只有內容真正變更的資源需要重新下載
+"""
+
+import re
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import unquote
+
+from .atomic import atomic_write
+from .backups import file_digest
+from .scanner import LineCounter
+
+# 內容雜湊取前幾個十六進位字元作為版本號
+HASH_LENGTH = 10
+
+# 帶 ?v= 的資源引用 - 第1組為資源網址，第2組為目前的版本號
+ASSET_REF_PATTERN = re.compile(rb'([^\s"\'()<>=?#]+\.[A-Za-z0-9]+)\?v=([0-9A-Za-z]+)')
+
+
+@dataclass(frozen=True)
+class AssetRef:
+    """頁面中對某個資源的 ?v= 引用"""
+    page: object
+    url: str
+    asset: object
+    version: str
+    line: int
+    start: int
+    end: int
+
+
+def resolve_asset(page_path, url, root):
+    """將頁面中的資源網址解析為本機路徑，外部網址或不存在的文件回傳 None"""
+    if url.startswith(('http:', 'https:', '//', 'data:')):
+        return None
+    url = unquote(url)
+    if url.startswith('/'):
+        target = Path(root) / url.lstrip('/')
+    else:
+        target = Path(page_path).parent / url
+    return target if target.is_file() else None
+
+
+def iter_asset_refs(page_path, data, root):
+    """找出頁面內容 (bytes) 中所有帶 ?v= 的資源引用"""
+    if b'?v=' not in data:
+        return
+    lines = LineCounter(data)
+    for match in ASSET_REF_PATTERN.finditer(data):
+        url = match.group(1).decode('utf-8', errors='replace')
+        yield AssetRef(
+            page=page_path,
+            url=url,
+            asset=resolve_asset(page_path, url, root),
+            version=match.group(2).decode('ascii'),
+            line=lines.line_of(match.start()),
+            start=match.start(2),
+            end=match.end(2),
+        )
+
+
+class ContentHasher:
+    """計算並快取資源文件的短內容雜湊"""
+
+    def __init__(self, length=HASH_LENGTH):
+        self.length = length
+        self._cache = {}
+
+    def __call__(self, file_path):
+        key = Path(file_path).resolve()
+        if key not in self._cache:
+            self._cache[key] = file_digest(key)[:self.length]
+        return self._cache[key]
+
+
+@dataclass(frozen=True)
+class StampResult:
+    """單一資源引用的雜湊改寫結果"""
+    ref: AssetRef
+    new_version: str
+
+    @property
+    def changed(self):
+        return self.ref.version != self.new_version
+
+
+def stamp_page(page_path, root, hasher, dry_run=False, transaction=None):
+    """將單一頁面中的 ?v= 改寫為各資源的內容雜湊，回傳 (結果列表, 找不到的資源引用)
+
+    每個頁面只讀取一次、最多寫入一次
+    """
+    with open(page_path, 'rb') as f:
+        data = f.read()
+
+    results = []
+    missing = []
+    for ref in iter_asset_refs(page_path, data, root):
+        if ref.asset is None:
+            missing.append(ref)
+            continue
+        results.append(StampResult(ref, hasher(ref.asset)))
+
+    changed = [r for r in results if r.changed]
+    if changed and not dry_run:
+        parts = []
+        pos = 0
+        for result in changed:
+            parts.append(data[pos:result.ref.start])
+            parts.append(result.new_version.encode('ascii'))
+            pos = result.ref.end
+        parts.append(data[pos:])
+        new_data = b''.join(parts)
+        if transaction is not None:
+            transaction.stage(page_path, new_data)
+        else:
+            atomic_write(page_path, new_data)
+
+    return results, missing
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+文件名內容指紋
+將本地 js/css 資源複製為帶內容雜湊的文件名 (app.<雜湊>.js)，頁面改為引用該文件，
+並產生 asset-manifest.json 記錄原始名稱與指紋名稱的對照；
+網址本身不帶查詢字串，任何快取都能放心以一年 immutable 快取
+"""
+
+import os
+import re
+import json
+import hashlib
+import posixpath
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import unquote
+
+from .atomic import atomic_write
+from .busting import HASH_LENGTH, ContentHasher, resolve_asset
+from .scanner import LineCounter
+
+# 需要加上指紋的資源類型
+FINGERPRINT_SUFFIXES = ('.js', '.css')
+# 原始名稱 → 指紋名稱的對照表 (相對於部署目錄)
+ASSET_MANIFEST = 'asset-manifest.json'
+
+# 頁面中的 src= / href= 屬性 - 第2組為網址
+ATTRIBUTE_PATTERN = re.compile(rb'''\b(?:src|href)\s*=\s*(["'])([^"'<>\s]+)\1''', re.I)
+# 已加上指紋的文件名 - 第1組為原始主檔名，第3組為副檔名
+HASHED_NAME = re.compile(r'^(.+)\.([0-9a-f]{%d})(\.[A-Za-z0-9]+)$' % HASH_LENGTH)
+# 只含版本號的查詢字串，加上指紋後不再需要
+_VERSION_QUERY = re.compile(r'^v=[0-9A-Za-z]+$')
+
+
+@dataclass(frozen=True)
+class FingerprintResult:
+    """頁面中單一資源引用的指紋改寫結果"""
+    page: object
+    line: int
+    url: str
+    new_url: str
+
+    @property
+    def changed(self):
+        return self.url != self.new_url
+
+
+def fingerprint_name(name, digest):
+    """app.js → app.<digest>.js"""
+    stem, dot, suffix = name.rpartition('.')
+    return f"{stem}.{digest}.{suffix}" if dot else f"{name}.{digest}"
+
+
+def load_asset_manifest(root):
+    """讀取部署目錄下的 asset-manifest.json，不存在或格式錯誤時回傳空字典"""
+    try:
+        with open(Path(root) / ASSET_MANIFEST, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return manifest if isinstance(manifest, dict) else {}
+
+
+def unhashed_path(rel):
+    """指紋文件的相對路徑 → 原始資源的相對路徑 (js/app.<雜湊>.js → js/app.js)，文件名不符合時回傳 None"""
+    match = HASHED_NAME.match(posixpath.basename(rel))
+    if match is None:
+        return None
+    return posixpath.join(posixpath.dirname(rel), match.group(1) + match.group(3))
+
+
+class FingerprintedPaths:
+    """判斷相對路徑是否為指紋文件
+
+    除了目前對照表中的指紋文件 (current)，文件名符合指紋格式且原始資源存在的舊指紋文件也算在內，
+    即使對照表已不再記錄它們
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.current = frozenset(load_asset_manifest(self.root).values())
+
+    def stale(self, rel):
+        """不在目前對照表中的舊指紋文件"""
+        if rel in self.current:
+            return False
+        logical = unhashed_path(rel)
+        return logical is not None and (self.root / logical).is_file()
+
+    def __contains__(self, rel):
+        return rel in self.current or self.stale(rel)
+
+
+def fingerprinted_paths(root):
+    """部署目錄中的指紋文件 (FingerprintedPaths)，掃描版本號時應略過這些文件以保持內容不變"""
+    return FingerprintedPaths(root)
+
+
+class Fingerprinter:
+    """計算資源的指紋名稱並改寫頁面引用
+
+    rewrite_page() 逐頁改寫引用，過程中記錄用到的資源；
+    write_assets() 建立指紋文件，remove_superseded() 刪除被取代的舊指紋文件，
+    write_manifest() 寫出新的對照表
+    """
+
+    def __init__(self, root, hasher=None, suffixes=FINGERPRINT_SUFFIXES):
+        self.root = Path(root)
+        self.hasher = hasher or ContentHasher()
+        self.suffixes = tuple(suffixes)
+        self.previous = load_asset_manifest(self.root)
+        self._logical_of = {hashed: logical for logical, hashed in self.previous.items()}
+        self.manifest = {}
+        # 內容在本次執行中被改寫 (尚未寫入磁碟) 的資源，指紋文件以此內容建立
+        self._content = {}
+
+    def _rel(self, path):
+        return Path(path).resolve().relative_to(self.root.resolve()).as_posix()
+
+    def logical(self, target):
+        """將頁面引用的文件 (可能已是指紋文件) 對應回原始資源的相對路徑"""
+        try:
+            rel = self._rel(target)
+        except ValueError:
+            return None
+        if rel in self._logical_of:
+            return self._logical_of[rel]
+        logical = unhashed_path(rel)
+        if logical is not None and (self.root / logical).is_file():
+            return logical
+        return rel
+
+    def hashed(self, logical, data=None):
+        """原始資源的指紋路徑，並記錄到新的對照表
+
+        data 為資源改寫後的內容 (如已標記引用的樣式表)，提供時以此內容計算指紋並建立指紋文件
+        """
+        if logical not in self.manifest:
+            if data is not None:
+                digest = hashlib.sha256(data).hexdigest()[:self.hasher.length]
+                self._content[logical] = data
+            else:
+                digest = self.hasher(self.root / logical)
+            directory, name = posixpath.split(logical)
+            self.manifest[logical] = posixpath.join(directory, fingerprint_name(name, digest))
+        return self.manifest[logical]
+
+    def _new_url(self, page_path, url):
+        path, hash_mark, fragment = url.partition('#')
+        path, question, query = path.partition('?')
+        if not path.lower().endswith(self.suffixes):
+            return None
+        target = resolve_asset(page_path, path, self.root)
+        if target is None:
+            # 指紋文件已被清除時，改以原始名稱解析
+            match = HASHED_NAME.match(posixpath.basename(unquote(path)))
+            if match is None:
+                return None
+            original = posixpath.join(posixpath.dirname(path), match.group(1) + match.group(3))
+            target = resolve_asset(page_path, original, self.root)
+            if target is None:
+                return None
+        logical = self.logical(target)
+        if logical is None:
+            return None
+
+        # 保留網址原本的寫法 (相對或絕對)，只替換文件名
+        new_path = posixpath.join(posixpath.dirname(path), posixpath.basename(self.hashed(logical)))
+        if query and not _VERSION_QUERY.match(query):
+            new_path += question + query
+        return new_path + hash_mark + fragment
+
+    def rewrite_page(self, page_path, dry_run=False, transaction=None):
+        """將單一頁面中本地資源的 src / href 改為指紋網址，回傳每個引用的結果
+
+        每個頁面只讀取一次、最多寫入一次
+        """
+        with open(page_path, 'rb') as f:
+            data = f.read()
+
+        lines = LineCounter(data)
+        results = []
+        parts = []
+        pos = 0
+        for match in ATTRIBUTE_PATTERN.finditer(data):
+            url = match.group(2).decode('utf-8', errors='replace')
+            new_url = self._new_url(page_path, url)
+            if new_url is None:
+                continue
+            result = FingerprintResult(page_path, lines.line_of(match.start()), url, new_url)
+            results.append(result)
+            if result.changed:
+                parts.append(data[pos:match.start(2)])
+                parts.append(new_url.encode('utf-8'))
+                pos = match.end(2)
+
+        if parts and not dry_run:
+            parts.append(data[pos:])
+            new_data = b''.join(parts)
+            if transaction is not None:
+                transaction.stage(page_path, new_data)
+            else:
+                atomic_write(page_path, new_data)
+
+        return results
+
+    def write_assets(self, dry_run=False, transaction=None):
+        """為對照表中的資源建立尚不存在的指紋文件，回傳新建立的 (原始路徑, 指紋路徑)"""
+        created = []
+        for logical, hashed in sorted(self.manifest.items()):
+            target = self.root / hashed
+            if target.is_file():
+                continue
+            created.append((logical, hashed))
+            if dry_run:
+                continue
+            data = self._content.get(logical)
+            if data is None:
+                with open(self.root / logical, 'rb') as f:
+                    data = f.read()
+            if transaction is not None:
+                transaction.stage(target, data)
+            else:
+                atomic_write(target, data)
+        return created
+
+    def _next_manifest(self):
+        """新的對照表：本次引用的資源，加上本次未引用但原始資源仍存在的舊項目"""
+        manifest = {
+            logical: hashed for logical, hashed in self.previous.items()
+            if logical not in self.manifest and (self.root / logical).is_file()
+        }
+        manifest.update(self.manifest)
+        return dict(sorted(manifest.items()))
+
+    def remove_superseded(self, dry_run=False, transaction=None):
+        """刪除不在新對照表中的指紋文件 (資源內容已變更或原始資源已刪除)，回傳被刪除的 (原始路徑, 指紋路徑)
+
+        除了舊對照表記錄的指紋文件，同一目錄中文件名符合指紋格式的舊版本也一併刪除
+        """
+        keep = set(self._next_manifest().values())
+        logicals = set(self.previous) | set(self.manifest)
+        removed = []
+        for directory in sorted({posixpath.dirname(logical) for logical in logicals}):
+            try:
+                entries = list(os.scandir(self.root / directory))
+            except OSError:
+                continue
+            for entry in entries:
+                rel = posixpath.join(directory, entry.name)
+                logical = unhashed_path(rel)
+                if logical in logicals and rel not in keep and entry.is_file():
+                    removed.append((logical, rel))
+        removed.sort()
+
+        if not dry_run:
+            for _, rel in removed:
+                if transaction is not None:
+                    transaction.remove(self.root / rel)
+                else:
+                    os.remove(self.root / rel)
+        return removed
+
+    def write_manifest(self, dry_run=False, transaction=None):
+        """寫出新的 asset-manifest.json (保留本次未引用但仍存在的舊項目)，回傳內容是否有變更"""
+        manifest = self._next_manifest()
+        if manifest == self.previous:
+            return False
+        if not dry_run:
+            data = (json.dumps(manifest, ensure_ascii=False, indent=2) + '\n').encode('utf-8')
+            if transaction is not None:
+                transaction.stage(self.root / ASSET_MANIFEST, data)
+            else:
+                atomic_write(self.root / ASSET_MANIFEST, data)
+        return True
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+頁面與資源的引用圖
+由掃描時擷取的 script/link/import/url() 引用建立 頁面 → 資源 的有向圖，
+可查詢某些文件變更後需要重新加上版本號的頁面，並可直接以 git diff 作為輸入
+"""
+
+import re
+import os
+import posixpath
+import subprocess
+from pathlib import Path
+from urllib.parse import unquote
+
+from .parallel import iter_scan
+
+_SCHEME = re.compile(r'^[A-Za-z][A-Za-z0-9+.-]*:')
+
+# 指向這些文件的引用是頁面間的導覽連結而非載入的資源，不列入引用圖
+NAVIGATION_SUFFIXES = ('.html', '.htm')
+
+
+def _relpath(root, file_path):
+    return os.path.relpath(os.path.abspath(file_path), os.path.abspath(root)).replace('\\', '/')
+
+
+def resolve_reference(page, url):
+    """將頁面 (相對於根目錄的路徑) 中的網址解析為相對於根目錄的路徑
+
+    外部網址、資料網址、超出根目錄、沒有副檔名或指向其他頁面的引用回傳 None
+    """
+    if url.startswith('//') or _SCHEME.match(url) or '${' in url:
+        return None
+    url = unquote(url)
+    if url.startswith('/'):
+        target = posixpath.normpath(url.lstrip('/'))
+    else:
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(page), url))
+    suffix = posixpath.splitext(target)[1].lower()
+    if target.startswith('..') or not suffix or suffix in NAVIGATION_SUFFIXES:
+        return None
+    return target
+
+
+class ReferenceGraph:
+    """頁面 → 資源 的引用圖，節點為相對於根目錄的 POSIX 路徑"""
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self._refs = {}        # 文件 -> 它引用的資源
+        self._dependents = {}  # 資源 -> 引用它的文件
+
+    @classmethod
+    def from_index(cls, index):
+        """由掃描索引中記錄的引用建立引用圖，不需走訪目錄"""
+        graph = cls(index.root)
+        for page, urls in index.references():
+            graph.add(graph.root / page, urls)
+        return graph
+
+    def key(self, file_path):
+        """取得文件在圖中的節點名稱"""
+        return _relpath(self.root, file_path)
+
+    def add(self, file_path, urls):
+        """記錄文件中引用的網址，重複加入同一文件時以最後一次為準"""
+        page = self.key(file_path)
+        self.remove(page)
+        targets = set()
+        for url in urls:
+            target = resolve_reference(page, url)
+            if target is not None and target != page:
+                targets.add(target)
+        self._refs[page] = targets
+        for target in targets:
+            self._dependents.setdefault(target, set()).add(page)
+
+    def remove(self, page):
+        """移除文件的所有引用"""
+        for target in self._refs.pop(page, ()):
+            dependents = self._dependents.get(target)
+            if dependents is not None:
+                dependents.discard(page)
+                if not dependents:
+                    del self._dependents[target]
+
+    def __contains__(self, page):
+        return page in self._refs
+
+    def __len__(self):
+        return len(self._refs)
+
+    def references(self, page):
+        """文件直接引用的資源"""
+        return set(self._refs.get(page, ()))
+
+    def dependents(self, asset):
+        """直接引用該資源的文件"""
+        return set(self._dependents.get(asset, ()))
+
+    def affected(self, changed, transitive=True):
+        """回傳引用了變更文件的所有文件 (不含變更文件本身)
+
+        transitive 為 True 時沿著引用鏈往上追溯，例如模組 a.js import 了 b.js，
+        b.js 變更時引用 a.js 的頁面也會列入
+        """
+        changed = {c if isinstance(c, str) else self.key(c) for c in changed}
+        affected = set()
+        pending = list(changed)
+        while pending:
+            asset = pending.pop()
+            for page in self._dependents.get(asset, ()):
+                if page in affected or page in changed:
+                    continue
+                affected.add(page)
+                if transitive:
+                    pending.append(page)
+        return affected
+
+    def pages_to_restamp(self, changed, transitive=True):
+        """變更文件需要重新加上版本號時，實際需要改寫的文件路徑 (排序後)"""
+        return [self.root / page for page in sorted(self.affected(changed, transitive))]
+
+
+def since_scope(index, since, suffixes, walk=None, jobs=None):
+    """--since 模式的處理範圍，回傳 (變更文件, 需要掃描及改寫的文件)
+
+    引用圖直接由索引取得，只重新掃描變更的文件及索引記錄狀態已改變的文件，不走訪整個目錄；
+    索引為空 (尚未完整掃描過) 時才呼叫 walk() 取得所有文件建立引用圖
+    """
+    root = index.root
+    changed = git_changed_files(root, since)
+
+    if len(index) or walk is None:
+        graph = ReferenceGraph.from_index(index)
+        rescan = []
+        # 建立索引之後才修改 (例如已提交而不在 diff 中) 的文件，其引用也須重新掃描
+        for rel in dict.fromkeys(changed + list(index.outdated())):
+            file_path = root / rel
+            if file_path.is_file() and file_path.suffix in suffixes:
+                rescan.append(file_path)
+            else:
+                graph.remove(rel)
+    else:
+        graph = ReferenceGraph(root)
+        rescan = walk()
+
+    for _ in iter_scan(index.scanner, rescan, index, jobs, graph=graph):
+        pass
+
+    files = [root / rel for rel in changed if rel in graph]
+    files.extend(graph.pages_to_restamp(changed))
+    return changed, list(dict.fromkeys(files))
+
+
+def git_changed_files(root, since='HEAD'):
+    """以 git 取得自 since 以來變更的文件 (含工作區修改及未追蹤的新文件)，
+    回傳相對於 root 的 POSIX 路徑列表；root 不在 git 儲存庫中時拋出 RuntimeError
+    """
+    def run(*args):
+        result = subprocess.run(
+            ['git', '-C', str(root), *args],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.decode('utf-8', errors='replace').strip())
+        return result.stdout.decode('utf-8', errors='surrogateescape')
+
+    # -z 避免非ASCII路徑被加上引號轉義；--relative 讓路徑相對於 root
+    changed = run('diff', '--name-only', '--relative', '-z', since, '--')
+    untracked = run('ls-files', '--others', '--exclude-standard', '-z')
+    paths = [p for p in changed.split('\0') + untracked.split('\0') if p]
+    return list(dict.fromkeys(paths))
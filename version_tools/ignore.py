@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+部署文件篩選
+將 firebase.json 的 hosting.public / hosting.ignore 與 .gitignore 規則編譯成單一正則，
+走訪目錄時被忽略的目錄不會被進入，只處理實際會部署的文件
+"""
+
+import re
+import json
+import posixpath
+from pathlib import Path
+
+
+def translate_glob(glob):
+    """將 glob (支援 **、*、?、[...]) 轉換為比對 POSIX 相對路徑的正則"""
+    out = []
+    i, n = 0, len(glob)
+    while i < n:
+        if glob.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif glob.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif glob[i] == '*':
+            out.append('[^/]*')
+            i += 1
+        elif glob[i] == '?':
+            out.append('[^/]')
+            i += 1
+        elif glob[i] == '[' and glob.find(']', i + 2) != -1:
+            end = glob.find(']', i + 2)
+            body = glob[i + 1:end].replace('\\', '\\\\')
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            out.append(f'[{body}]')
+            i = end + 1
+        else:
+            out.append(re.escape(glob[i]))
+            i += 1
+    return ''.join(out)
+
+
+def _rule(pattern, match_base):
+    """將單一規則轉換為正則，回傳 (正則, 是否為排除例外)；空行及註解回傳 None
+
+    match_base 為 True 時依 .gitignore 語意，不含斜線的規則可匹配任何層級
+    """
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith('#'):
+        return None
+    negate = pattern.startswith('!')
+    if negate:
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+
+    anchored = not match_base or '/' in pattern
+    body = translate_glob(pattern.lstrip('/'))
+    if not anchored:
+        body = '(?:.*/)?' + body
+    # 目錄規則只匹配目錄本身 (以 '/' 結尾查詢) 及其下的所有文件
+    return body + ('/.*' if dir_only else '(?:/.*)?'), negate
+
+
+def _compile(rules):
+    """將規則依序編譯為單一正則，回傳 (正則, 各分組是否為例外規則)
+
+    依 .gitignore 語意最後一條符合的規則決定結果：規則以相反順序排列並各自成為一個分組，
+    交替式正則第一個完整匹配的分支即為最後符合的規則，由 lastindex 得知
+    """
+    rules = [rule for rule in rules if rule[1] is not None]
+    if not rules:
+        return None, ()
+    regex = re.compile('|'.join(f'({prefix}{body})' for prefix, (body, _) in reversed(rules)))
+    return regex, (None,) + tuple(negate for _, (_, negate) in reversed(rules))
+
+
+class IgnoreMatcher:
+    """判斷相對路徑是否為不部署的文件
+
+    hosting.ignore 及 .gitignore 各自合併為一個正則，符合任一來源即為忽略；
+    同一來源內依規則順序由最後一條符合的規則決定 (! 開頭的例外規則可被之後的規則覆蓋)。
+    只讀取根目錄的 .gitignore，子目錄中的 .gitignore 不會被套用
+    """
+
+    def __init__(self, ignore=(), gitignore=(), public='.'):
+        public = posixpath.normpath(public.replace('\\', '/')).strip('/')
+        self.public = '' if public == '.' else public
+
+        # hosting.ignore 相對於 public 目錄，.gitignore 相對於根目錄
+        prefix = re.escape(self.public + '/') if self.public else ''
+        self._sources = [
+            source for source in (
+                _compile([(prefix, _rule(p, False)) for p in ignore]),
+                _compile([('', _rule(p, True)) for p in gitignore]),
+            )
+            if source[0] is not None
+        ]
+
+    @classmethod
+    def from_root(cls, root):
+        """讀取 root 下的 firebase.json 及 .gitignore 建立篩選器，文件不存在時不忽略任何文件"""
+        root = Path(root)
+        ignore = []
+        public = '.'
+        try:
+            with open(root / 'firebase.json', 'r', encoding='utf-8') as f:
+                hosting = json.load(f).get('hosting', {})
+            # 多站台設定時 hosting 為列表，以第一個站台為準
+            if isinstance(hosting, list):
+                hosting = hosting[0] if hosting else {}
+            ignore = hosting.get('ignore', [])
+            public = hosting.get('public', '.')
+        except (OSError, ValueError, AttributeError):
+            pass
+
+        gitignore = []
+        try:
+            with open(root / '.gitignore', 'r', encoding='utf-8') as f:
+                gitignore = f.read().splitlines()
+        except OSError:
+            pass
+
+        return cls(ignore, gitignore, public)
+
+    def ignored(self, rel, is_dir=False):
+        """rel 為相對於根目錄的 POSIX 路徑，is_dir 表示 rel 為目錄"""
+        if self.public and not (rel + '/').startswith(self.public + '/'):
+            # public 目錄以外只需進入通往 public 的上層目錄
+            return not (is_dir and self.public.startswith(rel + '/'))
+        if not self._sources:
+            return False
+        if is_dir:
+            rel += '/'
+        for regex, negations in self._sources:
+            match = regex.fullmatch(rel)
+            if match is not None and not negations[match.lastindex]:
+                return True
+        return False
+
+    __call__ = ignored
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+持久化增量掃描索引
+以 SQLite 保存每個文件的 (mtime, size, 內容雜湊) 及其版本號與資源引用，
+再次掃描時只重新讀取及解析狀態有變的文件；記錄依掃描器的模式指紋分開保存
+"""
+
+import os
+import json
+import time
+import sqlite3
+from pathlib import Path
+
+from .scanner import FileScan, VersionMatch
+
+# 修改時間距今少於此值 (奈秒) 的文件不信任其 mtime，下次仍需比對雜湊
+RACY_WINDOW_NS = 2_000_000_000
+# 同一個索引文件保留記錄的掃描器 (模式集合) 數量
+MAX_SIGNATURES = 4
+
+
+class ScanIndex:
+    """工作目錄下的掃描索引"""
+
+    FILENAME = '.version-scan-index.sqlite'
+
+    def __init__(self, root, scanner, path=None):
+        self.root = Path(root)
+        self.scanner = scanner
+        self.path = Path(path) if path else self.root / self.FILENAME
+        self._entries = {}
+        self._dirty = set()
+        self.hits = 0
+        self.misses = 0
+        self._load()
+
+    def _connect(self):
+        conn = sqlite3.connect(str(self.path))
+        # 每個掃描器 (模式集合) 各自保留記錄，圖形介面與命令列共用同一個文件也不會互相作廢
+        conn.execute(
+            'CREATE TABLE IF NOT EXISTS scans ('
+            'signature TEXT, path TEXT, mtime_ns INTEGER, size INTEGER, '
+            'digest TEXT, matches TEXT, refs TEXT, PRIMARY KEY (signature, path))'
+        )
+        conn.execute('CREATE TABLE IF NOT EXISTS signatures (signature TEXT PRIMARY KEY, used_ns INTEGER)')
+        return conn
+
+    def _load(self):
+        """一次載入目前掃描器的所有索引記錄"""
+        try:
+            conn = self._connect()
+        except sqlite3.Error:
+            return
+        try:
+            with conn:
+                # 舊版格式 (單一掃描器) 的表格
+                conn.execute('DROP TABLE IF EXISTS files')
+                conn.execute('DROP TABLE IF EXISTS meta')
+            rows = conn.execute(
+                'SELECT path, mtime_ns, size, digest, matches, refs FROM scans WHERE signature = ?',
+                (self.scanner.signature,)
+            )
+            for key, mtime_ns, size, digest, matches, refs in rows:
+                self._entries[key] = [mtime_ns, size, digest, matches, refs]
+        except sqlite3.Error:
+            self._entries = {}
+        finally:
+            conn.close()
+
+    def _key(self, file_path):
+        try:
+            rel = os.path.relpath(file_path, self.root)
+        except ValueError:
+            rel = os.path.abspath(file_path)
+        return rel.replace('\\', '/')
+
+    def lookup(self, file_path, st):
+        """文件狀態未變時回傳索引中的 FileScan，否則回傳 None"""
+        entry = self._entries.get(self._key(file_path))
+        if entry is None or entry[0] != st.st_mtime_ns or entry[1] != st.st_size:
+            return None
+        self.hits += 1
+        return self._file_scan(file_path, entry)
+
+    def digest(self, file_path):
+        """索引中記錄的內容雜湊，沒有記錄時回傳 None"""
+        entry = self._entries.get(self._key(file_path))
+        return entry[2] if entry is not None else None
+
+    def revalidate(self, file_path, st):
+        """文件狀態改變但內容雜湊相同時，更新記錄的狀態並回傳索引中的 FileScan"""
+        key = self._key(file_path)
+        entry = self._entries[key]
+        self.hits += 1
+        entry[0] = self._trusted_mtime(st)
+        entry[1] = st.st_size
+        self._dirty.add(key)
+        return self._file_scan(file_path, entry)
+
+    @staticmethod
+    def _trusted_mtime(st):
+        mtime_ns = st.st_mtime_ns
+        if time.time_ns() - mtime_ns < RACY_WINDOW_NS:
+            mtime_ns = 0
+        return mtime_ns
+
+    def _file_scan(self, file_path, entry):
+        return FileScan(
+            file=file_path,
+            digest=entry[2],
+            matches=tuple(
+                VersionMatch(
+                    file=file_path,
+                    version=version,
+                    pattern=self.scanner.specs[kind].regex,
+                    line=line,
+                    start=start,
+                    end=end,
+                    kind=kind,
+                )
+                for version, kind, line, start, end in json.loads(entry[3])
+            ),
+            refs=tuple(json.loads(entry[4])),
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+    def references(self):
+        """產生索引中每個文件的 (相對路徑, 資源網址)，不需讀取或 stat 任何文件"""
+        for key, entry in self._entries.items():
+            yield key, json.loads(entry[4])
+
+    def outdated(self):
+        """以 stat 比對索引中的每個文件，產生狀態已改變或已刪除的文件相對路徑，不需讀取文件內容"""
+        for key, entry in list(self._entries.items()):
+            try:
+                st = os.stat(self.root / key)
+            except OSError:
+                yield key
+                continue
+            if entry[0] != st.st_mtime_ns or entry[1] != st.st_size:
+                yield key
+
+    def files_with(self, kinds):
+        """索引中含有指定種類 (模式名稱) 版本號的文件相對路徑，不需讀取或 stat 任何文件"""
+        kinds = set(kinds)
+        for key, entry in self._entries.items():
+            if any(record[1] in kinds for record in json.loads(entry[3])):
+                yield key
+
+    def store(self, file_path, st, scan):
+        """記錄新的掃描結果，st 須為讀取文件前取得的狀態"""
+        self.misses += 1
+        mtime_ns = self._trusted_mtime(st)
+        records = json.dumps([
+            (m.version, m.kind, m.line, m.start, m.end) for m in scan.matches
+        ])
+        key = self._key(file_path)
+        self._entries[key] = [mtime_ns, st.st_size, scan.digest, records, json.dumps(scan.refs)]
+        self._dirty.add(key)
+
+    def scan_file(self, file_path, specific_version=None, st=None):
+        """掃描單一文件，狀態未變時直接使用索引中的結果"""
+        if st is None:
+            st = os.stat(file_path)
+        scan = self.lookup(file_path, st)
+        if scan is None:
+            scan = self.scanner.scan_path(file_path, self.digest(file_path))
+            if scan is None:
+                scan = self.revalidate(file_path, st)
+            else:
+                self.store(file_path, st, scan)
+        return scan.select(specific_version)
+
+    def save(self):
+        """將變更的記錄寫回磁碟"""
+        try:
+            conn = self._connect()
+        except sqlite3.Error:
+            return
+        try:
+            with conn:
+                signature = self.scanner.signature
+                conn.execute(
+                    'INSERT OR REPLACE INTO signatures VALUES (?, ?)', (signature, time.time_ns())
+                )
+                conn.executemany(
+                    'INSERT OR REPLACE INTO scans VALUES (?, ?, ?, ?, ?, ?, ?)',
+                    [(signature, key, *self._entries[key]) for key in self._dirty]
+                )
+                # 只保留最近使用的幾組模式，登記檔修改後的舊記錄不會無限累積
+                stale = [row[0] for row in conn.execute(
+                    'SELECT signature FROM signatures ORDER BY used_ns DESC LIMIT -1 OFFSET ?',
+                    (MAX_SIGNATURES,)
+                )]
+                for old in stale:
+                    conn.execute('DELETE FROM scans WHERE signature = ?', (old,))
+                    conn.execute('DELETE FROM signatures WHERE signature = ?', (old,))
+            self._dirty.clear()
+        except sqlite3.Error:
+            pass
+        finally:
+            conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.save()
+        return False
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+ES 模組引用版本號
+瀏覽器以完整網址識別模組，只更新頁面上的 ?v= 不會讓已快取的子模組重新下載；
+此模組解析 import / export ... from / import() 的相對路徑，依模組圖由葉節點往上
+以內容雜湊標記每個引用 (子模組變更時所有上層模組的雜湊隨之改變)，
+並在頁面中產生 <link rel="modulepreload"> 讓整個模組圖並行下載
+"""
+
+import os
+import re
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+
+from .atomic import atomic_write
+from .busting import ContentHasher, resolve_asset
+from .scanner import LineCounter
+
+# 視為 ES 模組的副檔名
+MODULE_SUFFIXES = ('.js', '.mjs')
+
+# 靜態 import / export ... from / import '...' 及動態 import('...') - spec 組為模組路徑
+IMPORT_PATTERN = re.compile(
+    rb'''(?:(?P<dynamic>\bimport\s*\(\s*)|\b(?:import|export)\b[^'";()]*?\bfrom\s*|\bimport\s*)'''
+    rb'''(?P<quote>["'])(?P<spec>[^"'\r\n]+)(?P=quote)'''
+)
+# 頁面中的 <script ...> 開始標籤
+SCRIPT_TAG_PATTERN = re.compile(rb'<script\b[^>]*>', re.I)
+_MODULE_TYPE = re.compile(rb'''\btype\s*=\s*["']?module\b''', re.I)
+_SRC_ATTRIBUTE = re.compile(rb'''\bsrc\s*=\s*(["'])([^"'<>\s]+)\1''', re.I)
+# 只含版本號的查詢字串
+_VERSION_QUERY = re.compile(r'^v=[0-9A-Za-z]+$')
+
+PRELOAD_START = '<!-- @modulepreload-start -->'
+PRELOAD_END = '<!-- @modulepreload-end -->'
+_PRELOAD_BLOCK = re.compile(
+    rb'[ \t]*' + re.escape(PRELOAD_START.encode()) + rb'.*?' + re.escape(PRELOAD_END.encode()) + rb'[ \t]*\r?\n?',
+    re.S
+)
+
+
+@dataclass(frozen=True)
+class ModuleImport:
+    """模組中的單一 import 引用，start/end 為模組路徑 (不含引號) 的位元組偏移"""
+    specifier: str
+    target: object
+    dynamic: bool
+    line: int
+    start: int
+    end: int
+
+
+@dataclass(frozen=True)
+class ModuleStamp:
+    """單一模組路徑的改寫結果"""
+    file: object
+    line: int
+    specifier: str
+    new_specifier: str
+
+    @property
+    def changed(self):
+        return self.specifier != self.new_specifier
+
+
+def _split_specifier(specifier):
+    """拆出路徑及版本號查詢字串，帶有其他查詢參數的路徑回傳 None (不改寫)"""
+    path, _, query = specifier.partition('?')
+    if query and not _VERSION_QUERY.match(query):
+        return None
+    return path
+
+
+class ModuleGraph:
+    """ES 模組圖
+
+    revision() 為模組改寫後內容的雜湊：先標記模組引用的所有子模組，再對改寫後的內容計算雜湊，
+    因此任何子模組變更都會傳遞到所有上層模組。循環引用的模組 (同一個強連通分量) 共用一個雜湊，
+    由分量內所有模組的原始內容及分量外子模組的雜湊計算；每個模組因此只有一個網址，
+    瀏覽器不會因網址不同而重複執行同一個模組
+    """
+
+    def __init__(self, root, hasher=None):
+        self.root = Path(root)
+        self.hasher = hasher or ContentHasher()
+        self._parsed = {}
+        self._stamped = {}
+        self._revisions = {}
+        self._components = {}
+
+    def _key(self, path):
+        return Path(path).resolve()
+
+    def imports(self, path):
+        """解析模組中的相對路徑 import，回傳 (原始內容, ModuleImport 列表)"""
+        key = self._key(path)
+        if key not in self._parsed:
+            with open(key, 'rb') as f:
+                data = f.read()
+            imports = []
+            if b'import' in data or b'export' in data:
+                lines = LineCounter(data)
+                for match in IMPORT_PATTERN.finditer(data):
+                    specifier = match.group('spec').decode('utf-8', errors='replace')
+                    # 只處理相對或根目錄路徑，套件名稱 (firebase/auth 等) 由打包工具處理
+                    if not specifier.startswith(('./', '../', '/')) or specifier.startswith('//'):
+                        continue
+                    path_part = _split_specifier(specifier)
+                    if path_part is None or not path_part.endswith(MODULE_SUFFIXES):
+                        continue
+                    target = resolve_asset(key, path_part, self.root)
+                    if target is None:
+                        continue
+                    imports.append(ModuleImport(
+                        specifier=specifier,
+                        target=self._key(target),
+                        dynamic=match.group('dynamic') is not None,
+                        line=lines.line_of(match.start('spec')),
+                        start=match.start('spec'),
+                        end=match.end('spec'),
+                    ))
+            self._parsed[key] = (data, imports)
+        return self._parsed[key]
+
+    def component(self, path):
+        """模組所在的強連通分量 (互相循環引用的模組集合，沒有循環時只含模組本身)"""
+        key = self._key(path)
+        if key not in self._components:
+            self._find_components(key)
+        return self._components[key]
+
+    def _find_components(self, start):
+        """以 Tarjan 演算法 (非遞迴) 找出 start 可到達的所有強連通分量"""
+        index = {start: 0}
+        low = {start: 0}
+        stack = [start]
+        on_stack = {start}
+        work = [(start, iter([ref.target for ref in self.imports(start)[1]]))]
+        while work:
+            node, targets = work[-1]
+            for target in targets:
+                if target in self._components:
+                    continue
+                if target not in index:
+                    index[target] = low[target] = len(index)
+                    stack.append(target)
+                    on_stack.add(target)
+                    work.append((target, iter([ref.target for ref in self.imports(target)[1]])))
+                    break
+                if target in on_stack:
+                    low[node] = min(low[node], index[target])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                if low[node] == index[node]:
+                    members = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(member)
+                        members.append(member)
+                        if member == node:
+                            break
+                    component = frozenset(members)
+                    for member in members:
+                        self._components[member] = component
+
+    def revision(self, path):
+        """模組的內容雜湊 (已包含所有子模組的雜湊)"""
+        key = self._key(path)
+        if key in self._revisions:
+            return self._revisions[key]
+
+        component = self.component(key)
+        data, imports = self.imports(key)
+        if len(component) == 1 and not any(ref.target == key for ref in imports):
+            if imports:
+                new_data, _ = self.stamped(key)
+                revision = hashlib.sha256(new_data).hexdigest()[:self.hasher.length]
+            else:
+                revision = self.hasher(key)
+            self._revisions[key] = revision
+            return revision
+
+        # 循環引用：分量內的模組互相引用時無法先標記子模組，改以整個分量的內容計算共用的雜湊
+        root = self.root.resolve()
+        digest = hashlib.sha256()
+        for member in sorted(component):
+            member_data, member_imports = self.imports(member)
+            # 去除已標記的版本號，重新執行時雜湊不會因上次寫入的標記而改變
+            parts = []
+            pos = 0
+            for ref in member_imports:
+                parts.append(member_data[pos:ref.start])
+                parts.append(_split_specifier(ref.specifier).encode('utf-8'))
+                pos = ref.end
+            parts.append(member_data[pos:])
+            digest.update(member.relative_to(root).as_posix().encode('utf-8') + b'\0' + b''.join(parts) + b'\0')
+            for ref in member_imports:
+                if ref.target not in component:
+                    digest.update(ref.target.relative_to(root).as_posix().encode('utf-8')
+                                  + b'=' + self.revision(ref.target).encode('ascii') + b'\0')
+        revision = digest.hexdigest()[:self.hasher.length]
+        for member in component:
+            self._revisions[member] = revision
+        return revision
+
+    def stamped(self, path):
+        """以子模組的雜湊標記所有 import 路徑，回傳 (新內容, ModuleStamp 列表)，結果會被快取"""
+        key = self._key(path)
+        if key not in self._stamped:
+            self._stamped[key] = self._stamp(key)
+        return self._stamped[key]
+
+    def _stamp(self, key):
+        data, imports = self.imports(key)
+        stamps = []
+        parts = []
+        pos = 0
+        for ref in imports:
+            new_specifier = f"{_split_specifier(ref.specifier)}?v={self.revision(ref.target)}"
+            stamps.append(ModuleStamp(key, ref.line, ref.specifier, new_specifier))
+            parts.append(data[pos:ref.start])
+            parts.append(new_specifier.encode('utf-8'))
+            pos = ref.end
+        parts.append(data[pos:])
+        return b''.join(parts), stamps
+
+    def static_dependencies(self, path):
+        """模組靜態引用的所有子模組 (深度優先、不重複、不含本身)，動態 import() 按需載入故不列入"""
+        seen = {self._key(path)}
+        order = []
+        pending = [self._key(path)]
+        while pending:
+            current = pending.pop()
+            _, imports = self.imports(current)
+            for ref in reversed(imports):
+                if not ref.dynamic and ref.target not in seen:
+                    seen.add(ref.target)
+                    order.append(ref.target)
+                    pending.append(ref.target)
+        return order
+
+    def stamp_module(self, path, dry_run=False, transaction=None):
+        """改寫單一模組中的 import 路徑，回傳 ModuleStamp 列表"""
+        new_data, stamps = self.stamped(path)
+        if any(s.changed for s in stamps) and not dry_run:
+            if transaction is not None:
+                transaction.stage(path, new_data)
+            else:
+                atomic_write(path, new_data)
+        return stamps
+
+    def stamp_page(self, page_path, dry_run=False, transaction=None):
+        """標記頁面中 <script type="module"> 的 src，並更新 modulepreload 區塊
+
+        回傳 (ModuleStamp 列表, 預載的模組網址列表)；每個頁面只讀取一次、最多寫入一次
+        """
+        with open(page_path, 'rb') as f:
+            data = f.read()
+        page_dir = Path(page_path).resolve().parent
+
+        stamps = []
+        preload = []
+        first_entry = None
+        lines = LineCounter(data)
+        parts = []
+        pos = 0
+        for tag in SCRIPT_TAG_PATTERN.finditer(data):
+            if not _MODULE_TYPE.search(tag.group(0)):
+                continue
+            src = _SRC_ATTRIBUTE.search(data, tag.start(), tag.end())
+            if src is None:
+                continue
+            specifier = src.group(2).decode('utf-8', errors='replace')
+            path_part = _split_specifier(specifier)
+            target = resolve_asset(page_path, path_part, self.root) if path_part else None
+            if target is None:
+                continue
+            if first_entry is None:
+                first_entry = tag.start()
+
+            new_specifier = f"{path_part}?v={self.revision(target)}"
+            stamps.append(ModuleStamp(page_path, lines.line_of(tag.start()), specifier, new_specifier))
+            parts.append(data[pos:src.start(2)])
+            parts.append(new_specifier.encode('utf-8'))
+            pos = src.end(2)
+
+            for dependency in self.static_dependencies(target):
+                url = Path(os.path.relpath(dependency, page_dir)).as_posix()
+                hint = f"{url}?v={self.revision(dependency)}"
+                if hint not in preload:
+                    preload.append(hint)
+        parts.append(data[pos:])
+        new_data = b''.join(parts)
+
+        new_data = self._preload_block(new_data, preload, first_entry)
+        if new_data != data and not dry_run:
+            if transaction is not None:
+                transaction.stage(page_path, new_data)
+            else:
+                atomic_write(page_path, new_data)
+        return stamps, preload
+
+    @staticmethod
+    def _preload_block(data, preload, first_entry):
+        """將 modulepreload 區塊放在第一個模組腳本之前，已有區塊時原地替換"""
+        existing = _PRELOAD_BLOCK.search(data)
+        if not preload:
+            return data if existing is None else data[:existing.start()] + data[existing.end():]
+
+        if existing is not None:
+            line_start = existing.start()
+        else:
+            # 改寫 src 不會改變模組腳本之前的內容，原本的偏移仍然有效
+            line_start = data.rfind(b'\n', 0, first_entry) + 1
+        indent = re.match(rb'[ \t]*', data[line_start:]).group(0).decode()
+        newline = '\r\n' if b'\r\n' in data else '\n'
+        block = [indent + PRELOAD_START]
+        block.extend(f'{indent}<link rel="modulepreload" href="{url}">' for url in preload)
+        block.append(indent + PRELOAD_END)
+        block = (newline.join(block) + newline).encode('utf-8')
+
+        if existing is not None:
+            return data[:existing.start()] + block + data[existing.end():]
+        return data[:line_start] + block + data[line_start:]
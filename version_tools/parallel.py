@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+"""
+並行掃描後端
+以批次方式將文件分派給進程池，攤平進程間通訊成本；
+文件數量較少時改用線程池，避免啟動進程的開銷
+"""
+
+import os
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+
+# 每個批次最多包含的文件數
+BATCH_SIZE = 64
+# 待掃描文件少於此數量時使用線程池
+PROCESS_THRESHOLD = 200
+
+# 工作進程內的掃描器，由 _init_worker 設定
+_worker_scanner = None
+
+
+def resolve_jobs(jobs=None):
+    """取得實際的並行數，None 或 0 表示使用所有CPU核心"""
+    if not jobs or jobs < 0:
+        return os.cpu_count() or 1
+    return jobs
+
+
+def _init_worker(scanner):
+    global _worker_scanner
+    _worker_scanner = scanner
+
+
+def _scan_batch(paths, scanner=None):
+    """掃描一個批次的 (文件, 索引中的內容雜湊)，錯誤以字串回傳以便跨進程傳遞
+
+    內容雜湊與索引相同的文件不解析，回傳的 FileScan 為 None
+    """
+    scanner = scanner or _worker_scanner
+    results = []
+    for file_path, known_digest in paths:
+        try:
+            results.append((file_path, scanner.scan_path(file_path, known_digest), None))
+        except Exception as e:
+            results.append((file_path, None, str(e)))
+    return results
+
+
+def _batches(paths, jobs, batch_size):
+    # 讓每個工作者至少分到幾個批次，以平衡負載
+    size = max(1, min(batch_size, -(-len(paths) // (jobs * 4))))
+    return [paths[i:i + size] for i in range(0, len(paths), size)]
+
+
+def _run(scanner, paths, jobs, batch_size):
+    if jobs <= 1 or len(paths) <= 1:
+        yield from _scan_batch(paths, scanner)
+        return
+
+    if len(paths) < PROCESS_THRESHOLD:
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        submit = lambda batch: executor.submit(_scan_batch, batch, scanner)
+    else:
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(scanner,))
+        submit = lambda batch: executor.submit(_scan_batch, batch)
+
+    try:
+        futures = [submit(batch) for batch in _batches(paths, jobs, batch_size)]
+        for future in as_completed(futures):
+            yield from future.result()
+    finally:
+        # 呼叫端提前停止 (例如取消掃描) 時，尚未開始的批次直接取消
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_scan(scanner, files, index=None, jobs=None, specific_version=None, batch_size=BATCH_SIZE,
+              graph=None):
+    """掃描多個文件，逐一產生 (文件路徑, 版本號引用列表, 錯誤訊息)
+
+    提供 index 時，狀態未變的文件直接由索引取得，只有其餘文件會分派給工作者；
+    提供 graph (ReferenceGraph) 時同時記錄每個文件的資源引用；
+    files 可包含 walk_files 產生的 os.DirEntry，結果依完成順序產生
+    """
+    for file_path, scan, error in iter_file_scans(scanner, files, index, jobs, batch_size, graph):
+        yield file_path, scan.select(specific_version) if scan is not None else [], error
+
+
+def iter_file_scans(scanner, files, index=None, jobs=None, batch_size=BATCH_SIZE, graph=None):
+    """與 iter_scan 相同，但產生完整的 (文件路徑, FileScan, 錯誤訊息)，出錯時 FileScan 為 None
+
+    FileScan 帶有掃描時的內容雜湊，改寫時可據此確認偏移量仍然有效
+    """
+    pending = []
+    stats = {}
+    for file_path in files:
+        entry = None
+        if isinstance(file_path, os.DirEntry):
+            # 走訪目錄時取得的 DirEntry 可直接提供 stat，結果一律以 Path 回傳
+            entry, file_path = file_path, Path(file_path.path)
+        if index is not None:
+            try:
+                st = entry.stat() if entry is not None else os.stat(file_path)
+            except OSError as e:
+                yield file_path, None, str(e)
+                continue
+            cached = index.lookup(file_path, st)
+            if cached is not None:
+                if graph is not None:
+                    graph.add(file_path, cached.refs)
+                yield file_path, cached, None
+                continue
+            stats[file_path] = st
+        # 狀態改變的文件交由工作者比對內容雜湊，內容未變時不需重新解析
+        pending.append((file_path, index.digest(file_path) if index is not None else None))
+
+    for file_path, scan, error in _run(scanner, pending, resolve_jobs(jobs), batch_size):
+        if error is not None:
+            yield file_path, None, error
+            continue
+        if scan is None:
+            scan = index.revalidate(file_path, stats[file_path])
+        elif index is not None:
+            index.store(file_path, stats[file_path], scan)
+        if graph is not None:
+            graph.add(file_path, scan.refs)
+        yield file_path, scan, None
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Service Worker 預緩存清單
+掃描部署目錄產生 {url, revision} 清單並注入 service-worker.js，
+revision 為文件的內容雜湊，客戶端安裝新版時只需下載內容變更的項目
+"""
+
+import re
+import json
+import hashlib
+from dataclasses import dataclass
+from pathlib import Path
+from urllib.parse import quote
+
+from .atomic import atomic_write
+from .busting import ContentHasher
+from .fingerprint import fingerprinted_paths
+from .ignore import IgnoreMatcher
+
+# 預設納入預緩存的文件 (相對於部署目錄)
+PRECACHE_GLOBS = ('*.html', 'manifest.json', 'css/**/*.css', 'js/**/*.js', 'icons/**/*')
+# 不納入預緩存的文件名稱 - Service Worker 腳本本身由瀏覽器另行更新
+PRECACHE_EXCLUDE_NAMES = ('service-worker.js',)
+# 不納入預緩存的目錄
+PRECACHE_EXCLUDE_DIRS = ('node_modules',)
+# 指向其他文件的網址，revision 與目標文件相同
+PRECACHE_ALIASES = {'/': 'index.html'}
+
+MANIFEST_START = '// @precache-manifest-start'
+MANIFEST_END = '// @precache-manifest-end'
+_MANIFEST_BLOCK = re.compile(re.escape(MANIFEST_START) + r'.*?' + re.escape(MANIFEST_END), re.S)
+
+
+@dataclass(frozen=True)
+class PrecacheEntry:
+    """預緩存清單中的一個項目"""
+    url: str
+    revision: str
+
+
+def _excluded(rel):
+    if rel.name in PRECACHE_EXCLUDE_NAMES:
+        return True
+    return any(part.startswith('.') or part in PRECACHE_EXCLUDE_DIRS for part in rel.parts)
+
+
+def build_manifest(root, globs=PRECACHE_GLOBS, hasher=None, ignore=None):
+    """掃描部署目錄，回傳依網址排序的預緩存清單
+
+    ignore 為 IgnoreMatcher，未提供時依 root 下的 firebase.json 及 .gitignore 建立；
+    頁面不再引用的舊指紋文件不納入，目前對照表中的指紋文件仍會預緩存
+    """
+    root = Path(root)
+    hasher = hasher or ContentHasher()
+    ignore = ignore or IgnoreMatcher.from_root(root)
+    hashed = fingerprinted_paths(root)
+    revisions = {}
+    for pattern in globs:
+        for file_path in root.glob(pattern):
+            rel = file_path.relative_to(root)
+            if not file_path.is_file() or _excluded(rel) or ignore(rel.as_posix()) or hashed.stale(rel.as_posix()):
+                continue
+            revisions['/' + quote(rel.as_posix())] = hasher(file_path)
+
+    for url, target in PRECACHE_ALIASES.items():
+        if (root / target).is_file():
+            revisions[url] = hasher(root / target)
+
+    return [PrecacheEntry(url, revisions[url]) for url in sorted(revisions)]
+
+
+def manifest_revision(entries, length=10):
+    """整份清單的雜湊，用於命名預緩存"""
+    data = json.dumps([[e.url, e.revision] for e in entries], separators=(',', ':'))
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:length]
+
+
+def render_manifest(entries):
+    """產生注入 service-worker.js 的程式碼區塊"""
+    lines = [
+        f'{MANIFEST_START} (由版本工具產生，請勿手動修改)',
+        f'const PRECACHE_REVISION = {json.dumps(manifest_revision(entries))};',
+        'const PRECACHE_MANIFEST = [',
+    ]
+    for entry in entries:
+        lines.append(f'  {{ url: {json.dumps(entry.url)}, revision: {json.dumps(entry.revision)} }},')
+    lines.append('];')
+    lines.append(MANIFEST_END)
+    return '\n'.join(lines)
+
+
+def inject_manifest(sw_path, entries, dry_run=False, transaction=None):
+    """將預緩存清單寫入 Service Worker 的標記區塊，回傳內容是否有變更"""
+    with open(sw_path, 'rb') as f:
+        content = f.read().decode('utf-8')
+
+    if not _MANIFEST_BLOCK.search(content):
+        raise ValueError(f"{sw_path} 中找不到 {MANIFEST_START} ... {MANIFEST_END} 標記區塊")
+
+    block = render_manifest(entries)
+    new_content = _MANIFEST_BLOCK.sub(lambda m: block, content, count=1)
+    changed = new_content != content
+
+    if changed and not dry_run:
+        data = new_content.encode('utf-8')
+        if transaction is not None:
+            transaction.stage(sw_path, data)
+        else:
+            atomic_write(sw_path, data)
+
+    return changed
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+機器可讀的處理記錄
+命令列以 --format json / ndjson 輸出每個找到的引用及每次改寫，
+每筆記錄產生後立即寫出，部署流程可在掃描仍在進行時就開始處理；
+改寫記錄則在交易提交、文件實際替換後才寫出
+"""
+
+import os
+import sys
+import json
+from pathlib import Path
+
+# 支援的輸出格式，text 為原本的人類可讀輸出
+RECORD_FORMATS = ('text', 'json', 'ndjson')
+
+
+class RecordWriter:
+    """逐筆輸出 JSON 記錄，每筆記錄都帶有 type 欄位
+
+    ndjson 每行一筆記錄；json 輸出一個陣列，元素同樣逐筆寫出並 flush，
+    讀到結尾的 ']' 時才是完整的 JSON 文件。提供 root 時 file 欄位
+    改寫為相對於 root 的 POSIX 路徑
+    """
+
+    def __init__(self, fmt='ndjson', stream=None, root=None):
+        if fmt not in ('json', 'ndjson'):
+            raise ValueError(f"不支援的記錄格式: {fmt}")
+        self.fmt = fmt
+        # 建立時固定輸出目標，之後將 sys.stdout 轉向 stderr 不影響記錄
+        self.stream = stream or sys.stdout
+        self.root = root
+        self.count = 0
+        self.closed = False
+
+    def emit(self, record_type, **fields):
+        """寫出一筆記錄"""
+        if self.root is not None and fields.get('file') is not None:
+            fields['file'] = Path(os.path.relpath(fields['file'], self.root)).as_posix()
+        line = json.dumps({'type': record_type, **fields}, ensure_ascii=False, default=str)
+        if self.fmt == 'json':
+            line = ('[\n' if self.count == 0 else ',\n') + line
+        else:
+            line += '\n'
+        self.stream.write(line)
+        self.stream.flush()
+        self.count += 1
+
+    def close(self):
+        """結束輸出，json 格式補上陣列結尾"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.fmt == 'json':
+            self.stream.write('[]\n' if self.count == 0 else '\n]\n')
+            self.stream.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class DeferredRecords:
+    """暫存記錄，待改寫交易提交 (文件已實際替換) 後才以 flush() 寫出
+
+    改寫先暫存於 RewriteTransaction，提交時才原子替換；在暫存時就輸出 rewrite 記錄，
+    下游 (CDN 清除快取、上傳 Service Worker 等) 可能讀到舊文件，交易還原時更會收到
+    從未發生的改寫。records 為 None 時不輸出任何記錄
+    """
+
+    def __init__(self, records):
+        self.records = records
+        self.pending = []
+
+    def emit(self, record_type, **fields):
+        if self.records is not None:
+            self.pending.append((record_type, fields))
+
+    def flush(self):
+        """交易提交後依序寫出暫存的記錄"""
+        pending, self.pending = self.pending, []
+        for record_type, fields in pending:
+            self.records.emit(record_type, **fields)
+
+    def discard(self):
+        """交易還原時捨棄暫存的記錄"""
+        self.pending = []
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""
+版本號位置登記檔
+以設定檔宣告所有帶版本號的位置 (適用路徑、正則、錨點)，
+全部編譯進同一個掃描器，新增位置不需額外走訪或讀取文件
+"""
+
+import re
+import json
+from pathlib import Path
+
+from .scanner import DEFAULT_PATTERNS, PatternSpec
+
+REGISTRY_FILENAME = '.version-patterns.json'
+
+# 登記檔欄位與 PatternSpec 欄位的對照
+_FIELDS = {
+    'name': 'name',
+    'pattern': 'regex',
+    'version_group': 'version_group',
+    'suffixes': 'suffixes',
+    'paths': 'paths',
+    'anchors': 'anchors',
+    'before': 'before',
+    'after': 'after',
+    'release': 'release',
+}
+_TUPLE_FIELDS = ('suffixes', 'paths', 'anchors')
+
+
+def parse_registry(data):
+    """將登記檔內容 ({"extractors": [...]}) 轉換為 PatternSpec 元組，格式錯誤時拋出 ValueError"""
+    extractors = data.get('extractors') if isinstance(data, dict) else None
+    if not isinstance(extractors, list) or not extractors:
+        raise ValueError("登記檔必須包含非空的 extractors 列表")
+
+    specs = []
+    names = set()
+    for item in extractors:
+        unknown = set(item) - set(_FIELDS)
+        if unknown:
+            raise ValueError(f"未知的欄位: {', '.join(sorted(unknown))}")
+        if 'name' not in item or 'pattern' not in item:
+            raise ValueError("每個 extractor 都必須有 name 及 pattern")
+        if item['name'] in names:
+            raise ValueError(f"重複的 extractor 名稱: {item['name']}")
+        names.add(item['name'])
+
+        kwargs = {}
+        for key, value in item.items():
+            field = _FIELDS[key]
+            kwargs[field] = tuple(value) if field in _TUPLE_FIELDS else value
+        spec = PatternSpec(**kwargs)
+
+        try:
+            groups = re.compile(spec.regex).groups
+        except re.error as e:
+            raise ValueError(f"{spec.name} 的正則無效: {e}")
+        if not 1 <= spec.version_group <= groups:
+            raise ValueError(f"{spec.name} 的 version_group 超出分組數量 ({groups})")
+        specs.append(spec)
+    return tuple(specs)
+
+
+def load_patterns(root='.', path=None):
+    """讀取工作目錄下的登記檔，檔案不存在時回傳 DEFAULT_PATTERNS"""
+    path = Path(path) if path else Path(root) / REGISTRY_FILENAME
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return DEFAULT_PATTERNS
+    return parse_registry(data)
+
+
+def release_patterns(patterns):
+    """取出每次發佈都應改寫的模式"""
+    return tuple(spec for spec in patterns if spec.release)
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+"""
+單次讀寫的版本號改寫流程
+每個文件只讀取一次、在記憶體中一次套用所有替換 (可同時將多個舊版本號合併為新版本號)，最多寫入一次；
+以位元組處理，文件中其他內容 (包括無效的UTF-8序列) 原樣保留
+"""
+
+import re
+import hashlib
+from dataclasses import dataclass
+
+from .atomic import atomic_write
+
+
+@dataclass(frozen=True)
+class RewriteResult:
+    """單一版本號引用的改寫結果"""
+    file: object
+    line: int
+    kind: str
+    old_version: str
+    new_version: str
+    applied: bool
+
+
+def splice_versions(content, matches, new_version):
+    """依照掃描到的位元組位置一次替換所有版本號
+
+    new_version 也可以是 {舊版本號: 新版本號} 對照表，每個引用替換為各自的新版本號
+    """
+    if isinstance(new_version, str):
+        replacement = new_version.encode('ascii')
+        replacements = None
+    else:
+        replacements = {old: new.encode('ascii') for old, new in new_version.items()}
+    parts = []
+    pos = 0
+    for match in sorted(matches, key=lambda m: m.start):
+        parts.append(content[pos:match.start])
+        parts.append(replacement if replacements is None else replacements[match.version])
+        pos = match.end
+    parts.append(content[pos:])
+    return b''.join(parts)
+
+
+def version_matcher(versions):
+    """將多個版本號編譯為單一交替式位元組正則，一次搜尋即可得知文件是否含有其中任何一個
+
+    較長的版本號排在前面 (20250417v12 不會被 20250417v1 搶先匹配)
+    """
+    literals = sorted({v.encode('ascii') for v in versions}, key=lambda v: (-len(v), v))
+    return re.compile(b'|'.join(map(re.escape, literals)))
+
+
+def rewrite_file(file_path, scanner, old_version, new_version, dry_run=False, transaction=None):
+    """掃描並改寫單一文件中的舊版本號，回傳每個引用的改寫結果
+
+    提供 transaction 時新內容只暫存於其中，待提交時才原子替換；
+    否則立即以原子方式寫入
+    """
+    return consolidate_file(file_path, scanner, {old_version: new_version}, dry_run, transaction)
+
+
+def consolidate_file(file_path, scanner, mapping, dry_run=False, transaction=None, matcher=None):
+    """依 {舊版本號: 新版本號} 對照表一次改寫單一文件，回傳每個引用的改寫結果
+
+    不論對照表有多少個舊版本號，文件都只讀取一次、掃描一次、最多寫入一次；
+    matcher 為 version_matcher(mapping) 的結果 (多個文件共用時可預先編譯)，
+    文件中完全沒有任何舊版本號時不需執行版本號模式的掃描
+    """
+    with open(file_path, 'rb') as f:
+        content = f.read()
+
+    if matcher is None:
+        matcher = version_matcher(mapping)
+    if matcher.search(content) is None:
+        return []
+
+    matches = [m for m in scanner.scan_bytes(content, file_path) if m.version in mapping]
+    if not matches:
+        return []
+
+    return _apply(file_path, content, matches, mapping, dry_run, transaction)
+
+
+def splice_file(file_path, matches, new_version, digest, dry_run=False, transaction=None):
+    """依掃描時記錄的位元組偏移直接替換版本號，回傳每個引用的改寫結果
+
+    digest 為掃描時文件內容的 sha256 (FileScan.digest)；內容未變時不執行任何正則，
+    只需一次讀取及一次寫入。內容已變更時偏移量不再可靠，也無法確定使用者選取的是哪一處引用，
+    因此不改寫並拋出 ValueError，須重新掃描
+    """
+    with open(file_path, 'rb') as f:
+        content = f.read()
+
+    if hashlib.sha256(content).hexdigest() != digest:
+        raise ValueError("文件在掃描後已被修改，請重新掃描")
+    if not matches:
+        return []
+
+    mapping = {m.version: new_version for m in matches}
+    return _apply(file_path, content, matches, mapping, dry_run, transaction)
+
+
+def _apply(file_path, content, matches, mapping, dry_run, transaction):
+    """在記憶體中一次替換所有引用並暫存或寫入新內容"""
+    new_content = splice_versions(content, matches, mapping)
+    changed = new_content != content
+
+    if changed and not dry_run:
+        if transaction is not None:
+            transaction.stage(file_path, new_content)
+        else:
+            atomic_write(file_path, new_content)
+
+    return [
+        RewriteResult(
+            file=file_path,
+            line=match.line,
+            kind=match.kind,
+            old_version=match.version,
+            new_version=mapping[match.version],
+            applied=changed,
+        )
+        for match in matches
+    ]
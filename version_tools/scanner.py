@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+"""
+版本號掃描引擎
+將所有版本號模式編譯成單一交替式位元組正則，每個文件只走訪一次；
+文件以 mmap 映射後直接在緩衝區上比對，不解碼也不複製內容，
+偏移量及行號皆以位元組位置計算；無法映射的文件改以固定大小的區塊串流掃描。
+執行正則前先以字面錨點 (如 ?v=、appVersion) 篩選候選區域，
+不含任何錨點的文件只需付出幾次 bytes.find 的成本。
+HTML/JS/CSS 文件同時擷取 script/link/import/url() 引用的資源網址，
+供建立頁面與資源的引用圖
+"""
+
+import re
+import mmap
+import hashlib
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+
+from .ignore import translate_glob
+
+# 串流掃描時每次讀取的位元組數
+CHUNK_SIZE = 1 << 20
+# 相鄰區塊重疊的位元組數，須大於任何單一匹配的長度
+OVERLAP = 4096
+
+# 索引記錄格式版本，偏移量的意義或記錄內容改變時須遞增
+SCAN_FORMAT = 3
+
+_NEWLINE = re.compile(b'\n')
+
+# 版本號正則表達式模式 - 匹配 ?v=YYYYMMDDVN 格式
+VERSION_PATTERN = r'(\?v=)([0-9]{8}v[0-9]+)'
+# 版本號正則表達式模式 - 匹配 "version": "YYYYMMDDVN" 格式
+JSON_VERSION_PATTERN = r'("version"\s*:\s*")([0-9]{8}v[0-9]+)(")'
+# 版本號正則表達式模式 - 匹配 let appVersion = "YYYYMMDDVN" 格式
+JS_VERSION_PATTERN = r'(let\s+appVersion\s*=\s*[\'"])([0-9]{8}v[0-9]+)([\'"])'
+
+# 資源引用正則表達式 - 每個分支只有一個分組，為不含查詢字串的網址
+REFERENCE_PATTERN = re.compile(
+    rb'\b(?:src|href)\s*=\s*["\']([^"\'?#<>\s]+)'         # <script src>、<link href>、元素屬性賦值
+    rb'|\bimport\s*\(\s*["\']([^"\'?#\s]+)'               # 動態 import()
+    rb'|\b(?:import|from)\s+["\']([^"\'?#\s]+)'           # 靜態 import / export ... from
+    rb'|@import\s+(?:url\(\s*)?["\']?([^"\'?#)\s;]+)'     # CSS @import
+    rb'|\burl\(\s*["\']?([^"\'?#)\s]+)'                   # CSS url()
+)
+# 擷取資源引用的副檔名
+REFERENCE_SUFFIXES = ('.html', '.htm', '.js', '.mjs', '.css')
+
+
+@dataclass(frozen=True)
+class PatternSpec:
+    """版本號模式定義
+
+    regex 只能使用無名分組，version_group 為版本號所在的分組編號，
+    suffixes 為適用的副檔名 (None 表示所有文件)，paths 為適用的路徑 glob
+    (如 'js/init.js'、'**/*.json'，比對文件路徑的結尾，None 表示所有文件)；
+    release 表示每次發佈都應改寫為新版本號，不論目前的值為何
+
+    anchors 為每個匹配必定包含的字面字串，用於在執行正則前快速篩選候選區域；
+    匹配起點距錨點不超過 before 個位元組，終點距錨點不超過 after 個位元組。
+    沒有錨點的模式會對整個文件執行正則
+    """
+    name: str
+    regex: str
+    version_group: int = 2
+    suffixes: tuple = None
+    anchors: tuple = ()
+    before: int = 64
+    after: int = 256
+    paths: tuple = None
+    release: bool = False
+
+    def applies_to(self, suffix, file_path=None):
+        if self.suffixes is not None and suffix not in self.suffixes:
+            return False
+        if self.paths is None:
+            return True
+        return file_path is not None and _path_regex(self.paths).search(file_path) is not None
+
+
+@lru_cache(maxsize=None)
+def _path_regex(globs):
+    """將路徑 glob 編譯為比對 POSIX 路徑結尾 (以目錄為界) 的正則"""
+    return re.compile('(?:^|/)(?:' + '|'.join(translate_glob(g.lstrip('/')) for g in globs) + ')$')
+
+
+DEFAULT_PATTERNS = (
+    PatternSpec('query', VERSION_PATTERN, anchors=('?v=',)),
+    PatternSpec('json', JSON_VERSION_PATTERN, suffixes=('.json',), anchors=('"version"',)),
+    PatternSpec('js', JS_VERSION_PATTERN, suffixes=('.js',), anchors=('appVersion',)),
+)
+
+
+@dataclass(frozen=True)
+class VersionMatch:
+    """單一版本號引用，start/end 為版本號的位元組偏移"""
+    file: object
+    version: str
+    pattern: str
+    line: int
+    start: int
+    end: int
+    kind: str
+
+
+@dataclass(frozen=True)
+class FileScan:
+    """單一文件的完整掃描結果，refs 為文件中引用的資源網址 (原始寫法、不重複)"""
+    file: object
+    digest: str
+    matches: tuple
+    refs: tuple = ()
+
+    def select(self, specific_version=None):
+        """取出指定版本 (None 表示全部) 的引用"""
+        if specific_version is None:
+            return list(self.matches)
+        return [m for m in self.matches if m.version == specific_version]
+
+
+class LineCounter:
+    """遞增式行號計算，查詢的偏移量必須遞增
+
+    只計算相鄰兩次查詢之間的換行數，不需為整個文件建立換行索引
+    """
+
+    def __init__(self, buf, offset=0, first_line=1):
+        self._buf = buf
+        self._pos = offset
+        self._line = first_line
+
+    def line_of(self, offset):
+        """取得偏移量所在的行號 (從1開始)"""
+        if offset > self._pos:
+            self._line += len(_NEWLINE.findall(self._buf, self._pos, offset))
+            self._pos = offset
+        return self._line
+
+
+class VersionScanner:
+    """以單一交替式正則掃描所有版本號模式"""
+
+    def __init__(self, patterns=DEFAULT_PATTERNS, references=True):
+        self.patterns = tuple(patterns)
+        self.specs = {spec.name: spec for spec in self.patterns}
+        self.references = references
+        self._compiled = {}
+
+    @property
+    def signature(self):
+        """模式集合的指紋，模式變更時索引需要重建"""
+        key = repr((SCAN_FORMAT, self.patterns, self.references))
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def _applicable(self, file_path):
+        """取得適用於指定文件的模式編號"""
+        if file_path is None:
+            return tuple(i for i, spec in enumerate(self.patterns) if spec.applies_to(''))
+        suffix = Path(file_path).suffix
+        posix = str(file_path).replace('\\', '/')
+        return tuple(i for i, spec in enumerate(self.patterns) if spec.applies_to(suffix, posix))
+
+    def _combined(self, file_path):
+        """取得適用於指定文件的合併位元組正則、分組對照表及錨點
+
+        以適用的模式組合為快取鍵，同一組合只編譯一次；
+        任一適用模式沒有錨點時，錨點為 None，表示必須掃描整個文件
+        """
+        key = self._applicable(file_path)
+        if key not in self._compiled:
+            parts = []
+            groups = {}
+            anchors = []
+            index = 1
+            for spec in (self.patterns[i] for i in key):
+                parts.append(f'({spec.regex})')
+                groups[index] = (spec, index + spec.version_group)
+                index += 1 + re.compile(spec.regex).groups
+                if anchors is not None and spec.anchors:
+                    anchors.extend((a.encode('utf-8'), spec.before, spec.after) for a in spec.anchors)
+                else:
+                    anchors = None
+            regex = re.compile('|'.join(parts).encode('utf-8')) if parts else None
+            self._compiled[key] = (regex, groups, anchors)
+        return self._compiled[key]
+
+    @staticmethod
+    def _candidate_spans(buf, anchors, pos, end):
+        """以字面搜尋找出錨點，回傳合併後的候選區域 [(起點, 終點), ...]"""
+        spans = []
+        for anchor, before, after in anchors:
+            found = buf.find(anchor, pos, end)
+            while found != -1:
+                spans.append((max(found - before, pos), min(found + after, end)))
+                found = buf.find(anchor, found + 1, end)
+        if not spans:
+            return spans
+
+        spans.sort()
+        merged = [list(spans[0])]
+        for start, stop in spans[1:]:
+            if start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], stop)
+            else:
+                merged.append([start, stop])
+        return merged
+
+    def _records(self, buf, file_path, pos=0, limit=None, offset=0, first_line=1):
+        """掃描 buf[pos:]，產生起點在 limit 之前的 VersionMatch
+
+        先以字面錨點篩選候選區域，只在這些小區域內執行完整正則；
+        buf 可以是 bytes 或 mmap，offset 與 first_line 為 buf[0] 在整個文件中的
+        位元組偏移及行號
+        """
+        regex, groups, anchors = self._combined(file_path)
+        if regex is None:
+            return
+        if limit is None:
+            limit = len(buf)
+
+        if anchors is None:
+            spans = [(pos, len(buf))]
+        else:
+            spans = self._candidate_spans(buf, anchors, pos, len(buf))
+
+        lines = LineCounter(buf)
+        resume = pos
+        for span_start, span_end in spans:
+            for match in regex.finditer(buf, max(span_start, resume), span_end):
+                if match.start() >= limit:
+                    return
+                spec, version_group = groups[match.lastindex]
+                resume = match.end()
+                yield VersionMatch(
+                    file=file_path,
+                    version=match.group(version_group).decode('ascii', errors='replace'),
+                    pattern=spec.regex,
+                    line=first_line + lines.line_of(match.start()) - 1,
+                    start=offset + match.start(version_group),
+                    end=offset + match.end(version_group),
+                    kind=spec.name,
+                )
+
+    def _wants_refs(self, file_path):
+        return (self.references and file_path is not None
+                and Path(file_path).suffix.lower() in REFERENCE_SUFFIXES)
+
+    @staticmethod
+    def _references(buf, pos=0, limit=None):
+        """擷取 buf[pos:] 中起點在 limit 之前的資源網址，回傳 (網址列表, 最後一個引用的終點)"""
+        if limit is None:
+            limit = len(buf)
+        refs = []
+        resume = pos
+        for match in REFERENCE_PATTERN.finditer(buf, pos):
+            if match.start() >= limit:
+                break
+            refs.append(match.group(match.lastindex).decode('utf-8', errors='replace'))
+            resume = match.end()
+        return refs, resume
+
+    def scan_bytes(self, buf, file_path=None, specific_version=None):
+        """掃描位元組內容 (bytes 或 mmap)，回傳 VersionMatch 列表"""
+        return [
+            m for m in self._records(buf, file_path)
+            if specific_version is None or m.version == specific_version
+        ]
+
+    def scan_text(self, content, file_path=None, specific_version=None):
+        """掃描文字內容，偏移量以 UTF-8 編碼後的位元組計算"""
+        return self.scan_bytes(content.encode('utf-8'), file_path, specific_version)
+
+    def scan_stream(self, stream, file_path=None):
+        """以固定大小的區塊串流掃描二進位文件物件，回傳 (內容雜湊, VersionMatch 列表)
+
+        相鄰區塊保留 OVERLAP 個位元組的重疊，跨越區塊邊界的版本號仍能找到；
+        記憶體用量與文件大小無關
+        """
+        digest, matches, _ = self._scan_stream(stream, file_path)
+        return digest, matches
+
+    def _scan_stream(self, stream, file_path=None):
+        """串流掃描的實作，另外回傳資源網址列表"""
+        digest = hashlib.sha256()
+        matches = []
+        refs = []
+        wants_refs = self._wants_refs(file_path)
+        buf = b''
+        offset = 0       # buf[0] 在整個文件中的位元組偏移
+        first_line = 1   # buf[0] 所在的行號
+        resume = 0       # 上一個匹配結束的位置，之後的掃描從此開始
+        ref_resume = 0   # 上一個資源引用結束的位置
+
+        while True:
+            data = stream.read(CHUNK_SIZE)
+            final = not data
+            digest.update(data)
+            buf += data
+
+            # 尾端重疊區的匹配留待下一個區塊再判斷
+            limit = len(buf) if final else len(buf) - OVERLAP
+            if limit > 0:
+                pos = max(resume - offset, 0)
+                for match in self._records(buf, file_path, pos, limit, offset, first_line):
+                    matches.append(match)
+                    resume = match.end
+                if wants_refs:
+                    found, end = self._references(buf, max(ref_resume - offset, 0), limit)
+                    if found:
+                        refs.extend(found)
+                        ref_resume = offset + end
+                first_line += buf.count(b'\n', 0, limit)
+                buf = buf[limit:]
+                offset += limit
+
+            if final:
+                return digest.hexdigest(), matches, refs
+
+    def scan_path(self, file_path, known_digest=None):
+        """以 mmap 零複製掃描單一文件，同時計算內容雜湊
+
+        known_digest 為索引中記錄的內容雜湊，內容相同時不解析文件並回傳 None
+        (文件只是被 touch、checkout 或複製過，索引中的結果仍然有效)
+        """
+        with open(file_path, 'rb') as f:
+            try:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, OSError):
+                # 空文件或不支援映射的文件改用串流掃描
+                digest, matches, refs = self._scan_stream(f, file_path)
+            else:
+                with buf:
+                    digest = hashlib.sha256(buf).hexdigest()
+                    if digest == known_digest:
+                        return None
+                    matches = self.scan_bytes(buf, file_path)
+                    refs = self._references(buf)[0] if self._wants_refs(file_path) else []
+        return FileScan(file=file_path, digest=digest, matches=tuple(matches),
+                        refs=tuple(dict.fromkeys(refs)))
+
+    def scan_file(self, file_path, specific_version=None):
+        """讀取並掃描單一文件"""
+        return self.scan_path(file_path).select(specific_version)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+"""
+版本號分佈統計
+掃描時逐個文件累計 版本號 → 文件 → 行號，引用次數隨之計算，
+命令列的分析輸出及圖形介面的分佈檢視都直接讀取，不需再次走訪掃描結果
+"""
+
+from bisect import insort
+
+
+class VersionStats:
+    """版本號 → 文件 → 已排序行號 的彙總，同時記錄每個版本號的引用次數"""
+
+    def __init__(self, matches=()):
+        self._files = {}
+        self._counts = {}
+        self.total = 0
+        self.add(matches)
+
+    def add(self, matches):
+        """加入 VersionMatch；同一文件的引用依偏移順序產生，行號直接附加即保持排序"""
+        for match in matches:
+            lines = self._files.setdefault(match.version, {}).setdefault(str(match.file), [])
+            if not lines or lines[-1] <= match.line:
+                lines.append(match.line)
+            else:
+                insort(lines, match.line)
+            self._counts[match.version] = self._counts.get(match.version, 0) + 1
+            self.total += 1
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __contains__(self, version):
+        return version in self._counts
+
+    def __iter__(self):
+        return iter(self._counts)
+
+    def count(self, version):
+        """版本號的引用次數"""
+        return self._counts.get(version, 0)
+
+    def percentage(self, version):
+        """版本號佔所有引用的百分比"""
+        return self.count(version) * 100 / self.total if self.total else 0.0
+
+    def files(self, version):
+        """版本號出現的文件，回傳 {文件: 已排序行號列表}"""
+        return self._files.get(version, {})
+
+    def file_count(self, version):
+        """版本號出現在幾個文件中"""
+        return len(self._files.get(version, ()))
+
+    def most_common(self, n=None):
+        """依引用次數由多至少回傳 [(版本號, 次數)]，次數相同時依首次出現的順序"""
+        ranked = sorted(self._counts.items(), key=lambda item: item[1], reverse=True)
+        return ranked if n is None else ranked[:n]
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+樣式表引用版本號
+以內容雜湊標記 (或加上指紋) 樣式表中 url() 及 @import 引用的字型、圖片及樣式表；
+被引用的樣式表先標記，其改寫後內容的雜湊再傳遞給引用它的樣式表。
+可選擇將小型的 @import 樣式表直接內嵌，省去首次繪製前逐層下載的等待
+"""
+
+import os
+import re
+import hashlib
+import posixpath
+from dataclasses import dataclass
+from pathlib import Path
+
+from .atomic import atomic_write
+from .busting import ContentHasher, resolve_asset
+from .scanner import LineCounter
+
+# 樣式表中的引用：註解 (略過)、@import 規則、url()
+CSS_REF_PATTERN = re.compile(
+    rb'''(?P<comment>/\*.*?\*/)'''
+    rb'''|(?P<import>@import\s+(?:url\(\s*(?P<q1>["']?)(?P<url1>[^"')\s]+)(?P=q1)\s*\)|(?P<q2>["'])(?P<url2>[^"'\r\n]+)(?P=q2))'''
+    rb'''(?P<condition>[^;]*);[ \t]*(?:\r?\n)?)'''
+    rb'''|url\(\s*(?P<q3>["']?)(?P<url3>[^"')\s]+)(?P=q3)\s*\)''',
+    re.S | re.I
+)
+_CHARSET_RULE = re.compile(rb'^\s*@charset\s+[^;]*;\s*', re.I)
+# 只含版本號的查詢字串
+_VERSION_QUERY = re.compile(r'^v=[0-9A-Za-z]+$')
+
+# 內嵌的 @import 以標記包圍並保留原本的規則，重新執行時先還原再重新內嵌
+INLINE_START = '/* @inline-start '
+INLINE_END = '/* @inline-end */'
+_INLINE_BLOCK = re.compile(
+    re.escape(INLINE_START.encode()) + rb'(?P<rule>.*?) \*/\r?\n.*?' + re.escape(INLINE_END.encode()) + rb'(?P<eol>\r?\n)?',
+    re.S
+)
+
+
+@dataclass(frozen=True)
+class CssRef:
+    """樣式表中的單一引用，start/end 為網址的位元組偏移，rule_start/rule_end 為整條 @import 規則"""
+    url: str
+    target: object
+    is_import: bool
+    condition: str
+    line: int
+    start: int
+    end: int
+    rule_start: int
+    rule_end: int
+
+
+@dataclass(frozen=True)
+class CssStamp:
+    """單一引用的改寫結果，inlined 表示 @import 已改為內嵌，block_changed 表示內嵌的內容與磁碟上的不同"""
+    file: object
+    line: int
+    url: str
+    new_url: str
+    inlined: bool = False
+    block_changed: bool = False
+
+    @property
+    def changed(self):
+        return self.block_changed or self.url != self.new_url
+
+
+def _split_url(url):
+    """拆出 (路徑, 查詢字串, 片段)；帶有版本號以外查詢參數的網址回傳 None (不改寫)"""
+    path, hash_mark, fragment = url.partition('#')
+    path, _, query = path.partition('?')
+    if query and not _VERSION_QUERY.match(query):
+        return None
+    return path, hash_mark + fragment
+
+
+class StylesheetGraph:
+    """樣式表引用圖
+
+    revision() 為樣式表改寫後內容的雜湊，其他資源為內容雜湊；提供 fingerprinter 時
+    引用改為指紋文件名而不是 ?v=。inline_limit 大於 0 時，樣式表中所有 @import
+    (無媒體條件、目標不超過 inline_limit 位元組且本身沒有 @import) 都會被內嵌
+    """
+
+    def __init__(self, root, hasher=None, fingerprinter=None, inline_limit=0):
+        self.root = Path(root)
+        self.hasher = hasher or ContentHasher()
+        self.fingerprinter = fingerprinter
+        self.inline_limit = inline_limit
+        self._parsed = {}
+        # 樣式表中已內嵌的區塊 {原本的 @import 規則: 磁碟上的整個區塊}
+        self._blocks = {}
+        self._stamped = {}
+        self._revisions = {}
+        self._visiting = set()
+
+    def _key(self, path):
+        return Path(path).resolve()
+
+    def refs(self, path):
+        """解析樣式表 (先還原已內嵌的 @import)，回傳 (磁碟內容, 還原後內容, CssRef 列表)"""
+        key = self._key(path)
+        if key not in self._parsed:
+            with open(key, 'rb') as f:
+                raw = f.read()
+            blocks = self._blocks[key] = {}
+
+            def revert(m):
+                blocks[m.group('rule')] = m.group(0)
+                return m.group('rule') + b';' + (m.group('eol') or b'')
+
+            data = _INLINE_BLOCK.sub(revert, raw)
+            refs = []
+            lines = LineCounter(data)
+            for match in CSS_REF_PATTERN.finditer(data):
+                if match.group('comment'):
+                    continue
+                group = next(g for g in ('url1', 'url2', 'url3') if match.group(g))
+                url = match.group(group).decode('utf-8', errors='replace')
+                parts = _split_url(url)
+                if parts is None or url.startswith(('data:', 'http:', 'https:', '//', '#')):
+                    continue
+                target = resolve_asset(key, parts[0], self.root)
+                if target is None:
+                    continue
+                is_import = match.group('import') is not None
+                refs.append(CssRef(
+                    url=url,
+                    target=self._key(target),
+                    is_import=is_import,
+                    condition=match.group('condition').strip().decode('utf-8', errors='replace') if is_import else '',
+                    line=lines.line_of(match.start()),
+                    start=match.start(group),
+                    end=match.end(group),
+                    rule_start=match.start(),
+                    rule_end=match.end(),
+                ))
+            self._parsed[key] = (raw, data, refs)
+        return self._parsed[key]
+
+    def revision(self, path):
+        """資源的內容雜湊，樣式表為標記引用後的內容雜湊"""
+        key = self._key(path)
+        if key.suffix.lower() != '.css':
+            return self.hasher(key)
+        if key in self._revisions:
+            return self._revisions[key]
+        if key in self._visiting:
+            # 循環引用：以磁碟上的內容代替，避免無限遞迴
+            return self.hasher(key)
+
+        self._visiting.add(key)
+        try:
+            new_data, _ = self.stamped(key)
+            revision = hashlib.sha256(new_data).hexdigest()[:self.hasher.length]
+        finally:
+            self._visiting.discard(key)
+        self._revisions[key] = revision
+        return revision
+
+    def _asset_path(self, target):
+        """引用目標改寫後的文件路徑 (加上指紋時為指紋文件) 及查詢字串"""
+        if self.fingerprinter is None:
+            return target, f"?v={self.revision(target)}"
+        # 已是指紋文件時改以原始資源為準
+        logical = self.fingerprinter.logical(target)
+        source = self.root / logical
+        data = self.stamped(source)[0] if source.suffix.lower() == '.css' else None
+        return self.root / self.fingerprinter.hashed(logical, data), ''
+
+    def _new_url(self, ref, base=None):
+        """改寫後的網址；base 為內嵌時所在樣式表的目錄，相對路徑須改以其為基準"""
+        path, fragment = _split_url(ref.url)
+        asset, query = self._asset_path(ref.target)
+        if base is not None and not path.startswith('/'):
+            path = Path(os.path.relpath(asset, base)).as_posix()
+        else:
+            # 保留網址原本的寫法，只替換文件名
+            path = posixpath.join(posixpath.dirname(path), asset.name)
+        return path + query + fragment
+
+    def _inlinable(self, key, ref):
+        if not ref.is_import or ref.condition or ref.target == key or ref.target.suffix.lower() != '.css':
+            return False
+        if ref.target.stat().st_size > self.inline_limit:
+            return False
+        return not any(r.is_import for r in self.refs(ref.target)[2])
+
+    def stamped(self, path):
+        """標記樣式表中的所有引用，回傳 (新內容, CssStamp 列表)，結果會被快取"""
+        key = self._key(path)
+        if key not in self._stamped:
+            self._stamped[key] = self._stamp(key)
+        return self._stamped[key]
+
+    def _stamp(self, key, base=None):
+        _, data, refs = self.refs(key)
+        imports = [r for r in refs if r.is_import]
+        # @import 必須位於其他規則之前，只有全部都能內嵌時才內嵌
+        inline = base is None and self.inline_limit > 0 and imports and all(
+            self._inlinable(key, r) for r in imports
+        )
+
+        stamps = []
+        parts = []
+        pos = 0
+        for ref in refs:
+            if inline and ref.is_import:
+                rule = data[ref.rule_start:ref.rule_end].rstrip().rstrip(b';')
+                content = _CHARSET_RULE.sub(b'', self._stamp(ref.target, base=key.parent)[0])
+                if not content.endswith(b'\n'):
+                    content += b'\n'
+                block = INLINE_START.encode() + rule + b' */\n' + content + INLINE_END.encode() + b'\n'
+                parts.append(data[pos:ref.rule_start])
+                parts.append(block)
+                pos = ref.rule_end
+                changed = self._blocks[key].get(rule) != block
+                stamps.append(CssStamp(key, ref.line, ref.url, ref.url, inlined=True, block_changed=changed))
+                continue
+            new_url = self._new_url(ref, base)
+            stamps.append(CssStamp(key, ref.line, ref.url, new_url))
+            parts.append(data[pos:ref.start])
+            parts.append(new_url.encode('utf-8'))
+            pos = ref.end
+        parts.append(data[pos:])
+        return b''.join(parts), stamps
+
+    def fingerprint_sheet(self, path):
+        """加上指紋模式：原始樣式表保持不變，改寫後的內容寫入指紋文件
+
+        回傳 (指紋文件的相對路徑, CssStamp 列表)；指紋文件由 fingerprinter.write_assets() 建立
+        """
+        logical = self.fingerprinter.logical(path)
+        new_data, stamps = self.stamped(self.root / logical)
+        return self.fingerprinter.hashed(logical, new_data), stamps
+
+    def stamp_sheet(self, path, dry_run=False, transaction=None):
+        """改寫單一樣式表，回傳 CssStamp 列表；每個樣式表只讀取一次、最多寫入一次"""
+        raw = self.refs(path)[0]
+        new_data, stamps = self.stamped(path)
+        if new_data != raw and not dry_run:
+            if transaction is not None:
+                transaction.stage(path, new_data)
+            else:
+                atomic_write(path, new_data)
+        return stamps
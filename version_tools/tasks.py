@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+圖形介面的背景工作
+耗時的掃描及改寫在背景執行緒中進行，進度訊息經由佇列交回 Tk 主執行緒，
+主執行緒以 root.after 定時輪詢，每次只處理一小段時間，介面保持流暢
+"""
+
+import time
+import queue
+import threading
+
+
+class TaskCancelled(Exception):
+    """背景工作已被取消"""
+
+
+class BackgroundTask:
+    """在背景執行緒執行 work(task)，並在 Tk 主執行緒分派其訊息
+
+    work 以 task.post(種類, 資料) 回報進度，並應定期呼叫 task.check_cancelled()；
+    handlers 為 {種類: 處理函式}，在主執行緒中呼叫。工作結束後以
+    on_done(狀態, 結果) 通知，狀態為 'done'、'cancelled' 或 'error' (結果為例外)
+    """
+
+    # 輪詢間隔 (毫秒) 及每次輪詢最多佔用的時間 (秒)，約為一個畫面的時間
+    POLL_MS = 16
+    FRAME_BUDGET = 0.008
+
+    def __init__(self, root, work, handlers=None, on_done=None):
+        self.root = root
+        self.work = work
+        self.handlers = handlers or {}
+        self.on_done = on_done
+        self.queue = queue.Queue()
+        self._cancel = threading.Event()
+        self._thread = None
+        self.running = False
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        self.root.after(self.POLL_MS, self._poll)
+        return self
+
+    def post(self, kind, payload=None):
+        """由背景執行緒送出訊息"""
+        self.queue.put((kind, payload))
+
+    def cancel(self):
+        """要求取消，工作會在下一次 check_cancelled() 時停止"""
+        self._cancel.set()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def check_cancelled(self):
+        if self._cancel.is_set():
+            raise TaskCancelled()
+
+    def _run(self):
+        try:
+            result = self.work(self)
+        except TaskCancelled:
+            self.queue.put((None, ('cancelled', None)))
+        except Exception as e:
+            self.queue.put((None, ('error', e)))
+        else:
+            self.queue.put((None, ('cancelled' if self.cancelled else 'done', result)))
+
+    def _poll(self):
+        deadline = time.perf_counter() + self.FRAME_BUDGET
+        while time.perf_counter() < deadline:
+            try:
+                kind, payload = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if kind is None:
+                self.running = False
+                if self.on_done is not None:
+                    self.on_done(*payload)
+                return
+            handler = self.handlers.get(kind)
+            if handler is not None:
+                handler(payload)
+        self.root.after(self.POLL_MS, self._poll)
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+"""
+目錄走訪
+以 os.scandir 單次走訪同時比對所有副檔名，排除的目錄在進入前就略過；
+產生的 os.DirEntry 已帶有目錄列表取得的資訊，掃描索引可直接使用其 stat 結果
+"""
+
+import os
+
+# 預設不進入的目錄
+EXCLUDED_DIRS = frozenset(('node_modules', '.git', 'dist', 'build'))
+
+
+def walk_files(root, suffixes, excluded_dirs=EXCLUDED_DIRS, ignore=None):
+    """走訪 root 下副檔名符合 suffixes 的所有文件，逐一產生 os.DirEntry
+
+    suffixes 為副檔名元組 (如 ('.html', '.js'))；名稱在 excluded_dirs 中的目錄
+    不會被進入；符號連結的目錄不跟隨，避免循環。
+    ignore 為 IgnoreMatcher (或任何接受 (相對路徑, 是否為目錄) 的函式)，
+    被忽略的目錄同樣不會被進入
+    """
+    suffixes = tuple(suffixes)
+    pending = [(os.fspath(root), '')]
+    while pending:
+        directory, prefix = pending.pop()
+        try:
+            entries = os.scandir(directory)
+        except OSError:
+            continue
+        subdirs = []
+        with entries:
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        if entry.name in excluded_dirs:
+                            continue
+                        rel = prefix + entry.name
+                        if ignore is None or not ignore(rel, True):
+                            subdirs.append((entry.path, rel + '/'))
+                    elif entry.name.endswith(suffixes) and entry.is_file():
+                        if ignore is None or not ignore(prefix + entry.name):
+                            yield entry
+                except OSError:
+                    continue
+        # 反向壓入，使子目錄依列出順序走訪
+        pending.extend(reversed(subdirs))
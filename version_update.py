@@ -11,201 +11,536 @@
 """
 
 import os
-import re
 import sys
 import json
 import argparse
-import shutil
+import contextlib
 from pathlib import Path
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
 
-# 版本號正則表達式模式 - 匹配 ?v=YYYYMMDDVN 格式
-VERSION_PATTERN = r'(\?v=)([0-9]{8}v[0-9]+)'
-# 版本號正則表達式模式 - 匹配 "version": "YYYYMMDDVN" 格式
-JSON_VERSION_PATTERN = r'("version"\s*:\s*")([0-9]{8}v[0-9]+)(")'
-# 版本號正則表達式模式 - 匹配 let appVersion = "YYYYMMDDVN" 格式
-JS_VERSION_PATTERN = r'(let\s+appVersion\s*=\s*[\'"])([0-9]{8}v[0-9]+)([\'"])'
+from version_tools import (
+    VERSION_PATTERN,
+    JSON_VERSION_PATTERN,
+    JS_VERSION_PATTERN,
+    VersionScanner,
+    ScanIndex,
+    splice_file,
+    iter_file_scans,
+    RewriteTransaction,
+    atomic_write,
+    BackupStore,
+    ContentHasher,
+    stamp_page,
+    build_manifest,
+    inject_manifest,
+    ReferenceGraph,
+    since_scope,
+    EXCLUDED_DIRS,
+    walk_files,
+    IgnoreMatcher,
+    load_patterns,
+    BackgroundTask,
+    VersionStats,
+    RECORD_FORMATS,
+    RecordWriter,
+    DeferredRecords,
+    ModuleGraph,
+    StylesheetGraph,
+    Fingerprinter,
+    fingerprinted_paths,
+)
+from version_tools.backups import DEFAULT_KEEP
 
 class VersionUpdater:
-    def __init__(self, working_dir='.'):
+    def __init__(self, working_dir='.', use_index=True, jobs=None, keep_backups=DEFAULT_KEEP, use_ignore=True):
         self.working_dir = Path(working_dir)
         self.log_messages = []
         self.file_types = ['.html', '.js', '.css']
         self.update_count = 0
         self.file_count = 0
+        self._scanner = None
+        self.use_index = use_index
+        self.jobs = jobs
+        self.keep_backups = keep_backups
+        self.use_ignore = use_ignore
+        # 額外接收日誌的函式 (GUI 的背景工作經由佇列轉交主執行緒)
+        self.listener = None
+        # 機器可讀的處理記錄 (RecordWriter)，未設定時只輸出日誌
+        self.records = None
+        # 交易進行中暫存的改寫記錄 (DeferredRecords)
+        self._deferred = None
+        # 含有預緩存清單標記區塊的 Service Worker，任何改寫提交時一併重新產生清單
+        self.precache_sw = 'service-worker.js'
     
     def log(self, message):
         """添加日誌消息"""
         print(message)
         self.log_messages.append(message)
+        if self.listener is not None:
+            self.listener(message)
+    
+    def emit(self, record_type, **fields):
+        """輸出一筆處理記錄，未設定 records 時不做任何事"""
+        if self.records is not None:
+            self.records.emit(record_type, **fields)
+    
+    def emit_committed(self, record_type, **fields):
+        """輸出描述改寫的記錄；位於 transaction() 之中時待交易提交後才輸出"""
+        target = self._deferred if self._deferred is not None else self
+        target.emit(record_type, **fields)
+    
+    @contextlib.contextmanager
+    def transaction(self):
+        """開啟改寫交易，舊內容保存於備份庫；期間的改寫記錄在提交成功後才輸出，還原時捨棄
+
+        有文件被改寫時，Service Worker 的預緩存清單在同一次提交中依改寫後的內容重新產生
+        """
+        deferred = self._deferred = DeferredRecords(self.records)
+        try:
+            with RewriteTransaction(backup=self.backup_store()) as transaction:
+                transaction.on_commit(self._refresh_precache)
+                yield transaction
+        except BaseException:
+            deferred.discard()
+            raise
+        finally:
+            self._deferred = None
+        deferred.flush()
+    
+    def _refresh_precache(self, transaction):
+        """交易提交時呼叫：文件已替換，依磁碟上的新內容重新產生預緩存清單並暫存於同一交易"""
+        sw_path = self.working_dir / self.precache_sw
+        if not (transaction.committed or transaction.removed) or os.path.abspath(sw_path) in transaction.committed:
+            return
+        if not sw_path.is_file():
+            return
+        try:
+            entries = build_manifest(self.working_dir)
+            changed = inject_manifest(sw_path, entries, transaction=transaction)
+        except ValueError:
+            # 沒有預緩存清單標記區塊的 Service Worker 不使用預緩存
+            return
+        except Exception as e:
+            self.log(f"更新預緩存清單時出錯: {str(e)}")
+            return
+        if changed:
+            self.log(f"已更新 {sw_path} 的預緩存清單，共 {len(entries)} 項")
+            self.emit_committed('precache', file=sw_path, entries=len(entries), changed=changed, dry_run=False)
+    
+    def _emit_references(self, done, total, matches):
+        for match in matches:
+            self.emit('reference', file=match.file, line=match.line, version=match.version, kind=match.kind)
+    
+    @property
+    def scanner(self):
+        """依工作目錄下的版本號位置登記檔建立的掃描器，工作目錄變更時重新讀取"""
+        if self._scanner is None or self._scanner[0] != self.working_dir:
+            self._scanner = (self.working_dir, VersionScanner(load_patterns(self.working_dir)))
+        return self._scanner[1]
+    
+    def ignore_matcher(self):
+        """取得依 firebase.json 及 .gitignore 篩選部署文件的規則，停用時回傳 None"""
+        return IgnoreMatcher.from_root(self.working_dir) if self.use_ignore else None
     
     def scan_files(self):
-        """掃描所有HTML、JS和CSS文件"""
-        result = []
+        """掃描所有會部署的HTML、JS和CSS文件，回傳 os.DirEntry 列表 (可直接提供 stat 給掃描索引)"""
         self.log(f"正在掃描目錄: {self.working_dir}")
         
-        for file_type in self.file_types:
-            for file_path in self.working_dir.glob(f'**/*{file_type}'):
-                if not self._is_excluded(file_path):
-                    result.append(file_path)
+        # 單次走訪比對所有副檔名，node_modules、.git 及不部署的目錄不會被進入
+        result = list(walk_files(self.working_dir, self.file_types, EXCLUDED_DIRS, self.ignore_matcher()))
+        
+        # 指紋文件的內容必須與文件名中的雜湊一致，不改寫其中的版本號
+        hashed = fingerprinted_paths(self.working_dir)
+        result = [entry for entry in result if not self._is_excluded(entry.path, hashed=hashed)]
         
         self.log(f"找到 {len(result)} 個文件")
         return result
     
-    def _is_excluded(self, file_path):
-        """檢查文件是否應該被排除"""
-        # 排除node_modules、.git等目錄
-        excluded_dirs = ['node_modules', '.git', 'dist', 'build']
-        
-        path_str = str(file_path)
-        for excluded in excluded_dirs:
-            if f'/{excluded}/' in path_str.replace('\\', '/') or path_str.endswith(f'/{excluded}'):
-                return True
-        
-        return False
+    def _is_excluded(self, file_path, ignore=None, hashed=()):
+        """檢查文件是否位於排除的目錄中、不會部署或為指紋文件 (hashed 為指紋文件的相對路徑)"""
+        rel = Path(os.path.relpath(file_path, self.working_dir))
+        if any(part in EXCLUDED_DIRS for part in rel.parts[:-1]):
+            return True
+        if rel.as_posix() in hashed:
+            return True
+        return ignore is not None and ignore(rel.as_posix())
+    
+    def backup_store(self):
+        """取得工作目錄下的內容定址備份庫"""
+        return BackupStore(self.working_dir, self.keep_backups)
     
-    def backup_file(self, file_path):
-        """創建文件備份"""
-        backup_path = f"{file_path}.bak"
-        shutil.copy2(file_path, backup_path)
-        return backup_path
+    def find_versions(self, files=None, specific_version=None, graph=None, progress=None):
+        """查找所有版本號引用，提供 graph 時同時記錄各文件的資源引用
+
+        progress(已完成數, 總數, 該文件的引用) 在每個文件掃描完成後呼叫，
+        可拋出例外中止掃描 (已掃描的結果仍會寫入索引)
+        """
+        results = []
+        for scan in self.find_scans(files, specific_version, graph, progress):
+            results.extend(scan.select(specific_version))
+        return results
     
-    def find_versions(self, files=None, specific_version=None):
-        """查找所有版本號引用"""
+    def find_scans(self, files=None, specific_version=None, graph=None, progress=None):
+        """與 find_versions 相同，但回傳每個文件完整的 FileScan (含掃描時的內容雜湊)，
+        改寫時可直接使用其中的位元組偏移；specific_version 只影響傳給 progress 的引用
+        """
         if files is None:
             files = self.scan_files()
+        files = list(files)
+        
+        # 使用掃描索引，未變更的文件不需重新讀取
+        index = ScanIndex(self.working_dir, self.scanner) if self.use_index else None
         
         results = []
-        for file_path in files:
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                
-                # 查找HTML/CSS/JS中的版本號 (?v=YYYYMMDDVN)
-                html_versions = re.finditer(VERSION_PATTERN, content)
-                for match in html_versions:
-                    version = match.group(2)
-                    if specific_version is None or version == specific_version:
-                        results.append({
-                            'file': file_path,
-                            'version': version,
-                            'pattern': VERSION_PATTERN,
-                            'line': content[:match.start()].count('\n') + 1
-                        })
-                
-                # 查找JSON文件中的版本號 ("version": "YYYYMMDDVN")
-                if file_path.suffix == '.json':
-                    json_versions = re.finditer(JSON_VERSION_PATTERN, content)
-                    for match in json_versions:
-                        version = match.group(2)
-                        if specific_version is None or version == specific_version:
-                            results.append({
-                                'file': file_path,
-                                'version': version,
-                                'pattern': JSON_VERSION_PATTERN,
-                                'line': content[:match.start()].count('\n') + 1
-                            })
-                
-                # 查找JS文件中的appVersion變量 (let appVersion = "YYYYMMDDVN")
-                if file_path.suffix == '.js':
-                    js_versions = re.finditer(JS_VERSION_PATTERN, content)
-                    for match in js_versions:
-                        version = match.group(2)
-                        if specific_version is None or version == specific_version:
-                            results.append({
-                                'file': file_path,
-                                'version': version,
-                                'pattern': JS_VERSION_PATTERN,
-                                'line': content[:match.start()].count('\n') + 1
-                            })
-            
-            except Exception as e:
-                self.log(f"讀取文件 {file_path} 時出錯: {str(e)}")
+        try:
+            scan = iter_file_scans(self.scanner, files, index, self.jobs, graph=graph)
+            for done, (file_path, file_scan, error) in enumerate(scan, 1):
+                if error:
+                    self.log(f"讀取文件 {file_path} 時出錯: {error}")
+                else:
+                    results.append(file_scan)
+                if progress is not None:
+                    progress(done, len(files), file_scan.select(specific_version) if file_scan is not None else [])
+        finally:
+            if index is not None:
+                index.save()
         
         return results
     
-    def update_version(self, file_info, new_version, dry_run=False):
-        """更新單個文件中的版本號"""
-        file_path = file_info['file']
-        old_version = file_info['version']
-        pattern = file_info['pattern']
+    def build_graph(self, files=None):
+        """掃描文件並建立頁面與資源的引用圖"""
+        graph = ReferenceGraph(self.working_dir)
+        self.find_versions(files, graph=graph)
+        return graph
+    
+    def affected_files(self, changed, graph=None):
+        """變更文件需要重新加上版本號時，實際需要改寫的頁面"""
+        graph = graph or self.build_graph()
+        pages = graph.pages_to_restamp(changed)
+        for page in pages:
+            self.log(f"受影響: {page}")
+        self.log(f"{len(changed)} 個變更文件影響 {len(pages)} 個頁面")
+        return pages
+    
+    def files_since(self, since):
+        """取得自 git 版本 since 以來變更的文件及引用它們的頁面，不走訪整個目錄"""
+        # 引用圖來自掃描索引，此模式下一律使用索引
+        with ScanIndex(self.working_dir, self.scanner) as index:
+            if not len(index):
+                self.log("掃描索引為空，先完整掃描一次以建立引用圖")
+            try:
+                changed, files = since_scope(
+                    index, since, self.file_types,
+                    walk=self.scan_files, jobs=self.jobs
+                )
+            except RuntimeError as e:
+                self.log(f"無法取得 git 變更: {e}")
+                return []
         
+        ignore = self.ignore_matcher()
+        hashed = fingerprinted_paths(self.working_dir)
+        files = [f for f in files if not self._is_excluded(f, ignore, hashed)]
+        self.log(f"自 {since} 以來變更了 {len(changed)} 個文件，需處理 {len(files)} 個文件")
+        return files
+    
+    def target_files(self, changed=None, since=None):
+        """取得需要改寫的文件：since 為 git 版本，changed 為變更文件列表，皆未提供時為所有文件"""
+        if since is not None:
+            return self.files_since(since)
+        files = self.scan_files()
+        if changed is not None:
+            files = self.affected_files(changed, self.build_graph(files))
+        return files
+    
+    def update_file(self, scan, matches, new_version, dry_run=False, transaction=None):
+        """依掃描時記錄的位元組偏移一次改寫單個文件中的引用，回傳每個引用的結果
+
+        scan 為該文件的 FileScan，文件在掃描後被修改過時不改寫
+        """
         try:
-            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                content = f.read()
+            results = splice_file(scan.file, matches, new_version, scan.digest, dry_run, transaction)
+        except Exception as e:
+            self.log(f"更新文件 {scan.file} 時出錯: {str(e)}")
+            return []
+        
+        for result in results:
+            if result.applied:
+                self.log(f"{'[試運行] ' if dry_run else ''}已更新: {scan.file} (第 {result.line} 行)")
+        
+        return results
+    
+    def update_all_versions(self, old_version, new_version, dry_run=False, changed=None, since=None,
+                            progress=None):
+        """更新所有文件中的版本號
+
+        提供 changed (變更文件列表) 或 since (git 版本) 時只改寫受影響的頁面；
+        progress(已完成數, 總數) 在每個文件改寫後呼叫，拋出例外時整批改寫都會還原
+        """
+        self.update_count = 0
+        self.file_count = 0
+        
+        # 查找所有匹配的版本號，保留每個文件的掃描結果 (偏移量及內容雜湊) 供改寫直接使用
+        files = self.target_files(changed, since)
+        # 每個文件掃描完成時就輸出其引用記錄，不等待整個掃描結束
+        scans = self.find_scans(
+            files, old_version, progress=self._emit_references if self.records is not None else None
+        )
+        
+        # 按文件分組，每個文件只讀寫一次
+        files_to_update = [(scan, scan.select(old_version)) for scan in scans]
+        files_to_update = [(scan, matches) for scan, matches in files_to_update if matches]
+        
+        if not files_to_update:
+            self.log(f"未找到版本號 {old_version} 的引用")
+            return 0, 0
+        
+        # 所有改寫先寫入暫存檔，全部完成後才統一 fsync 並原子替換，
+        # 舊內容保存於內容定址備份庫
+        with self.transaction() as transaction:
+            # 更新文件
+            updated_files = set()
+            for done, (scan, matches) in enumerate(files_to_update, 1):
+                results = self.update_file(scan, matches, new_version, dry_run, transaction)
+                applied = [r for r in results if r.applied]
+                if applied:
+                    file_path = scan.file
+                    updated_files.add(file_path)
+                    self.update_count += len(applied)
+                    self.emit_committed('rewrite', file=file_path, dry_run=dry_run, changes=[
+                        {'line': r.line, 'old': r.old_version, 'new': r.new_version} for r in applied
+                    ])
+                if progress is not None:
+                    progress(done, len(files_to_update))
             
-            # 根據不同模式進行替換
-            if pattern == VERSION_PATTERN:
-                new_content = content.replace(f'?v={old_version}', f'?v={new_version}')
-            elif pattern == JSON_VERSION_PATTERN:
-                new_content = re.sub(JSON_VERSION_PATTERN, f'\\1{new_version}\\3', content)
-            elif pattern == JS_VERSION_PATTERN:
-                new_content = re.sub(JS_VERSION_PATTERN, f'\\1{new_version}\\3', content)
-            else:
-                return False
+            self.file_count = len(updated_files)
+            self.log(f"總計更新了 {self.file_count} 個文件中的 {self.update_count} 處版本號引用")
             
-            if content != new_content:
-                if not dry_run:
-                    # 備份原文件
-                    self.backup_file(file_path)
-                    
-                    # 寫入新內容
-                    with open(file_path, 'w', encoding='utf-8') as f:
-                        f.write(new_content)
+            # 更新version-info.json
+            self.update_version_info(new_version, dry_run, transaction)
+        
+        if transaction.backup.run_id:
+            self.log(f"已備份原文件，備份編號: {transaction.backup.run_id}")
+        
+        return self.file_count, self.update_count
+    
+    def stamp_content_hashes(self, dry_run=False, changed=None, since=None):
+        """將每個 ?v= 改寫為所引用資源自己的內容雜湊，只有內容變更的資源會換號
+
+        提供 changed (變更文件列表) 或 since (git 版本) 時只處理受影響的頁面
+        """
+        self.update_count = 0
+        self.file_count = 0
+        hasher = ContentHasher()
+        
+        files = self.target_files(changed, since)
+        
+        with self.transaction() as transaction:
+            for file_path in map(Path, files):
+                try:
+                    results, missing = stamp_page(file_path, self.working_dir, hasher, dry_run, transaction)
+                except Exception as e:
+                    self.log(f"更新文件 {file_path} 時出錯: {str(e)}")
+                    continue
+                
+                for ref in missing:
+                    self.log(f"警告: {file_path} 第 {ref.line} 行引用的 {ref.url} 不是本地文件，保留原版本號")
                 
-                self.log(f"{'[試運行] ' if dry_run else ''}已更新: {file_path} (第 {file_info['line']} 行)")
-                return True
+                stamped = [r for r in results if r.changed]
+                for result in stamped:
+                    self.log(f"{'[試運行] ' if dry_run else ''}已更新: {file_path} (第 {result.ref.line} 行) "
+                             f"{result.ref.url}: {result.ref.version} -> {result.new_version}")
+                if stamped:
+                    self.file_count += 1
+                    self.update_count += len(stamped)
+                    self.emit_committed('rewrite', file=file_path, dry_run=dry_run, changes=[
+                        {'line': r.ref.line, 'url': r.ref.url, 'old': r.ref.version, 'new': r.new_version}
+                        for r in stamped
+                    ])
+            
+            self.log(f"總計更新了 {self.file_count} 個文件中的 {self.update_count} 處資源雜湊")
         
-        except Exception as e:
-            self.log(f"更新文件 {file_path} 時出錯: {str(e)}")
+        if transaction.backup.run_id:
+            self.log(f"已備份原文件，備份編號: {transaction.backup.run_id}")
         
-        return False
+        return self.file_count, self.update_count
     
-    def update_all_versions(self, old_version, new_version, dry_run=False):
-        """更新所有文件中的版本號"""
+    def stamp_modules(self, dry_run=False):
+        """以各模組 (含其所有子模組) 的內容雜湊標記 ES 模組的 import 路徑及頁面中的模組腳本，
+        並在頁面中產生 modulepreload 提示
+
+        模組圖涉及所有文件，此模式一律處理整個工作目錄
+        """
         self.update_count = 0
         self.file_count = 0
+        graph = ModuleGraph(self.working_dir)
+        files = [Path(f) for f in self.scan_files()]
         
-        # 查找所有匹配的版本號
-        files = self.scan_files()
-        version_refs = self.find_versions(files, old_version)
+        with self.transaction() as transaction:
+            for file_path in files:
+                try:
+                    if file_path.suffix in ('.html', '.htm'):
+                        stamps, preload = graph.stamp_page(file_path, dry_run, transaction)
+                        if preload:
+                            self.log(f"{file_path}: 預載 {len(preload)} 個模組")
+                    elif file_path.suffix in ('.js', '.mjs'):
+                        stamps = graph.stamp_module(file_path, dry_run, transaction)
+                    else:
+                        continue
+                except Exception as e:
+                    self.log(f"更新文件 {file_path} 時出錯: {str(e)}")
+                    continue
+                
+                changed = [s for s in stamps if s.changed]
+                for stamp in changed:
+                    self.log(f"{'[試運行] ' if dry_run else ''}已更新: {file_path} (第 {stamp.line} 行) "
+                             f"{stamp.specifier} -> {stamp.new_specifier}")
+                if changed:
+                    self.file_count += 1
+                    self.update_count += len(changed)
+                    self.emit_committed('rewrite', file=file_path, dry_run=dry_run, changes=[
+                        {'line': s.line, 'old': s.specifier, 'new': s.new_specifier} for s in changed
+                    ])
+            
+            self.log(f"總計更新了 {self.file_count} 個文件中的 {self.update_count} 處模組引用")
         
-        if not version_refs:
-            self.log(f"未找到版本號 {old_version} 的引用")
-            return 0, 0
+        if transaction.backup.run_id:
+            self.log(f"已備份原文件，備份編號: {transaction.backup.run_id}")
+        
+        return self.file_count, self.update_count
+    
+    def stamp_stylesheets(self, dry_run=False, inline_limit=0):
+        """以被引用資源的內容雜湊標記樣式表中的 url() 及 @import，被引用的樣式表變更時引用它的樣式表隨之換號
+
+        inline_limit 大於 0 時將不超過此大小 (位元組) 的 @import 樣式表內嵌；
+        引用關係涉及所有樣式表，此模式一律處理整個工作目錄
+        """
+        self.update_count = 0
+        self.file_count = 0
+        graph = StylesheetGraph(self.working_dir, inline_limit=inline_limit)
         
-        # 按文件分組
-        files_to_update = {}
-        for ref in version_refs:
-            file_path = ref['file']
-            if file_path not in files_to_update:
-                files_to_update[file_path] = []
-            files_to_update[file_path].append(ref)
-        
-        # 更新文件
-        updated_files = set()
-        for file_path, refs in files_to_update.items():
-            updated = False
-            for ref in refs:
-                if self.update_version(ref, new_version, dry_run):
-                    updated = True
-                    self.update_count += 1
+        with self.transaction() as transaction:
+            for file_path in self._stylesheets():
+                try:
+                    stamps = graph.stamp_sheet(file_path, dry_run, transaction)
+                except Exception as e:
+                    self.log(f"更新文件 {file_path} 時出錯: {str(e)}")
+                    continue
+                self._log_css_stamps(file_path, stamps, dry_run)
             
-            if updated:
-                updated_files.add(file_path)
+            self.log(f"總計更新了 {self.file_count} 個樣式表中的 {self.update_count} 處資源引用")
         
-        self.file_count = len(updated_files)
-        self.log(f"總計更新了 {self.file_count} 個文件中的 {self.update_count} 處版本號引用")
+        if transaction.backup.run_id:
+            self.log(f"已備份原文件，備份編號: {transaction.backup.run_id}")
         
-        # 更新version-info.json
-        self.update_version_info(new_version, dry_run)
+        return self.file_count, self.update_count
+    
+    def _stylesheets(self):
+        return [Path(f) for f in self.scan_files() if Path(f).suffix == '.css']
+    
+    def _log_css_stamps(self, file_path, stamps, dry_run, target=None):
+        """記錄樣式表的改寫結果，target 為實際寫入的文件 (加上指紋時為指紋文件)"""
+        changed = [s for s in stamps if s.changed]
+        for stamp in changed:
+            change = "已內嵌" if stamp.inlined else f"{stamp.url} -> {stamp.new_url}"
+            self.log(f"{'[試運行] ' if dry_run else ''}已更新: {target or file_path} (第 {stamp.line} 行) {change}")
+        if changed:
+            self.file_count += 1
+            self.update_count += len(changed)
+            self.emit_committed('rewrite', file=target or file_path, dry_run=dry_run, changes=[
+                {'line': s.line, 'old': s.url, 'new': s.new_url, 'inlined': s.inlined} for s in changed
+            ])
+    
+    def fingerprint_assets(self, dry_run=False, changed=None, since=None, css=False, inline_limit=0):
+        """將頁面引用的本地 js/css 改為帶內容雜湊的文件名，並更新 asset-manifest.json
+
+        提供 changed (變更文件列表) 或 since (git 版本) 時只處理受影響的頁面；
+        css 為 True 時樣式表中的 url() 及 @import 也改為指紋文件名 (寫在樣式表的指紋文件中，原始樣式表不變)
+        """
+        self.update_count = 0
+        self.file_count = 0
+        fingerprinter = Fingerprinter(self.working_dir)
+        
+        pages = [f for f in map(Path, self.target_files(changed, since)) if f.suffix in ('.html', '.htm')]
+        
+        with self.transaction() as transaction:
+            if css:
+                # 先決定樣式表的指紋 (依改寫後的內容)，頁面引用的才會是改寫後的樣式表
+                graph = StylesheetGraph(self.working_dir, fingerprinter=fingerprinter, inline_limit=inline_limit)
+                for sheet in self._stylesheets():
+                    try:
+                        hashed, stamps = graph.fingerprint_sheet(sheet)
+                    except Exception as e:
+                        self.log(f"更新文件 {sheet} 時出錯: {str(e)}")
+                        continue
+                    # 原始樣式表不改寫，只有指紋文件尚未建立 (內容有變更) 時才算更新
+                    if not (self.working_dir / hashed).is_file():
+                        self._log_css_stamps(sheet, stamps, dry_run, self.working_dir / hashed)
+            
+            for page in pages:
+                try:
+                    results = fingerprinter.rewrite_page(page, dry_run, transaction)
+                except Exception as e:
+                    self.log(f"更新文件 {page} 時出錯: {str(e)}")
+                    continue
+                
+                renamed = [r for r in results if r.changed]
+                for result in renamed:
+                    self.log(f"{'[試運行] ' if dry_run else ''}已更新: {page} (第 {result.line} 行) "
+                             f"{result.url} -> {result.new_url}")
+                if renamed:
+                    self.file_count += 1
+                    self.update_count += len(renamed)
+                    self.emit_committed('rewrite', file=page, dry_run=dry_run, changes=[
+                        {'line': r.line, 'old': r.url, 'new': r.new_url} for r in renamed
+                    ])
+            
+            # 指紋文件與頁面在同一批次提交
+            for logical, hashed in fingerprinter.write_assets(dry_run, transaction):
+                self.log(f"{'[試運行] ' if dry_run else ''}已建立: {hashed} ({logical})")
+                self.emit_committed('asset', file=self.working_dir / hashed, source=logical, dry_run=dry_run)
+            # 被取代的舊指紋文件在同一批次刪除，之後的掃描不會再把它們當成一般文件改寫
+            for logical, hashed in fingerprinter.remove_superseded(dry_run, transaction):
+                self.log(f"{'[試運行] ' if dry_run else ''}已刪除: {hashed} ({logical})")
+                self.emit_committed('asset', file=self.working_dir / hashed, source=logical, dry_run=dry_run, removed=True)
+            if fingerprinter.write_manifest(dry_run, transaction):
+                self.log(f"{'[試運行] ' if dry_run else ''}已更新 asset-manifest.json")
+            
+            self.log(f"總計更新了 {self.file_count} 個頁面中的 {self.update_count} 處資源引用")
+        
+        if transaction.backup.run_id:
+            self.log(f"已備份原文件，備份編號: {transaction.backup.run_id}")
         
         return self.file_count, self.update_count
     
-    def update_version_info(self, new_version, dry_run=False):
+    def update_precache_manifest(self, sw_path='service-worker.js', dry_run=False, transaction=None):
+        """重新產生 Service Worker 的預緩存清單，revision 為各文件的內容雜湊"""
+        sw_path = self.working_dir / sw_path
+        if not sw_path.exists():
+            self.log(f"警告: 找不到 {sw_path} 文件")
+            return False
+        
+        try:
+            entries = build_manifest(self.working_dir)
+            if transaction is None:
+                with self.transaction() as transaction:
+                    changed = inject_manifest(sw_path, entries, dry_run, transaction)
+            else:
+                changed = inject_manifest(sw_path, entries, dry_run, transaction)
+        except Exception as e:
+            self.log(f"更新預緩存清單時出錯: {str(e)}")
+            return False
+        
+        self.emit_committed('precache', file=sw_path, entries=len(entries), changed=changed, dry_run=dry_run)
+        if changed:
+            self.log(f"{'[試運行] ' if dry_run else ''}已更新 {sw_path} 的預緩存清單，共 {len(entries)} 項")
+        else:
+            self.log(f"{sw_path} 的預緩存清單已是最新")
+        return changed
+    
+    def update_version_info(self, new_version, dry_run=False, transaction=None):
         """更新version-info.json文件"""
         version_info_path = self.working_dir / 'version-info.json'
         
@@ -226,20 +561,44 @@ class VersionUpdater:
             version_info['updateDate'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
             
             if not dry_run:
-                # 備份原文件
-                self.backup_file(version_info_path)
-                
-                # 寫入新內容
-                with open(version_info_path, 'w', encoding='utf-8') as f:
-                    json.dump(version_info, f, ensure_ascii=False, indent=2)
+                # 原子寫入新內容，並保留原文件作為備份
+                data = json.dumps(version_info, ensure_ascii=False, indent=2).encode('utf-8')
+                if transaction is not None:
+                    transaction.stage(version_info_path, data)
+                else:
+                    atomic_write(version_info_path, data, backup=self.backup_store())
             
             self.log(f"{'[試運行] ' if dry_run else ''}已更新 version-info.json: {old_version} -> {new_version}")
+            self.emit_committed('rewrite', file=version_info_path, dry_run=dry_run,
+                      changes=[{'old': old_version, 'new': new_version}])
             return True
         
         except Exception as e:
             self.log(f"更新 version-info.json 時出錯: {str(e)}")
             return False
     
+    def list_backups(self):
+        """列出備份庫中的執行記錄"""
+        runs = self.backup_store().list_runs()
+        if not runs:
+            self.log("備份庫中沒有任何記錄")
+        for run in runs:
+            self.log(f"{run['run']}  {run['created']}  {len(run['files'])} 個文件")
+        return runs
+    
+    def restore_backup(self, run_id, dry_run=False):
+        """還原指定備份編號改寫過的文件"""
+        try:
+            restored = self.backup_store().restore(run_id, dry_run)
+        except FileNotFoundError:
+            self.log(f"找不到備份編號 {run_id}")
+            return []
+        
+        for file_path in restored:
+            self.log(f"{'[試運行] ' if dry_run else ''}已還原: {file_path}")
+        self.log(f"{'[試運行] ' if dry_run else ''}共還原 {len(restored)} 個文件")
+        return restored
+    
     def generate_new_version(self):
         """生成新的版本號 (格式: YYYYMMDDvX)"""
         today = datetime.now()
@@ -261,6 +620,10 @@ class VersionUpdaterGUI:
         
         # 創建版本更新器
         self.updater = VersionUpdater()
+        # 目前執行中的背景工作
+        self.task = None
+        # 最近一次掃描的版本號分佈
+        self.version_stats = VersionStats()
         
         # 創建主框架
         self.main_frame = ttk.Frame(root, padding=10)
@@ -293,8 +656,8 @@ class VersionUpdaterGUI:
         old_ver_entry = ttk.Entry(old_ver_frame, textvariable=self.old_ver_var, width=20)
         old_ver_entry.pack(side=tk.LEFT, padx=5)
         
-        scan_btn = ttk.Button(old_ver_frame, text="掃描現有版本", command=self.scan_versions)
-        scan_btn.pack(side=tk.LEFT, padx=5)
+        self.scan_btn = ttk.Button(old_ver_frame, text="掃描現有版本", command=self.scan_versions)
+        self.scan_btn.pack(side=tk.LEFT, padx=5)
         
         # 新版本號
         new_ver_frame = ttk.Frame(version_frame)
@@ -341,6 +704,19 @@ class VersionUpdaterGUI:
         # 綁定選擇事件
         self.tree.bind("<<TreeviewSelect>>", self.on_version_selected)
         
+        # 進度框架
+        progress_frame = ttk.Frame(self.main_frame)
+        progress_frame.pack(fill=tk.X)
+        
+        self.progress_var = tk.StringVar()
+        ttk.Label(progress_frame, textvariable=self.progress_var, width=16).pack(side=tk.LEFT)
+        
+        self.progress = ttk.Progressbar(progress_frame, mode="determinate")
+        self.progress.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        
+        self.cancel_btn = ttk.Button(progress_frame, text="取消", command=self.cancel_task, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.LEFT)
+        
         # 按鈕框架
         btn_frame = ttk.Frame(self.main_frame)
         btn_frame.pack(fill=tk.X, pady=10)
@@ -355,13 +731,13 @@ class VersionUpdaterGUI:
         dry_run_cb.pack(side=tk.LEFT)
         
         # 更新按鈕
-        update_btn = ttk.Button(
+        self.update_btn = ttk.Button(
             btn_frame,
             text="更新版本",
             command=self.update_versions,
             style="TButton"
         )
-        update_btn.pack(side=tk.RIGHT)
+        self.update_btn.pack(side=tk.RIGHT)
         
         # 日誌框架
         log_frame = ttk.LabelFrame(self.main_frame, text="日誌", padding=10)
@@ -392,35 +768,91 @@ class VersionUpdaterGUI:
         self.log_text.see(tk.END)
         self.log_text.config(state=tk.DISABLED)
     
+    def start_task(self, work, handlers, on_done):
+        """在背景執行 work，執行期間停用按鈕並顯示進度；updater 的日誌經由佇列顯示"""
+        if self.task is not None and self.task.running:
+            return
+        
+        def finish(status, result):
+            self.updater.listener = None
+            self.task = None
+            self.scan_btn.config(state=tk.NORMAL)
+            self.update_btn.config(state=tk.NORMAL)
+            self.cancel_btn.config(state=tk.DISABLED)
+            if status == 'cancelled':
+                self.progress_var.set("已取消")
+                self.log("操作已取消")
+            elif status == 'error':
+                self.progress_var.set("發生錯誤")
+                self.log(f"發生錯誤: {result}")
+                messagebox.showerror("錯誤", str(result))
+            else:
+                self.progress_var.set("完成")
+                on_done(result)
+        
+        self.progress.config(value=0, maximum=1)
+        self.progress_var.set("")
+        self.scan_btn.config(state=tk.DISABLED)
+        self.update_btn.config(state=tk.DISABLED)
+        self.cancel_btn.config(state=tk.NORMAL)
+        
+        self.task = BackgroundTask(self.root, work, dict(handlers, log=self.log), finish)
+        self.updater.listener = lambda message: self.task.post('log', message)
+        self.task.start()
+    
+    def cancel_task(self):
+        """取消目前的背景工作"""
+        if self.task is not None:
+            self.task.cancel()
+            self.progress_var.set("正在取消...")
+    
+    def show_progress(self, payload):
+        """更新進度條，payload 為 (已完成數, 總數)"""
+        done, total = payload
+        self.progress.config(value=done, maximum=max(total, 1))
+        self.progress_var.set(f"{done} / {total}")
+    
     def scan_versions(self):
-        """掃描現有版本號"""
+        """在背景掃描現有版本號，掃描結果逐一加入樹形視圖"""
         self.tree.delete(*self.tree.get_children())
+        self.version_stats = VersionStats()
         self.log("正在掃描文件中的版本號...")
         
         self.updater.working_dir = Path(self.dir_var.get())
-        versions = self.updater.find_versions()
         
-        # 按版本號分組統計
-        version_stats = {}
-        for v in versions:
-            version = v['version']
-            if version not in version_stats:
-                version_stats[version] = 0
-            version_stats[version] += 1
+        def work(task):
+            def progress(done, total, matches):
+                task.check_cancelled()
+                task.post('progress', (done, total))
+                if matches:
+                    task.post('matches', matches)
+            return self.updater.find_versions(progress=progress)
+        
+        def add_matches(matches):
+            # 分佈統計隨掃描結果累計，完成時不需再走訪一次
+            self.version_stats.add(matches)
+            for v in matches:
+                self.tree.insert("", tk.END, values=(v.version, v.file, v.line))
         
-        # 添加到樹形視圖
-        for v in versions:
-            self.tree.insert("", tk.END, values=(v['version'], v['file'], v['line']))
+        self.start_task(
+            work,
+            {'progress': self.show_progress, 'matches': add_matches},
+            self.show_scan_result
+        )
+    
+    def show_scan_result(self, versions):
+        """掃描完成後顯示各版本號的統計"""
+        version_stats = self.version_stats
         
         # 更新日誌
-        if versions:
-            self.log(f"找到 {len(versions)} 處版本號引用:")
-            for version, count in version_stats.items():
-                self.log(f"  - {version}: {count} 處")
+        if version_stats:
+            self.log(f"找到 {version_stats.total} 處版本號引用:")
+            for version, count in version_stats.most_common():
+                self.log(f"  - {version}: {count} 處，{version_stats.file_count(version)} 個文件")
             
             # 如果舊版本號為空，則自動選擇最常見的版本
-            if not self.old_ver_var.get() and version_stats:
-                most_common = max(version_stats.items(), key=lambda x: x[1])[0]
+            if not self.old_ver_var.get():
+                most_common = version_stats.most_common(1)[0][0]
                 self.old_ver_var.set(most_common)
                 self.log(f"已自動選擇最常見的版本號: {most_common}")
         else:
@@ -460,18 +892,25 @@ class VersionUpdaterGUI:
         
         self.log(f"開始{'測試' if dry_run else ''}更新版本: {old_version} -> {new_version}")
         
-        # 更新版本號
+        # 在背景更新版本號，取消時整批改寫都會還原
         self.updater.working_dir = Path(self.dir_var.get())
-        file_count, ref_count = self.updater.update_all_versions(old_version, new_version, dry_run)
         
-        if file_count > 0:
-            message = f"{'測試' if dry_run else ''}更新完成！已更新 {file_count} 個文件中的 {ref_count} 處版本號引用"
-            self.log(message)
-            
-            if not dry_run:
-                messagebox.showinfo("完成", message)
-        else:
-            self.log(f"未找到舊版本號 {old_version} 的引用")
+        def work(task):
+            def progress(done, total):
+                task.check_cancelled()
+                task.post('progress', (done, total))
+            return self.updater.update_all_versions(old_version, new_version, dry_run, progress=progress)
+        
+        def done(result):
+            file_count, ref_count = result
+            if file_count > 0:
+                message = f"{'測試' if dry_run else ''}更新完成！已更新 {file_count} 個文件中的 {ref_count} 處版本號引用"
+                self.log(message)
+                
+                if not dry_run:
+                    messagebox.showinfo("完成", message)
+        
+        self.start_task(work, {'progress': self.show_progress}, done)
 
 
 def main():
@@ -482,6 +921,34 @@ def main():
     parser.add_argument("--dir", default=".", help="工作目錄，默認為當前目錄")
     parser.add_argument("--dry-run", action="store_true", help="測試運行模式，不實際修改文件")
     parser.add_argument("--gui", action="store_true", help="啟動圖形界面")
+    parser.add_argument("--no-index", action="store_true", help="不使用掃描索引，強制重新讀取所有文件")
+    parser.add_argument("--jobs", type=int, default=None, help="並行掃描的工作數，默認為CPU核心數")
+    parser.add_argument("--list-backups", action="store_true", help="列出備份庫中的執行記錄")
+    parser.add_argument("--restore", metavar="RUN", help="還原指定備份編號改寫過的文件")
+    parser.add_argument("--content-hash", action="store_true",
+                        help="以各資源文件的內容雜湊取代 ?v= 版本號，只有內容變更的資源會換號")
+    parser.add_argument("--css", action="store_true",
+                        help="以內容雜湊標記樣式表中 url() 及 @import 引用的資源；與 --fingerprint 一起使用時改為指紋文件名")
+    parser.add_argument("--inline-css-imports", nargs="?", type=int, const=4096, default=0, metavar="BYTES",
+                        help="與 --css 一起使用，將不超過 BYTES (默認 4096) 位元組的 @import 樣式表內嵌")
+    parser.add_argument("--modules", action="store_true",
+                        help="以內容雜湊標記 ES 模組的 import 路徑及頁面中的模組腳本，並產生 modulepreload 提示")
+    parser.add_argument("--fingerprint", action="store_true",
+                        help="將本地 js/css 複製為帶內容雜湊的文件名 (app.<雜湊>.js)，改寫頁面引用並產生 asset-manifest.json")
+    parser.add_argument("--precache", nargs="?", const="service-worker.js", metavar="SW",
+                        help="重新產生 Service Worker 的預緩存清單，默認為 service-worker.js")
+    parser.add_argument("--changed", nargs="+", metavar="FILE",
+                        help="只改寫引用了這些文件 (相對於工作目錄) 的頁面")
+    parser.add_argument("--since", metavar="REF",
+                        help="只處理自 git 版本 REF 以來變更的文件及引用它們的頁面，不走訪整個目錄")
+    parser.add_argument("--affected", action="store_true",
+                        help="只列出 --changed / --since 文件變更後需要重新加上版本號的頁面")
+    parser.add_argument("--no-ignore", action="store_true",
+                        help="不依 firebase.json 的 hosting.ignore 及 .gitignore 排除文件")
+    parser.add_argument("--keep-backups", type=int, default=DEFAULT_KEEP,
+                        help=f"備份庫保留的執行記錄數量，默認為 {DEFAULT_KEEP}，0 表示全部保留")
+    parser.add_argument("--format", choices=RECORD_FORMATS, default="text",
+                        help="輸出格式，json / ndjson 逐筆輸出每個引用及改寫的記錄 (日誌改為輸出至 stderr)")
     
     args = parser.parse_args()
     
@@ -493,21 +960,95 @@ def main():
         return
     
     # 命令行模式
-    updater = VersionUpdater(args.dir)
+    updater = VersionUpdater(args.dir, use_index=not args.no_index, jobs=args.jobs,
+                             keep_backups=args.keep_backups, use_ignore=not args.no_ignore)
+    if args.precache:
+        updater.precache_sw = args.precache
+    
+    if args.format == "text":
+        run_cli(updater, args)
+        return
+    
+    # 記錄寫至 stdout，其餘的日誌輸出轉向 stderr
+    with RecordWriter(args.format, root=args.dir) as records, contextlib.redirect_stdout(sys.stderr):
+        updater.records = records
+        run_cli(updater, args)
+
+
+def run_cli(updater, args):
+    """執行命令行模式的各項操作"""
+    if args.list_backups:
+        updater.list_backups()
+        return
+    
+    if args.restore:
+        updater.restore_backup(args.restore, args.dry_run)
+        return
+    
+    changed = [path.replace('\\', '/') for path in args.changed] if args.changed else None
+    
+    if args.affected:
+        if args.since:
+            pages = updater.files_since(args.since)
+            for file_path in pages:
+                print(f"受影響: {file_path}")
+        elif changed is not None:
+            pages = updater.affected_files(changed)
+        else:
+            print("請指定變更的文件 (--changed 或 --since 參數)")
+            updater.emit('error', message="請指定變更的文件 (--changed 或 --since 參數)")
+            return
+        for file_path in pages:
+            updater.emit('affected', file=file_path)
+        updater.emit('summary', mode='affected', files=len(pages))
+        return
+    
+    if args.css or args.content_hash or args.modules or args.fingerprint or args.precache:
+        # 先改寫樣式表，頁面中樣式表的雜湊才能反映改寫後的內容
+        if args.css and not args.fingerprint:
+            file_count, ref_count = updater.stamp_stylesheets(args.dry_run, args.inline_css_imports)
+            updater.emit('summary', mode='css', files=file_count, references=ref_count,
+                         dry_run=args.dry_run)
+        # 先改寫頁面中的雜湊，預緩存清單才能反映改寫後的頁面內容
+        if args.content_hash:
+            file_count, ref_count = updater.stamp_content_hashes(args.dry_run, changed, args.since)
+            if file_count == 0:
+                print("所有資源引用已是最新的內容雜湊")
+            updater.emit('summary', mode='content-hash', files=file_count, references=ref_count,
+                         dry_run=args.dry_run)
+        if args.modules:
+            # 模組的雜湊包含子模組的雜湊，須在 --content-hash 之後執行才不會被覆蓋
+            file_count, ref_count = updater.stamp_modules(args.dry_run)
+            updater.emit('summary', mode='modules', files=file_count, references=ref_count,
+                         dry_run=args.dry_run)
+        if args.fingerprint:
+            file_count, ref_count = updater.fingerprint_assets(args.dry_run, changed, args.since,
+                                                               args.css, args.inline_css_imports)
+            if file_count == 0:
+                print("所有資源引用已是最新的指紋文件名")
+            updater.emit('summary', mode='fingerprint', files=file_count, references=ref_count,
+                         dry_run=args.dry_run)
+        if args.precache:
+            changed_manifest = updater.update_precache_manifest(args.precache, args.dry_run)
+            updater.emit('summary', mode='precache', changed=changed_manifest, dry_run=args.dry_run)
+        return
     
     if not args.old:
         print("請指定舊版本號 (--old 參數)")
+        updater.emit('error', message="請指定舊版本號 (--old 參數)")
         return
     
     new_version = args.new or updater.generate_new_version()
     print(f"準備{'測試' if args.dry_run else ''}更新版本: {args.old} -> {new_version}")
     
-    file_count, ref_count = updater.update_all_versions(args.old, new_version, args.dry_run)
+    file_count, ref_count = updater.update_all_versions(args.old, new_version, args.dry_run, changed, args.since)
     
     if file_count > 0:
         print(f"{'測試' if args.dry_run else ''}更新完成！已更新 {file_count} 個文件中的 {ref_count} 處版本號引用")
     else:
         print(f"未找到舊版本號 {args.old} 的引用")
+    updater.emit('summary', mode='update', old=args.old, new=new_version, files=file_count, references=ref_count,
+                 dry_run=args.dry_run)
 
 
 if __name__ == "__main__":
@@ -7,20 +7,36 @@
 
 import os
 import re
-import sys
 import json
-import shutil
 from pathlib import Path
 from datetime import datetime
-import subprocess
+import multiprocessing
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-from collections import Counter
+
+from version_tools import (
+    VERSION_PATTERN,
+    VersionScanner,
+    ScanIndex,
+    iter_scan,
+    RewriteTransaction,
+    BackupStore,
+    version_matcher,
+    consolidate_file,
+    EXCLUDED_DIRS,
+    walk_files,
+    IgnoreMatcher,
+    load_patterns,
+    VersionStats,
+    fingerprinted_paths,
+)
 
 # 全局變數
-VERSION_PATTERN = r'(\?v=)([0-9]{8}v[0-9]+)'
-JSON_VERSION_PATTERN = r'("version"\s*:\s*")([0-9]{8}v[0-9]+)(")'
-JS_VERSION_PATTERN = r'(let\s+appVersion\s*=\s*[\'"])([0-9]{8}v[0-9]+)([\'"])'
+SCANNER = VersionScanner()
+
+def scanner_for(directory):
+    """依目錄下的版本號位置登記檔建立掃描器，沒有登記檔時使用預設模式"""
+    return VersionScanner(load_patterns(directory))
 
 def generate_new_version():
     """生成新的版本號"""
@@ -29,84 +45,51 @@ def generate_new_version():
     return f"{date_part}v1"
 
 def scan_files(directory="."):
-    """掃描指定目錄中的HTML和JS文件"""
-    file_list = []
-    for ext in ['.html', '.js', '.json']:
-        file_list.extend(list(Path(directory).rglob(f'*{ext}')))
-    return file_list
+    """掃描指定目錄中會部署的HTML和JS文件，回傳 os.DirEntry 列表"""
+    # 單次走訪比對所有副檔名，排除的目錄及 firebase.json / .gitignore 忽略的目錄不會被進入
+    ignore = IgnoreMatcher.from_root(directory)
+    files = list(walk_files(directory, ('.html', '.js', '.json'), EXCLUDED_DIRS, ignore))
+    # 指紋文件的內容必須與文件名中的雜湊一致，不改寫其中的版本號
+    hashed = fingerprinted_paths(directory)
+    files = [f for f in files if Path(os.path.relpath(f.path, directory)).as_posix() not in hashed]
+    return files
 
-def find_versions(files):
-    """尋找所有文件中的版本號"""
-    versions = []
-    version_files = {}  # 追蹤每個版本在哪些文件中
-    
-    for file_path in files:
-        try:
-            if not _is_excluded(file_path):
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    content = f.read()
-                    file_versions = []
-                    
-                    # 查找HTML/JS中的版本號 (?v=YYYYMMDDVN)
-                    for match in re.finditer(VERSION_PATTERN, content):
-                        version = match.group(2)
-                        versions.append(version)
-                        file_versions.append(version)
-                    
-                    # 查找JSON中的版本號
-                    if file_path.suffix == '.json':
-                        for match in re.finditer(JSON_VERSION_PATTERN, content):
-                            version = match.group(2)
-                            versions.append(version)
-                            file_versions.append(version)
-                    
-                    # 查找JS中的appVersion變量
-                    if file_path.suffix == '.js':
-                        for match in re.finditer(JS_VERSION_PATTERN, content):
-                            version = match.group(2)
-                            versions.append(version)
-                            file_versions.append(version)
-                    
-                    # 將此文件的版本號儲存起來
-                    for v in set(file_versions):
-                        if v not in version_files:
-                            version_files[v] = []
-                        version_files[v].append(str(file_path))
-        except Exception as e:
-            print(f"處理文件 {file_path} 時出錯: {str(e)}")
+def find_versions(files, index=None, jobs=None, scanner=None):
+    """尋找所有文件中的版本號，回傳 版本號 → 文件 → 行號 的 VersionStats"""
+    scanner = scanner or (index.scanner if index is not None else SCANNER)
+    version_stats = VersionStats()
+    
+    files = [file_path for file_path in files if not _is_excluded(file_path)]
+    for file_path, matches, error in iter_scan(scanner, files, index, jobs):
+        if error:
+            print(f"處理文件 {file_path} 時出錯: {error}")
+            continue
+        
+        # 掃描時直接累計每個版本的文件及行號
+        version_stats.add(matches)
             
-    return versions, version_files
+    return version_stats
 
 def _is_excluded(file_path):
-    """檢查文件是否應該被排除"""
-    excluded_dirs = ['node_modules', '.git', 'dist', 'build']
+    """檢查文件是否應該被排除 (排除的目錄已在走訪時略過)"""
     excluded_files = ['version_update.py', 'version_update_windows.py']
-    
-    if file_path.name in excluded_files:
-        return True
-    
-    path_str = str(file_path).replace('\\', '/')
-    for excluded in excluded_dirs:
-        if f'/{excluded}/' in path_str or path_str.endswith(f'/{excluded}'):
-            return True
-    
-    return False
+    return os.path.basename(file_path) in excluded_files
 
 def detect_current_versions(directory="."):
     """檢測當前系統中的所有版本號及其分佈"""
     print(f"正在掃描目錄: {directory}")
     files = scan_files(directory)
     print(f"找到 {len(files)} 個文件")
-    versions, version_files = find_versions(files)
+    # 使用掃描索引，未變更的文件不需重新讀取
+    with ScanIndex(directory, scanner_for(directory)) as index:
+        version_stats = find_versions(files, index)
     
-    if not versions:
-        return None, {}, {}
+    if not version_stats:
+        return None, version_stats
     
-    # 使用Counter找出各版本號出現頻率
-    counter = Counter(versions)
-    most_common_version = counter.most_common(1)[0][0]
+    most_common_version = version_stats.most_common(1)[0][0]
     
-    return most_common_version, counter, version_files
+    return most_common_version, version_stats
 
 def generate_newer_version(current_versions):
     """生成一個比所有現有版本都新的版本號"""
@@ -197,8 +180,7 @@ def create_gui():
     log_text.see(tk.END)
     
     # 定義全局變數用於存儲所有版本號和其關聯文件
-    version_counter = Counter()
-    version_files_dict = {}
+    version_stats = VersionStats()
     
     def log(message):
         """添加日誌消息"""
@@ -256,29 +238,25 @@ def create_gui():
     
     def scan_versions():
         """掃描並顯示版本號"""
-        nonlocal version_counter, version_files_dict
+        nonlocal version_stats
         
         log("正在掃描當前目錄中的版本號...")
-        current_version, counter, version_files = detect_current_versions(dir_var.get())
-        
-        # 保存結果到全局變數
-        version_counter = counter
-        version_files_dict = version_files
+        current_version, version_stats = detect_current_versions(dir_var.get())
         
         if current_version:
             log(f"檢測到當前版本: {current_version}")
             
             # 清空並重新填充版本列表
             version_listbox.delete(0, tk.END)
-            for version, count in counter.most_common():
-                percentage = (count / sum(counter.values())) * 100
+            for version, count in version_stats.most_common():
+                percentage = version_stats.percentage(version)
                 version_listbox.insert(tk.END, f"{version} ({count}處, {percentage:.1f}%)")
                 
             # 預選最常見的版本
             version_listbox.selection_set(0)
             
             # 生成一個比所有版本都新的版本號
-            new_version = generate_newer_version(counter.keys())
+            new_version = generate_newer_version(version_stats)
             new_ver_var.set(new_version)
             log(f"已自動生成新版本號: {new_version}")
             
@@ -289,23 +267,17 @@ def create_gui():
     
     def show_version_distribution():
         """顯示系統中的版本號分佈情況"""
-        nonlocal version_counter
-        
-        if not version_counter:
+        if not version_stats:
             log("未檢測到任何版本號引用")
             return
         
-        total = sum(version_counter.values())
-        
-        log(f"\n系統中的版本號分佈情況（共 {total} 處引用）:")
-        for version, count in version_counter.most_common():
-            percentage = (count / total) * 100
-            log(f"  - {version}: {count} 處 ({percentage:.1f}%)")
+        log(f"\n系統中的版本號分佈情況（共 {version_stats.total} 處引用）:")
+        for version, count in version_stats.most_common():
+            percentage = version_stats.percentage(version)
+            log(f"  - {version}: {count} 處 ({percentage:.1f}%)，{version_stats.file_count(version)} 個文件")
     
     def show_version_files():
         """顯示選中版本的文件列表"""
-        nonlocal version_files_dict
-        
         selected_indices = version_listbox.curselection()
         if not selected_indices:
             messagebox.showinfo("提示", "請先選擇一個版本")
@@ -338,10 +310,12 @@ def create_gui():
         
         # 顯示文件列表
         for version in selected_versions:
-            if version in version_files_dict:
+            if version in version_stats:
                 files_text.insert(tk.END, f"版本 {version} 出現在以下文件中:\n")
-                for file_path in sorted(version_files_dict[version]):
-                    files_text.insert(tk.END, f"  - {file_path}\n")
+                files = version_stats.files(version)
+                for file_path in sorted(files):
+                    lines = ', '.join(map(str, files[file_path]))
+                    files_text.insert(tk.END, f"  - {file_path} (第 {lines} 行)\n")
                 files_text.insert(tk.END, "\n")
             else:
                 files_text.insert(tk.END, f"找不到版本 {version} 的文件記錄\n\n")
@@ -420,121 +394,75 @@ def create_gui():
                 return
         
         # 執行更新
+        transaction = None
         try:
             # 記錄開始時間
             start_time = datetime.now()
             
-            # 對每個選中的版本進行更新
-            for old_version in selected_versions:
-                log(f"\n開始{'測試' if is_dry_run else ''}更新版本：{old_version} -> {new_version}")
-                
-                # 掃描所有檔案
-                files = scan_files(working_directory)
-                
-                # 更新版本號
-                updated_files = 0
-                updated_refs = 0
-                detailed_updates = []
+            # 所有選中的舊版本號一次合併為新版本號：每個文件只讀取、掃描及寫入一次
+            mapping = {old_version: new_version for old_version in selected_versions}
+            matcher = version_matcher(mapping)
+            scanner = scanner_for(working_directory)
+            log(f"\n開始{'測試' if is_dry_run else ''}更新版本：{', '.join(selected_versions)} -> {new_version}")
+            
+            # 所有改寫先寫入暫存檔，處理完所有檔案後才統一 fsync 並原子替換，
+            # 舊內容保存於內容定址備份庫
+            transaction = RewriteTransaction(backup=BackupStore(working_directory))
+            
+            # 掃描所有檔案
+            files = scan_files(working_directory)
+            
+            # 更新版本號
+            updated_files = 0
+            updated_refs = 0
+            
+            for file_path in map(Path, files):
+                if _is_excluded(file_path):
+                    continue
+                try:
+                    results = consolidate_file(file_path, scanner, mapping, is_dry_run, transaction, matcher)
+                except Exception as e:
+                    log(f"處理文件時出錯: {file_path} - {str(e)}")
+                    continue
                 
-                for file_path in files:
+                applied = [r for r in results if r.applied]
+                if applied:
+                    updated_files += 1
+                    updated_refs += len(applied)
+                    for result in applied:
+                        log(f"{'[試運行] ' if is_dry_run else ''}已更新: {file_path} (第 {result.line} 行) "
+                            f"{result.old_version} -> {result.new_version}")
+            
+            # 更新version-info.json如果存在
+            try:
+                info_path = Path(working_directory) / 'version-info.json'
+                if info_path.exists():
                     try:
-                        if not _is_excluded(file_path):
-                            with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                                content = f.read()
-                            
-                            # 計算原始引用數
-                            original_refs_count = content.count(f'?v={old_version}')
-                            json_matches = len(re.findall(JSON_VERSION_PATTERN.replace('([0-9]{8}v[0-9]+)', re.escape(old_version)), content))
-                            js_matches = len(re.findall(JS_VERSION_PATTERN.replace('([0-9]{8}v[0-9]+)', re.escape(old_version)), content))
-                            total_refs = original_refs_count + json_matches + js_matches
-                            
-                            if total_refs == 0:
-                                continue
-                                
-                            # 記錄更新詳情
-                            file_specific_updates = []
-                            
-                            # 逐行檢查，提供行號信息
-                            lines = content.splitlines()
-                            for i, line in enumerate(lines):
-                                line_num = i + 1  # 1-based line numbering
-                                
-                                # 檢查各種模式
-                                if f'?v={old_version}' in line:
-                                    file_specific_updates.append(f"第 {line_num} 行")
-                                    
-                                # JSON模式
-                                if re.search(JSON_VERSION_PATTERN.replace('([0-9]{8}v[0-9]+)', re.escape(old_version)), line):
-                                    file_specific_updates.append(f"第 {line_num} 行")
-                                    
-                                # JS模式
-                                if re.search(JS_VERSION_PATTERN.replace('([0-9]{8}v[0-9]+)', re.escape(old_version)), line):
-                                    file_specific_updates.append(f"第 {line_num} 行")
-                            
-                            # 替換版本號
-                            new_content = content.replace(f'?v={old_version}', f'?v={new_version}')
+                        with open(info_path, 'r', encoding='utf-8') as f:
+                            info_content = f.read()
+                            info_data = json.loads(info_content)
                             
-                            # 修復JSON模式替換
-                            json_pattern = f'"version"\\s*:\\s*"{re.escape(old_version)}"'
-                            new_content = re.sub(json_pattern, f'"version": "{new_version}"', new_content)
+                        if 'version' in info_data:
+                            old_info_version = info_data['version']
+                            log(f"{'[試運行] ' if is_dry_run else ''}已更新 version-info.json: {old_info_version} -> {new_version}")
                             
-                            # 修復JS模式替換
-                            js_pattern = f'let\\s+appVersion\\s*=\\s*[\'\"]{re.escape(old_version)}[\'\"]'
-                            new_content = re.sub(js_pattern, f'let appVersion = "{new_version}"', new_content)
-                            
-                            if content != new_content:
-                                updated_files += 1
-                                updated_refs += total_refs
-                                
-                                # 記錄更新詳情
-                                file_update_info = f"{file_path} ({', '.join(file_specific_updates)})"
-                                detailed_updates.append(file_update_info)
-                                
-                                # 在測試模式下打印詳細信息，或實際更新文件
-                                for line_info in file_specific_updates:
-                                    log(f"{'[試運行] ' if is_dry_run else ''}已更新: {file_path} ({line_info})")
+                            if not is_dry_run:
+                                # 更新版本
+                                info_data['version'] = new_version
                                 
-                                if not is_dry_run:
-                                    # 備份原文件
-                                    backup_path = f"{file_path}.bak"
-                                    shutil.copy2(file_path, backup_path)
-                                    
-                                    # 寫入新內容
-                                    with open(file_path, 'w', encoding='utf-8') as f:
-                                        f.write(new_content)
+                                # 暫存新內容，提交時將原檔案存入備份庫
+                                transaction.stage(info_path, json.dumps(info_data, indent=2).encode('utf-8'))
                     except Exception as e:
-                        log(f"處理文件時出錯: {file_path} - {str(e)}")
-                
-                # 更新version-info.json如果存在
-                try:
-                    info_path = Path(working_directory) / 'version-info.json'
-                    if info_path.exists():
-                        try:
-                            with open(info_path, 'r', encoding='utf-8') as f:
-                                info_content = f.read()
-                                info_data = json.loads(info_content)
-                                
-                            if 'version' in info_data:
-                                old_info_version = info_data['version']
-                                log(f"{'[試運行] ' if is_dry_run else ''}已更新 version-info.json: {old_info_version} -> {new_version}")
-                                
-                                if not is_dry_run:
-                                    # 備份
-                                    shutil.copy2(info_path, f"{info_path}.bak")
-                                    
-                                    # 更新版本
-                                    info_data['version'] = new_version
-                                    
-                                    # 寫入
-                                    with open(info_path, 'w', encoding='utf-8') as f:
-                                        json.dump(info_data, f, indent=2)
-                        except Exception as e:
-                            log(f"更新 version-info.json 時出錯: {str(e)}")
-                except:
-                    pass
-                
-                result_msg = f"{'測試' if is_dry_run else ''}更新完成！已更新 {updated_files} 個文件中的 {updated_refs} 處版本號引用"
-                log(result_msg)
+                        log(f"更新 version-info.json 時出錯: {str(e)}")
+            except:
+                pass
+            
+            transaction.commit()
+            if transaction.backup.run_id:
+                log(f"原檔案已備份，備份編號: {transaction.backup.run_id}")
+            
+            result_msg = f"{'測試' if is_dry_run else ''}更新完成！已更新 {updated_files} 個文件中的 {updated_refs} 處版本號引用"
+            log(result_msg)
             
             # 計算總耗時
             duration = datetime.now() - start_time
@@ -547,6 +475,8 @@ def create_gui():
                 messagebox.showinfo("成功", f"版本更新完成！\n\n已將 {', '.join(selected_versions)} 更新為 {new_version}")
         
         except Exception as e:
+            if transaction is not None:
+                transaction.rollback()
             log(f"\n執行出錯：{str(e)}")
             messagebox.showerror("錯誤", f"執行出錯：{str(e)}")
     
@@ -577,6 +507,8 @@ def create_gui():
     print("GUI視窗已關閉")
 
 if __name__ == "__main__":
+    # 打包成執行檔後，並行掃描的工作進程需要此呼叫
+    multiprocessing.freeze_support()
     print("版本更新工具 - Windows優化版")
     print("正在啟動GUI介面...")
     create_gui() 
\ No newline at end of file
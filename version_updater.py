@@ -9,11 +9,10 @@
 """
 
 import os
-import re
 import argparse
+import contextlib
 from pathlib import Path
 from datetime import datetime
-import shutil
 import sys
 import json
 
@@ -23,161 +22,149 @@ try:
 except ImportError:
     requests = None
 
+from version_tools import (
+    PatternSpec, VersionScanner, ScanIndex, RewriteTransaction, BackupStore, since_scope,
+    walk_files, IgnoreMatcher, load_patterns, release_patterns, iter_file_scans, splice_file, VersionStats,
+    RECORD_FORMATS, RecordWriter, DeferredRecords, fingerprinted_paths
+)
+
 # 版本号正则表达式模式
 VERSION_PATTERN = r'([\?]v=)([0-9]{8}v[0-9]+)'
 
-def scan_html_files(directory='.'):
-    """扫描给定目录中的所有HTML文件"""
+# 共用扫描器，直接在映射的文件缓冲区上匹配，不解码文件内容
+SCANNER = VersionScanner((PatternSpec('query', VERSION_PATTERN, anchors=('?v=',)),))
+# 没有限定文件类型的发布位置只在会部署的文件类型中寻找
+DEPLOY_SUFFIXES = ('.html', '.js', '.css', '.json')
+
+def build_scanner(directory):
+    """将 ?v= 引用与登记档中标记为 release 的位置编译进同一个扫描器，返回 (扫描器, release 模式)
+
+    每个文件只读取、扫描一次，登记新的发布位置不需额外遍历或读取文件
+    """
+    release = tuple(spec for spec in release_patterns(load_patterns(directory)) if spec.name != 'query')
+    return VersionScanner(SCANNER.patterns + release, references=False), release
+
+def release_suffixes(release):
+    """release 模式适用的文件类型"""
+    suffixes = set()
+    for spec in release:
+        if spec.suffixes:
+            suffixes.update(spec.suffixes)
+        elif spec.paths and all(os.path.splitext(glob)[1] for glob in spec.paths):
+            suffixes.update(os.path.splitext(glob)[1] for glob in spec.paths)
+        else:
+            suffixes.update(DEPLOY_SUFFIXES)
+    return tuple(sorted(suffixes))
+
+def scan_html_files(directory='.', suffixes=('.html',)):
+    """扫描给定目录中的所有HTML文件 (或 suffixes 指定的文件类型)"""
     print(f"正在扫描目录: {directory}")
-    html_files = []
     
-    for root, _, files in os.walk(directory):
-        for file in files:
-            if file.endswith('.html'):
-                full_path = os.path.join(root, file)
-                html_files.append(full_path)
+    # 单次遍历，node_modules、.git 及 firebase.json / .gitignore 忽略的目录不会被进入
+    ignore = IgnoreMatcher.from_root(directory)
+    # 指纹文件的内容必须与文件名中的哈希一致，不改写其中的版本号
+    hashed = fingerprinted_paths(directory)
+    html_files = [
+        entry.path for entry in walk_files(directory, suffixes, ignore=ignore)
+        if Path(os.path.relpath(entry.path, directory)).as_posix() not in hashed
+    ]
     
-    print(f"找到 {len(html_files)} 个HTML文件")
+    print(f"找到 {len(html_files)} 个{'HTML' if suffixes == ('.html',) else ''}文件")
     return html_files
 
-def backup_file(file_path):
-    """创建文件备份"""
-    backup_path = f"{file_path}.bak"
-    shutil.copy2(file_path, backup_path)
-    return backup_path
+def changed_html_files(directory, since, release=()):
+    """只取得自 git 版本 since 以来变更、或引用了变更文件的HTML文件，不遍历整个目录
 
-def analyze_versions(html_files):
-    """分析所有HTML文件中的版本号"""
-    version_stats = {}
+    引用图来自与 version_update.py 共用的扫描索引，索引为空时才完整扫描一次；
+    返回 (HTML文件, 含有 release 位置的文件)，后者同样由索引取得
+    """
+    suffixes = ('.html', '.js', '.css')
+    with ScanIndex(directory, VersionScanner(load_patterns(directory))) as index:
+        changed, files = since_scope(
+            index, since, suffixes,
+            walk=lambda: [Path(f) for f in scan_html_files(directory, suffixes)]
+        )
+        release_files = [str(index.root / rel) for rel in index.files_with(spec.name for spec in release)]
     
-    for file_path in html_files:
-        try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-                versions = re.findall(VERSION_PATTERN, content)
-                
-                for _, version in versions:
-                    if version not in version_stats:
-                        version_stats[version] = {'count': 0, 'files': []}
-                    
-                    version_stats[version]['count'] += 1
-                    if file_path not in version_stats[version]['files']:
-                        version_stats[version]['files'].append(file_path)
-        except Exception as e:
-            print(f"分析文件 {file_path} 时出错: {str(e)}")
-    
-    return version_stats
+    html_files = [str(f) for f in files if f.suffix == '.html']
+    print(f"自 {since} 以来变更了 {len(changed)} 个文件，涉及 {len(html_files)} 个HTML文件")
+    return html_files, release_files
+
+def scan_files(directory, files, scanner, html_files, records=None):
+    """扫描每个文件，返回 ({文件: FileScan}, HTML文件中 ?v= 引用的 VersionStats)
+
+    使用与 version_update.py 共用的扫描索引 (状态未变的文件不需重新读取) 并行扫描；
+    FileScan 带有更新时校验偏移量用的内容哈希。每个文件扫描完成就输出其引用记录，不等待整个扫描结束
+    """
+    scans = {}
+    version_stats = VersionStats()
+    html_files = set(html_files)
+    with ScanIndex(directory, scanner) as index:
+        for file_path, scan, error in iter_file_scans(scanner, files, index):
+            if error:
+                print(f"分析文件 {file_path} 时出错: {error}")
+                continue
+            scans[file_path] = scan
+            if file_path not in html_files:
+                continue
+            # 直接累计扫描结果的 版本号 → 文件 → 行号
+            matches = [match for match in scan.matches if match.kind == 'query']
+            version_stats.add(matches)
+            for match in matches:
+                emit(records, 'reference', file=file_path, line=match.line, version=match.version,
+                     kind=match.kind)
+    return scans, version_stats
+
+def emit(records, record_type, **fields):
+    """输出一笔处理记录，records 为 None 时不做任何事"""
+    if records is not None:
+        records.emit(record_type, **fields)
+
+def update_versions(html_files, scans, release, old_version, new_version, dry_run=False,
+                    transaction=None, records=None):
+    """更新HTML文件中的旧版本号，以及登记档中标记为 release 的位置 (appVersion、CLIENT_VERSION 等)
 
-def update_versions(html_files, old_version, new_version, dry_run=False):
-    """更新所有HTML文件中的版本号"""
+    直接在扫描时记录的字节偏移写入新版本号，不再执行任何正则 (文件在扫描后被修改过时不改写并报告)；
+    每个文件只读取一次、写入一次。返回 (更新的HTML文件数, 更新的 ?v= 引用数, 更新的发布位置数)
+    """
     updated_files = 0
     updated_refs = 0
+    release_updated = 0
+    html_files = set(html_files)
+    release_kinds = {spec.name for spec in release}
     
-    for file_path in html_files:
-        file_updated = False
+    for file_path, scan in scans.items():
+        matches = [
+            match for match in scan.matches
+            if (match.kind == 'query' and match.version == old_version and file_path in html_files)
+            or (match.kind in release_kinds and match.version != new_version)
+        ]
+        if not matches:
+            continue
         try:
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-            
-            # 检查文件中是否包含旧版本号
-            if f"?v={old_version}" in content:
-                # 替换旧版本号为新版本号
-                new_content = content.replace(f"?v={old_version}", f"?v={new_version}")
-                
-                # 计算替换数量
-                count = new_content.count(f"?v={new_version}") - content.count(f"?v={new_version}")
-                updated_refs += count
-                
-                if not dry_run:
-                    # 备份原文件
-                    backup_file(file_path)
-                    
-                    # 写入新内容
-                    with open(file_path, 'w', encoding='utf-8') as file:
-                        file.write(new_content)
-                
-                file_updated = True
-                updated_files += 1
-                
-                print(f"{'[DRY RUN] ' if dry_run else ''}已更新文件: {file_path} (替换了 {count} 处引用)")
+            results = splice_file(file_path, matches, new_version, scan.digest, dry_run, transaction)
         except Exception as e:
             print(f"更新文件 {file_path} 时出错: {str(e)}")
-    
-    return updated_files, updated_refs
-
-def update_init_js(new_version, dry_run=False):
-    """更新init.js中的appVersion变量"""
-    init_js_path = os.path.join("js", "init.js")
-    
-    if not os.path.exists(init_js_path):
-        print(f"警告: 找不到 {init_js_path} 文件")
-        return False
-    
-    try:
-        with open(init_js_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-        
-        # 使用正则表达式匹配appVersion变量
-        pattern = r"(let\s+appVersion\s*=\s*['\"])([^'\"]+)(['\"])"
-        match = re.search(pattern, content)
+            continue
+        if not results:
+            continue
         
-        if match:
-            old_version = match.group(2)
-            new_content = re.sub(pattern, f"\\1{new_version}\\3", content)
-            
-            if not dry_run:
-                # 备份原文件
-                backup_file(init_js_path)
-                
-                # 写入新内容
-                with open(init_js_path, 'w', encoding='utf-8') as file:
-                    file.write(new_content)
-            
-            print(f"{'[DRY RUN] ' if dry_run else ''}已更新 init.js 中的版本号: {old_version} -> {new_version}")
-            return True
-        else:
-            print("警告: 在 init.js 中找不到 appVersion 变量")
-            return False
-    except Exception as e:
-        print(f"更新 init.js 时出错: {str(e)}")
-        return False
-
-def update_version_updater_js(new_version, dry_run=False):
-    """更新version-updater.js中的currentVersion变量"""
-    js_path = os.path.join("js", "version-updater.js")
+        refs = [result for result in results if result.kind == 'query']
+        if refs:
+            updated_files += 1
+            updated_refs += len(refs)
+            print(f"{'[DRY RUN] ' if dry_run else ''}已更新文件: {file_path} (替换了 {len(refs)} 处引用)")
+        for result in results:
+            if result.kind != 'query':
+                release_updated += 1
+                print(f"{'[DRY RUN] ' if dry_run else ''}已更新 {file_path} "
+                      f"中的 {result.kind} 版本号: {result.old_version} -> {new_version}")
+        emit(records, 'rewrite', file=file_path, dry_run=dry_run, changes=[
+            {'line': result.line, 'kind': result.kind, 'old': result.old_version, 'new': new_version}
+            for result in results
+        ])
     
-    if not os.path.exists(js_path):
-        print(f"警告: 找不到 {js_path} 文件")
-        return False
-    
-    try:
-        with open(js_path, 'r', encoding='utf-8') as file:
-            content = file.read()
-        
-        # 使用正则表达式匹配currentVersion变量
-        pattern = r"(currentVersion\s*:\s*['\"])([^'\"]+)(['\"])"
-        match = re.search(pattern, content)
-        
-        if match:
-            old_version = match.group(2)
-            new_content = re.sub(pattern, f"\\1{new_version}\\3", content)
-            
-            if not dry_run:
-                # 备份原文件
-                backup_file(js_path)
-                
-                # 写入新内容
-                with open(js_path, 'w', encoding='utf-8') as file:
-                    file.write(new_content)
-            
-            print(f"{'[DRY RUN] ' if dry_run else ''}已更新 version-updater.js 中的版本号: {old_version} -> {new_version}")
-            return True
-        else:
-            print("警告: 在 version-updater.js 中找不到 currentVersion 变量")
-            return False
-    except Exception as e:
-        print(f"更新 version-updater.js 时出错: {str(e)}")
-        return False
+    return updated_files, updated_refs, release_updated
 
 def generate_version():
     """生成新的版本号 (格式: YYYYMMDDvX)"""
@@ -236,35 +223,73 @@ def main():
     parser.add_argument("--analyze", action="store_true", help="仅分析版本号使用情况，不更新文件")
     parser.add_argument("--notes", nargs="+", help="版本更新说明，可提供多个")
     parser.add_argument("--update-firebase", action="store_true", help="更新Firebase中的版本信息")
+    parser.add_argument("--since", metavar="REF", help="只处理自 git 版本 REF 以来变更或受其影响的HTML文件")
+    parser.add_argument("--format", choices=RECORD_FORMATS, default="text",
+                        help="输出格式，json / ndjson 逐笔输出每个引用及改写的记录 (日志改为输出至 stderr)")
     
     args = parser.parse_args()
     
+    if args.format == "text":
+        run(args)
+        return
+    
+    # 记录写至 stdout，其余的日志输出转向 stderr
+    with RecordWriter(args.format, root=args.dir) as records, contextlib.redirect_stdout(sys.stderr):
+        run(args, records)
+
+def run(args, records=None):
+    """执行分析及更新"""
+    # ?v= 引用及发布位置在同一次扫描中取得
+    scanner, release = build_scanner(args.dir)
+    if not release:
+        print("警告: 登记档中没有标记为 release 的版本号位置")
+    
     # 扫描HTML文件
-    html_files = scan_html_files(args.dir)
+    if args.since:
+        try:
+            html_files, release_files = changed_html_files(args.dir, args.since, release)
+        except RuntimeError as e:
+            print(f"无法取得 git 变更: {e}")
+            emit(records, 'error', message=f"无法取得 git 变更: {e}")
+            sys.exit(1)
+        files = list(dict.fromkeys(html_files + release_files))
+    else:
+        # 单次遍历同时取得HTML文件及发布位置可能所在的文件
+        files = scan_html_files(args.dir, tuple(sorted({'.html', *release_suffixes(release)})))
+        html_files = [f for f in files if f.endswith('.html')]
     
     if not html_files:
         print("未找到HTML文件，程序退出")
+        emit(records, 'error', message="未找到HTML文件")
         sys.exit(1)
     
-    # 分析版本号使用情况
-    version_stats = analyze_versions(html_files)
+    # 扫描同时分析版本号使用情况
+    scans, version_stats = scan_files(args.dir, files, scanner, html_files, records)
     
     if not version_stats:
         print("未找到任何版本号标记，程序退出")
+        emit(records, 'error', message="未找到任何版本号标记")
         sys.exit(1)
     
     print("\n当前版本号使用情况:")
-    for version, stats in sorted(version_stats.items(), key=lambda x: x[1]['count'], reverse=True):
-        print(f"版本 {version}: 使用 {stats['count']} 次，涉及 {len(stats['files'])} 个文件")
+    for version, count in version_stats.most_common():
+        print(f"版本 {version}: 使用 {count} 次，涉及 {version_stats.file_count(version)} 个文件")
+        if args.analyze:
+            for file_path, lines in version_stats.files(version).items():
+                print(f"  {file_path}: 第 {', '.join(map(str, lines))} 行")
     
     if args.analyze:
         # 如果只是分析模式，不执行更新
+        emit(records, 'summary', mode='analyze', references=version_stats.total, versions={
+            version: {'count': count, 'files': version_stats.file_count(version)}
+            for version, count in version_stats.most_common()
+        })
         sys.exit(0)
     
     # 确定新旧版本号
     if not args.old:
         # 使用最常用的版本号作为旧版本
-        args.old = max(version_stats.items(), key=lambda x: x[1]['count'])[0]
+        args.old = version_stats.most_common(1)[0][0]
         print(f"\n自动选择最常用的版本号作为旧版本: {args.old}")
     
     if not args.new:
@@ -278,14 +303,16 @@ def main():
             print("操作已取消")
             sys.exit(0)
     
-    # 执行更新
-    updated_files, updated_refs = update_versions(html_files, args.old, args.new, args.dry_run)
-    
-    # 更新init.js
-    init_updated = update_init_js(args.new, args.dry_run)
-    
-    # 更新version-updater.js
-    updater_updated = update_version_updater_js(args.new, args.dry_run)
+    # 执行更新，所有改写先写入暂存文件，全部完成后才统一 fsync 并原子替换，
+    # 旧内容保存于内容定址备份库
+    # 改写记录待事务提交 (文件实际替换) 后才输出，事务还原时不会输出
+    deferred = DeferredRecords(records)
+    with RewriteTransaction(backup=BackupStore(args.dir)) as transaction:
+        # 同时更新登记档中每次发布都要更新的位置 (init.js、version-check.js 等)
+        updated_files, updated_refs, release_updated = update_versions(
+            html_files, scans, release, args.old, args.new, args.dry_run, transaction, deferred
+        )
+    deferred.flush()
     
     # 如果需要，更新Firebase中的版本信息
     firebase_updated = False
@@ -295,11 +322,19 @@ def main():
     # 输出结果
     print("\n更新摘要:")
     print(f"{'[DRY RUN] ' if args.dry_run else ''}已更新 {updated_files} 个文件中的 {updated_refs} 处版本引用")
-    print(f"{'[DRY RUN] ' if args.dry_run else ''}init.js 更新{'成功' if init_updated else '失败'}")
-    print(f"{'[DRY RUN] ' if args.dry_run else ''}version-updater.js 更新{'成功' if updater_updated else '失败'}")
+    print(f"{'[DRY RUN] ' if args.dry_run else ''}已更新 {release_updated} 处发布版本号位置")
     if args.update_firebase:
         print(f"{'[DRY RUN] ' if args.dry_run else ''}Firestore版本信息更新{'成功' if firebase_updated else '失败'}")
     
+    if transaction.backup.run_id:
+        print(f"原文件已备份，备份编号: {transaction.backup.run_id}")
+    
+    summary = {'old': args.old, 'new': args.new, 'files': updated_files, 'references': updated_refs,
+               'release': release_updated, 'dry_run': args.dry_run, 'backup': transaction.backup.run_id}
+    if args.update_firebase:
+        summary['firebase'] = firebase_updated
+    emit(records, 'summary', mode='update', **summary)
+    
     if not args.dry_run:
         print("\n版本更新已完成！")
         print(f"所有资源引用已从 {args.old} 更新到 {args.new}")
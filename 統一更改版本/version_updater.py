@@ -1,10 +1,131 @@
 ﻿import os
 import re
+import sys
 import tkinter as tk
 from tkinter import messagebox, ttk
 from pathlib import Path
 import concurrent.futures
-import traceback
+import multiprocessing
+
+# 共用掃描模組位於上層目錄
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from version_tools import (
+    PatternSpec, VersionScanner, ScanIndex, iter_file_scans, splice_file, walk_files, IgnoreMatcher,
+    BackgroundTask, RewriteTransaction, BackupStore
+)
+
+# 版本號模式 (版本號皆位於第1組)，錨點用於在執行正則前快速篩選檔案
+APP_PATTERNS = (
+    PatternSpec("query", r"[?&]v=(\d+v\d+)", version_group=1, anchors=("v=",)),
+    PatternSpec("const", r"const\s+\w*VERSION\w*\s*=\s*[\"'](\d+v\d+)[\"']", version_group=1,
+                anchors=("VERSION",)),
+    PatternSpec("version", r"version[\"']?\s*[:=]\s*[\"'](\d+v\d+)[\"']", version_group=1,
+                anchors=("version",)),
+    # 任何版本號都包含「數字+v」
+    PatternSpec("bare", r"(\d{8}v\d+)", version_group=1, anchors=tuple(f"{d}v" for d in "0123456789")),
+)
+
+class VirtualTreeview:
+    """只建立可見列的 Treeview
+
+    所有資料保存在 rows 列表中，Treeview 只保留填滿視窗所需的列，
+    捲動時改寫這些列的內容，結果再多也只需處理可見範圍
+    """
+
+    def __init__(self, tree, scrollbar, render_row):
+        self.tree = tree
+        self.scrollbar = scrollbar
+        # render_row(資料) 回傳該列顯示的 values
+        self.render_row = render_row
+        self.rows = []
+        self.offset = 0
+        # 可見列對應的 Treeview 項目，及項目對應的位置
+        self._items = []
+        self._slots = {}
+        self._pending = False
+
+        scrollbar.config(command=self.yview)
+        tree.bind("<Configure>", lambda event: self.refresh())
+        tree.bind("<MouseWheel>", self._on_wheel)
+        tree.bind("<Button-4>", lambda event: self.yview("scroll", -3, "units"))
+        tree.bind("<Button-5>", lambda event: self.yview("scroll", 3, "units"))
+
+    def set_rows(self, rows):
+        """替換所有資料並捲回頂端"""
+        self.rows = rows
+        self.offset = 0
+        self.refresh()
+
+    def refresh_later(self):
+        """資料持續增加時合併多次重繪"""
+        if not self._pending:
+            self._pending = True
+            self.tree.after_idle(self.refresh)
+
+    def refresh(self):
+        """依目前的捲動位置重繪可見列"""
+        self._pending = False
+        visible = self._visible_rows()
+        total = len(self.rows)
+        self.offset = max(min(self.offset, total - visible), 0)
+        count = min(visible, total - self.offset)
+
+        while len(self._items) < count:
+            item = self.tree.insert("", tk.END)
+            self._slots[item] = len(self._items)
+            self._items.append(item)
+        while len(self._items) > count:
+            item = self._items.pop()
+            del self._slots[item]
+            self.tree.delete(item)
+
+        for slot, item in enumerate(self._items):
+            self.tree.item(item, values=self.render_row(self.rows[self.offset + slot]))
+
+        if total:
+            self.scrollbar.set(self.offset / total, (self.offset + count) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+    def refresh_item(self, item):
+        """只重繪單一可見列"""
+        self.tree.item(item, values=self.render_row(self.row_at(item)))
+
+    def row_at(self, item):
+        """取得可見列對應的資料"""
+        return self.rows[self.offset + self._slots[item]]
+
+    def yview(self, *args):
+        """捲軸及滑鼠滾輪的捲動指令 ('moveto', 比例) 或 ('scroll', 數量, 'units'|'pages')"""
+        if args[0] == "moveto":
+            self.offset = int(float(args[1]) * len(self.rows))
+        elif args[0] == "scroll":
+            step = int(args[1])
+            if args[2] == "pages":
+                step *= max(len(self._items) - 1, 1)
+            self.offset += step
+        self.refresh()
+        return "break"
+
+    def _on_wheel(self, event):
+        # Windows 每格為 120，macOS 為 1
+        step = -event.delta // 120 if abs(event.delta) >= 120 else -event.delta
+        return self.yview("scroll", step * 3, "units")
+
+    def _visible_rows(self):
+        height = self.tree.winfo_height()
+        bbox = self.tree.bbox(self._items[0]) if self._items else None
+        if bbox:
+            top, row_height = bbox[1], bbox[3]
+        else:
+            # 尚未顯示任何列時，以樣式的列高估計 (標題列高度視為一列)
+            try:
+                row_height = int(ttk.Style().lookup("Treeview", "rowheight")) or 20
+            except (tk.TclError, ValueError):
+                row_height = 20
+            top = row_height
+        return max((height - top) // max(row_height, 1), 1)
+
 
 class VersionUpdaterApp:
     def __init__(self, root):
@@ -80,6 +201,28 @@ class VersionUpdaterApp:
             )
             cb.pack(anchor="w", padx=5)
         
+        # 並行掃描工作數 (0 表示使用所有CPU核心)
+        jobs_frame = tk.Frame(file_types_frame, bg=self.bg_color)
+        jobs_frame.pack(anchor="w", padx=5, pady=(5, 0))
+        
+        tk.Label(
+            jobs_frame,
+            text="並行數:",
+            font=("Microsoft JhengHei", 10),
+            bg=self.bg_color
+        ).pack(side=tk.LEFT)
+        
+        self.jobs_var = tk.IntVar(value=0)
+        self.jobs_spinbox = tk.Spinbox(
+            jobs_frame,
+            from_=0,
+            to=max(os.cpu_count() or 1, 1) * 2,
+            textvariable=self.jobs_var,
+            width=4,
+            font=("Microsoft JhengHei", 10)
+        )
+        self.jobs_spinbox.pack(side=tk.LEFT, padx=5)
+        
         # 版本號設定框架
         version_frame = tk.LabelFrame(self.control_frame, text="版本號", bg=self.bg_color, font=self.font)
         version_frame.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
@@ -173,6 +316,22 @@ class VersionUpdaterApp:
         )
         self.select_all_check.pack(side=tk.LEFT)
         
+        # 進度條及取消按鈕，掃描及更新皆在背景執行
+        self.cancel_button = tk.Button(
+            toolbar,
+            text="取消",
+            font=self.font,
+            state=tk.DISABLED,
+            command=self.cancel_task
+        )
+        self.cancel_button.pack(side=tk.RIGHT)
+        
+        self.progress = ttk.Progressbar(toolbar, mode="determinate", length=200)
+        self.progress.pack(side=tk.RIGHT, padx=5)
+        
+        self.progress_var = tk.StringVar()
+        tk.Label(toolbar, textvariable=self.progress_var, font=self.font, bg=self.bg_color).pack(side=tk.RIGHT)
+        
         # 創建Treeview
         self.tree_frame = tk.Frame(list_frame)
         self.tree_frame.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
@@ -187,12 +346,12 @@ class VersionUpdaterApp:
             self.tree_frame,
             columns=("selected", "version", "file", "line"),
             show="headings",
-            yscrollcommand=self.tree_yscroll.set,
             xscrollcommand=self.tree_xscroll.set
         )
         
-        self.tree_yscroll.config(command=self.versions_tree.yview)
+        # 垂直捲動由虛擬列表處理，Treeview 只保留可見的列
         self.tree_xscroll.config(command=self.versions_tree.xview)
+        self.versions_view = VirtualTreeview(self.versions_tree, self.tree_yscroll, self.render_entry)
         
         # 設定列標題
         self.versions_tree.heading("selected", text="選擇")
@@ -231,6 +390,13 @@ class VersionUpdaterApp:
         # 初始化工作目錄和版本列表
         self.working_dir = Path(self.working_dir_var.get())
         self.version_entries = []
+        self.entries_by_id = {}
+        # 選擇狀態 = 全選狀態，但 toggled 中的項目相反；全選只需清空 toggled
+        self.select_all_state = True
+        self.toggled = set()
+        self.scanner = VersionScanner(APP_PATTERNS)
+        # 目前執行中的背景工作
+        self.task = None
         
         # 初始化日誌
         self.log("請先設定目前版本號或直接掃描搜尋所有版本")
@@ -277,206 +443,211 @@ class VersionUpdaterApp:
             pass  # 靜默失敗，不影響用戶體驗
     
     def get_selected_file_types(self):
-        """獲取選中的檔案類型列表"""
-        patterns = []
+        """獲取選中的副檔名列表"""
+        suffixes = []
         
         if self.file_types["HTML (.html)"].get():
-            patterns.extend(["**/*.html", "**/*.htm"])
+            suffixes.extend([".html", ".htm"])
         
         if self.file_types["JS (.js)"].get():
-            patterns.append("**/*.js")
+            suffixes.append(".js")
         
         if self.file_types["CSS (.css)"].get():
-            patterns.append("**/*.css")
+            suffixes.append(".css")
         
-        return patterns
+        return suffixes
     
-    def scan_versions(self):
-        """掃描工作目錄中所有檔案尋找版本號"""
-        try:
-            # 禁用按鈕，防止重複操作
-            self.scan_button.config(state=tk.DISABLED)
-            self.update_button.config(state=tk.DISABLED)
-            
-            # 更新UI
-            self.root.update()
-            
-            try:
-                # 檢查是否有選擇檔案類型
-                file_patterns = self.get_selected_file_types()
-                if not file_patterns:
-                    messagebox.showerror("錯誤", "請至少選擇一種檔案類型進行掃描")
-                    return
-                
-                # 更新工作目錄
-                dir_path = self.working_dir_var.get()
-                if not os.path.isdir(dir_path):
-                    messagebox.showerror("錯誤", f"工作目錄無效: {dir_path}")
-                    return
-                    
-                self.working_dir = Path(dir_path)
-                
-                # 是否搜尋特定版本
-                specific_version = self.current_ver_var.get()
-                search_specific = bool(specific_version)
-                
-                self.log(f"開始掃描 {self.working_dir}")
-                
-                # 清空版本列表
-                self.versions_tree.delete(*self.versions_tree.get_children())
-                self.version_entries = []
-                
-                # 獲取所有符合條件的檔案
-                all_files = []
-                for pattern in file_patterns:
-                    all_files.extend(list(self.working_dir.glob(pattern)))
-                
-                # 去除重複檔案並限制數量
-                all_files = list(set(all_files))[:1000]  # 限制最多掃描1000個檔案
-                self.log(f"找到 {len(all_files)} 個檔案")
-                
-                # 更新UI
-                self.root.update()
-                
-                # 使用線程池加速掃描
-                results = []
-                with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                    future_to_file = {}
-                    for file in all_files:
-                        future = executor.submit(self.find_versions_in_file, file, specific_version)
-                        future_to_file[future] = file
-                        
-                    total = len(future_to_file)
-                    done = 0
-                    
-                    for future in concurrent.futures.as_completed(future_to_file):
-                        file_results = future.result()
-                        if file_results:
-                            results.extend(file_results)
-                        
-                        # 更新進度
-                        done += 1
-                        if done % 10 == 0:  # 每掃描10個檔案更新一次進度
-                            self.log(f"掃描進度: {done}/{total}")
-                            self.root.update()
-                
-                # 對結果進行去重和排序
-                unique_versions = set()
-                sorted_results = []
-                
-                for result in results:
-                    version_key = (result["file"], result["line"], result["version"])
-                    if version_key not in unique_versions:
-                        unique_versions.add(version_key)
-                        sorted_results.append(result)
-                
-                # 按版本號排序
-                sorted_results.sort(key=lambda x: x["version"])
-                
-                # 填充樹狀列表
-                for result in sorted_results:
-                    rel_path = os.path.relpath(result["file"], self.working_dir)
-                    item_id = self.versions_tree.insert("", tk.END, values=("✓", result["version"], rel_path, result["line"]))
-                    # 儲存額外資訊以供後續更新使用
-                    self.version_entries.append({
-                        "id": item_id,
-                        "selected": True,
-                        "version": result["version"],
-                        "file": result["file"],
-                        "line": result["line"]
-                    })
-                
-                # 設定建議的新版本號 (如果未設定)
-                if sorted_results and not self.new_ver_var.get():
-                    # 使用第一個版本號作為基礎
-                    first_version = sorted_results[0]["version"]
-                    parts = first_version.split("v")
-                    if len(parts) == 2:
-                        date_part = parts[0]
-                        version_num = int(parts[1])
-                        next_version = f"{date_part}v{version_num + 1}"
-                        self.new_ver_var.set(next_version)
-                
-                self.log(f"掃描完成，找到 {len(sorted_results)} 個版本號")
-                
-            except Exception as e:
-                self.log(f"掃描過程中發生錯誤: {str(e)}")
-                messagebox.showerror("錯誤", f"掃描過程中發生錯誤: {str(e)}")
-                
-        finally:
+    def start_task(self, work, handlers, on_done):
+        """在背景執行 work，執行期間停用按鈕並顯示進度
+
+        on_done(狀態, 結果) 在主執行緒呼叫，狀態為 'done'、'cancelled' 或 'error'
+        """
+        if self.task is not None and self.task.running:
+            return
+        
+        def finish(status, result):
+            self.task = None
             # 重新啟用按鈕
             self.scan_button.config(state=tk.NORMAL)
             self.update_button.config(state=tk.NORMAL)
+            self.cancel_button.config(state=tk.DISABLED)
+            self.progress_var.set({"done": "完成", "cancelled": "已取消", "error": "發生錯誤"}[status])
+            on_done(status, result)
+        
+        # 禁用按鈕，防止重複操作
+        self.scan_button.config(state=tk.DISABLED)
+        self.update_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.progress.config(value=0, maximum=1)
+        self.progress_var.set("")
+        
+        handlers = dict(handlers, log=self.log, progress=self.show_progress)
+        self.task = BackgroundTask(self.root, work, handlers, finish).start()
     
-    def find_versions_in_file(self, file_path, specific_version=None):
-        """在單一檔案中尋找版本號 (簡化版)"""
-        try:
-            results = []
+    def cancel_task(self):
+        """取消目前的背景工作"""
+        if self.task is not None:
+            self.task.cancel()
+            self.progress_var.set("正在取消...")
+    
+    def show_progress(self, payload):
+        """更新進度條，payload 為 (已完成數, 總數)"""
+        done, total = payload
+        self.progress.config(value=done, maximum=max(total, 1))
+        self.progress_var.set(f"{done}/{total}")
+    
+    def scan_versions(self):
+        """在背景掃描工作目錄中所有檔案尋找版本號，結果逐批加入列表"""
+        # 檢查是否有選擇檔案類型
+        suffixes = self.get_selected_file_types()
+        if not suffixes:
+            messagebox.showerror("錯誤", "請至少選擇一種檔案類型進行掃描")
+            return
+        
+        # 更新工作目錄
+        dir_path = self.working_dir_var.get()
+        if not os.path.isdir(dir_path):
+            messagebox.showerror("錯誤", f"工作目錄無效: {dir_path}")
+            return
             
-            # 使用更簡單快速的方式先篩選檔案
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                content = f.read(50000)  # 只讀取前50000字符提高速度
-                
-                # 如果是特定版本搜尋，先快速檢查
-                if specific_version and specific_version not in content:
-                    return []
-                
-                # 如果是搜尋所有版本，先快速檢查是否包含可能的版本格式
-                if not specific_version and not re.search(r"\d{6,8}v\d+", content):
-                    return []
+        self.working_dir = Path(dir_path)
+        working_dir = self.working_dir
+        
+        # 是否搜尋特定版本
+        specific_version = self.current_ver_var.get() or None
+        jobs = self.get_jobs()
+        
+        self.log(f"開始掃描 {working_dir}")
+        
+        # 清空版本列表
+        self.version_entries = []
+        self.entries_by_id = {}
+        self.select_all_state = True
+        self.toggled.clear()
+        self.select_all_var.set(True)
+        self.versions_view.set_rows(self.version_entries)
+        seen = set()
+        
+        def work(task):
+            # 單次走訪比對所有副檔名，node_modules、.git 及 firebase.json / .gitignore
+            # 忽略的目錄不會被進入，也不會產生重複檔案 (檔案以串流方式掃描，不限制數量及大小)
+            ignore = IgnoreMatcher.from_root(working_dir)
+            all_files = list(walk_files(working_dir, suffixes, ignore=ignore))
+            task.post("log", f"找到 {len(all_files)} 個檔案")
             
-            # 如果初步檢查通過，再進行詳細的行搜尋
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                lines = f.readlines()
-                
-            # 減少正則表達式模式，提高速度
-            patterns = [
-                r"[?&]v=(\d+v\d+)",
-                r"const\s+\w*VERSION\w*\s*=\s*[\"'](\d+v\d+)[\"']",
-                r"version[\"']?\s*[:=]\s*[\"'](\d+v\d+)[\"']",
-                r"(\d{8}v\d+)"
-            ]
+            # 使用掃描索引，未變更的檔案不需重新讀取；索引在背景執行緒中建立及使用
+            index = ScanIndex(working_dir, self.scanner)
+            total = len(all_files)
+            try:
+                # 使用並行掃描後端，依檔案數量自動選擇進程池或線程池
+                # 保留每個檔案的內容雜湊，更新時據此確認記錄的偏移量仍然有效
+                scan = iter_file_scans(self.scanner, all_files, index, jobs)
+                for done, (file, file_scan, error) in enumerate(scan, 1):
+                    task.check_cancelled()
+                    matches = file_scan.select(specific_version) if file_scan is not None else []
+                    if matches:
+                        task.post("matches", [
+                            self.result_from_match(match, file_scan.digest) for match in matches
+                        ])
+                    task.post("progress", (done, total))
+            finally:
+                index.save()
+        
+        def add_matches(results):
+            # 去重後直接加入列表，不等待整個掃描完成；相對路徑只在此計算一次
+            for result in results:
+                version_key = (result["file"], result["match"].start)
+                if version_key in seen:
+                    continue
+                seen.add(version_key)
+                entry = {
+                    "id": len(self.version_entries),
+                    "version": result["version"],
+                    "file": result["file"],
+                    "rel": os.path.relpath(result["file"], working_dir),
+                    "line": result["line"],
+                    "match": result["match"],
+                    "digest": result["digest"]
+                }
+                self.version_entries.append(entry)
+                self.entries_by_id[entry["id"]] = entry
+            self.versions_view.refresh_later()
+        
+        def done(status, error):
+            if status == "error":
+                self.log(f"掃描過程中發生錯誤: {str(error)}")
+                messagebox.showerror("錯誤", f"掃描過程中發生錯誤: {str(error)}")
+                return
             
-            for line_num, line in enumerate(lines, 1):
-                # 如果是特定版本搜尋，快速檢查
-                if specific_version:
-                    if specific_version in line:
-                        for pattern in patterns:
-                            matches = re.finditer(pattern, line)
-                            for match in matches:
-                                version = match.group(1)
-                                if version == specific_version:
-                                    results.append({
-                                        "file": str(file_path),
-                                        "line": line_num,
-                                        "version": version
-                                    })
-                else:
-                    # 搜尋所有版本
-                    for pattern in patterns:
-                        matches = re.finditer(pattern, line)
-                        for match in matches:
-                            version = match.group(1)
-                            if re.match(r"^\d+v\d+$", version):
-                                results.append({
-                                    "file": str(file_path),
-                                    "line": line_num,
-                                    "version": version
-                                })
+            # 按版本號排序
+            self.version_entries.sort(key=lambda x: x["version"])
+            self.versions_view.refresh()
             
-            return results
+            if status == "cancelled":
+                self.log(f"掃描已取消，目前找到 {len(self.version_entries)} 個版本號")
+                return
+            
+            # 設定建議的新版本號 (如果未設定)
+            if self.version_entries and not self.new_ver_var.get():
+                # 使用第一個版本號作為基礎
+                first_version = self.version_entries[0]["version"]
+                parts = first_version.split("v")
+                if len(parts) == 2:
+                    date_part = parts[0]
+                    version_num = int(parts[1])
+                    next_version = f"{date_part}v{version_num + 1}"
+                    self.new_ver_var.set(next_version)
+            
+            self.log(f"掃描完成，找到 {len(self.version_entries)} 個版本號")
+        
+        self.start_task(work, {"matches": add_matches}, done)
+    
+    def get_jobs(self):
+        """獲取並行掃描工作數，輸入無效時使用所有CPU核心"""
+        try:
+            return max(int(self.jobs_var.get()), 0)
+        except (tk.TclError, ValueError):
+            return 0
+    
+    @staticmethod
+    def result_from_match(match, digest=None):
+        """將掃描結果轉換為版本列表使用的字典，digest 為掃描時檔案內容的雜湊"""
+        return {
+            "file": str(match.file),
+            "line": match.line,
+            "version": match.version,
+            "match": match,
+            "digest": digest
+        }
+    
+    def find_versions_in_file(self, file_path, specific_version=None, index=None):
+        """在單一檔案中尋找版本號"""
+        try:
+            source = index if index is not None else self.scanner
+            matches = source.scan_file(file_path, specific_version or None)
+            return [self.result_from_match(match) for match in matches]
         except Exception:
             return []  # 靜默失敗，提高穩定性
     
+    def is_selected(self, entry):
+        """項目是否被選擇"""
+        return (entry["id"] in self.toggled) != self.select_all_state
+    
+    def render_entry(self, entry):
+        """列表中一列顯示的內容"""
+        return ("✓" if self.is_selected(entry) else "□", entry["version"], entry["rel"], entry["line"])
+    
+    def selected_entries(self):
+        """所有選定的項目 (依列表順序)"""
+        if self.select_all_state:
+            return [entry for entry in self.version_entries if entry["id"] not in self.toggled]
+        return sorted((self.entries_by_id[entry_id] for entry_id in self.toggled), key=lambda x: x["version"])
+    
     def toggle_select_all(self):
-        """切換全選/取消全選"""
-        select_all = self.select_all_var.get()
-        
-        for entry in self.version_entries:
-            entry["selected"] = select_all
-            self.versions_tree.item(entry["id"], values=("✓" if select_all else "□", entry["version"], 
-                                                      os.path.relpath(entry["file"], self.working_dir), 
-                                                      entry["line"]))
+        """切換全選/取消全選，只需重繪可見的列"""
+        self.select_all_state = self.select_all_var.get()
+        self.toggled.clear()
+        self.versions_view.refresh()
     
     def on_tree_click(self, event):
         """處理樹狀列表點擊事件"""
@@ -487,128 +658,131 @@ class VersionUpdaterApp:
             
             # 只處理第一列（選擇欄）的點擊
             if column == "#1" and item_id:
-                # 找到對應的條目
-                for entry in self.version_entries:
-                    if entry["id"] == item_id:
-                        # 切換選擇狀態
-                        entry["selected"] = not entry["selected"]
-                        self.versions_tree.item(item_id, values=("✓" if entry["selected"] else "□", 
-                                                              entry["version"], 
-                                                              os.path.relpath(entry["file"], self.working_dir), 
-                                                              entry["line"]))
-                        break
+                # 切換選擇狀態
+                entry = self.versions_view.row_at(item_id)
+                self.toggled ^= {entry["id"]}
+                
+                # 所有項目都反轉時等同切換全選狀態
+                if len(self.toggled) == len(self.version_entries):
+                    self.select_all_state = not self.select_all_state
+                    self.toggled.clear()
+                    self.versions_view.refresh()
+                else:
+                    self.versions_view.refresh_item(item_id)
                 
                 # 更新全選狀態
-                all_selected = all(entry["selected"] for entry in self.version_entries)
-                self.select_all_var.set(all_selected)
+                self.select_all_var.set(self.select_all_state and not self.toggled)
     
-    def update_file_version(self, file_path, line_num, old_version, new_version):
-        """更新單一檔案中的特定版本號 (簡化版)"""
-        try:
-            with open(file_path, "r", encoding="utf-8", errors="ignore") as f:
-                lines = f.readlines()
-            
-            if 1 <= line_num <= len(lines):
-                line = lines[line_num - 1]
-                
-                # 直接替換版本號，簡化處理
-                updated_line = line.replace(old_version, new_version)
-                
-                # 如果有變更，更新檔案
-                if updated_line != line:
-                    lines[line_num - 1] = updated_line
-                    with open(file_path, "w", encoding="utf-8", errors="ignore") as f:
-                        f.writelines(lines)
-                    return True
-            
-            return False
-        except Exception:
-            return False  # 靜默失敗
+    def update_file_version(self, file_path, entries, new_version, transaction):
+        """在掃描時記錄的位元組偏移直接寫入新版本號，回傳更新的版本號數量
+
+        同一檔案的所有項目一次處理，只讀取一次，新內容暫存於 transaction 待提交；
+        檔案在掃描後被修改過時拋出 ValueError (須重新掃描)
+        """
+        results = splice_file(
+            file_path,
+            [entry["match"] for entry in entries],
+            new_version,
+            entries[0]["digest"],
+            transaction=transaction
+        )
+        return sum(1 for result in results if result.applied)
     
     def update_versions(self):
-        """更新所有選定的版本號"""
-        try:
-            # 禁用按鈕，防止重複操作
-            self.scan_button.config(state=tk.DISABLED)
-            self.update_button.config(state=tk.DISABLED)
-            
-            new_version = self.new_ver_var.get()
-            
-            if not new_version:
-                messagebox.showerror("錯誤", "請輸入新版本號")
-                return
-                
-            # 確認版本格式
-            if not re.match(r"^\d+v\d+$", new_version):
-                messagebox.showerror("錯誤", "新版本號格式錯誤，請使用類似 YYYYMMDDv1 的格式")
-                return
-            
-            # 獲取選定的項目
-            selected_entries = [entry for entry in self.version_entries if entry["selected"]]
-            
-            if not selected_entries:
-                messagebox.showinfo("提示", "請至少選擇一個版本號進行更新")
-                return
-            
-            # 確認用戶是否要更新
-            if not messagebox.askyesno("確認", f"確定要將選定的 {len(selected_entries)} 個版本號更新為 {new_version} 嗎？"):
-                return
-            
-            self.log(f"開始更新 {len(selected_entries)} 個版本號")
+        """在背景更新所有選定的版本號"""
+        new_version = self.new_ver_var.get()
+        
+        if not new_version:
+            messagebox.showerror("錯誤", "請輸入新版本號")
+            return
             
-            # 使用線程池加速更新
+        # 確認版本格式
+        if not re.match(r"^\d+v\d+$", new_version):
+            messagebox.showerror("錯誤", "新版本號格式錯誤，請使用類似 YYYYMMDDv1 的格式")
+            return
+        
+        # 獲取選定的項目
+        selected_entries = self.selected_entries()
+        
+        if not selected_entries:
+            messagebox.showinfo("提示", "請至少選擇一個版本號進行更新")
+            return
+        
+        # 確認用戶是否要更新
+        if not messagebox.askyesno("確認", f"確定要將選定的 {len(selected_entries)} 個版本號更新為 {new_version} 嗎？"):
+            return
+        
+        self.log(f"開始更新 {len(selected_entries)} 個版本號")
+        
+        # 按檔案分組，每個檔案只讀寫一次
+        entries_by_file = {}
+        for entry in selected_entries:
+            entries_by_file.setdefault(entry["file"], []).append(entry)
+        
+        working_dir = self.working_dir
+        
+        def work(task):
+            # 所有改寫先寫入暫存檔，全部完成後才統一原子替換，舊內容保存於內容定址備份庫；
+            # 取消或出錯時捨棄所有暫存檔，檔案維持原狀
             updated_count = 0
-            with concurrent.futures.ThreadPoolExecutor(max_workers=5) as executor:
-                futures = []
+            with RewriteTransaction(backup=BackupStore(working_dir)) as transaction:
+                # 使用線程池加速更新，每個檔案由一個工作者處理
+                executor = concurrent.futures.ThreadPoolExecutor(max_workers=5)
+                try:
+                    futures = {
+                        executor.submit(self.update_file_version, file_path, entries, new_version, transaction): file_path
+                        for file_path, entries in entries_by_file.items()
+                    }
+                    
+                    total = len(futures)
+                    for done, future in enumerate(concurrent.futures.as_completed(futures), 1):
+                        try:
+                            updated_count += future.result()
+                        except Exception as e:
+                            task.post("log", f"更新檔案 {futures[future]} 時出錯: {str(e)}")
+                        task.check_cancelled()
+                        task.post("progress", (done, total))
+                finally:
+                    # 取消時尚未開始的更新不再執行
+                    executor.shutdown(wait=True, cancel_futures=True)
+                task.check_cancelled()
+            return updated_count, transaction.backup.run_id
+        
+        def done(status, result):
+            if status == "error":
+                self.log(f"更新過程中發生錯誤: {str(result)}")
+                messagebox.showerror("錯誤", f"更新過程中發生錯誤: {str(result)}")
+            elif status == "cancelled":
+                # 暫存的改寫已全部捨棄，檔案維持原狀
+                self.log("更新已取消，所有檔案維持原狀")
+            else:
+                updated_count, run_id = result
+                if run_id:
+                    self.log(f"原檔案已備份，備份編號: {run_id}")
                 
-                for entry in selected_entries:
-                    futures.append(
-                        executor.submit(
-                            self.update_file_version, 
-                            entry["file"], 
-                            entry["line"], 
-                            entry["version"], 
-                            new_version
-                        )
-                    )
+                # 更新當前版本
+                self.current_ver_var.set(new_version)
                 
-                total = len(futures)
-                done = 0
+                # 設定下一個版本號建議
+                parts = new_version.split("v")
+                if len(parts) == 2:
+                    date_part = parts[0]
+                    version_num = int(parts[1])
+                    next_version = f"{date_part}v{version_num + 1}"
+                    self.new_ver_var.set(next_version)
                 
-                for future in concurrent.futures.as_completed(futures):
-                    if future.result():
-                        updated_count += 1
-                    
-                    # 更新進度
-                    done += 1
-                    if done % 10 == 0:  # 每更新10個檔案更新一次進度
-                        self.log(f"更新進度: {done}/{total}")
-                        self.root.update()
-            
-            # 更新當前版本
-            self.current_ver_var.set(new_version)
-            
-            # 設定下一個版本號建議
-            parts = new_version.split("v")
-            if len(parts) == 2:
-                date_part = parts[0]
-                version_num = int(parts[1])
-                next_version = f"{date_part}v{version_num + 1}"
-                self.new_ver_var.set(next_version)
-            
-            # 完成訊息
-            self.log(f"更新完成！成功更新 {updated_count} 個版本號")
-            messagebox.showinfo("完成", f"版本更新完成！\n成功更新 {updated_count} 個版本號")
+                # 完成訊息
+                self.log(f"更新完成！成功更新 {updated_count} 個版本號")
+                messagebox.showinfo("完成", f"版本更新完成！\n成功更新 {updated_count} 個版本號")
             
             # 重新掃描
             self.scan_versions()
-            
-        finally:
-            # 重新啟用按鈕
-            self.scan_button.config(state=tk.NORMAL)
-            self.update_button.config(state=tk.NORMAL)
+        
+        self.start_task(work, {}, done)
 
 if __name__ == "__main__":
+    # 打包成執行檔後，並行掃描的工作進程需要此呼叫
+    multiprocessing.freeze_support()
     try:
         root = tk.Tk()
         app = VersionUpdaterApp(root)
@@ -3,7 +3,7 @@
 
 a = Analysis(
     ['version_updater.py'],
-    pathex=[],
+    pathex=['..'],
     binaries=[],
     datas=[],
     hiddenimports=[],